@@ -0,0 +1,138 @@
+"""
+Generators for large synthetic benchmark fixtures.
+"""
+
+import gzip
+import json
+import random
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from pathlib import Path
+
+from fake_imap import FakeImap
+
+RANDOM_SEED = 42
+SENTENCE = "the quick brown fox jumps over the lazy dog while the borg archives keep growing"
+
+
+def hostnames(count: int) -> list[str]:
+    return [f"host{no:03d}.example.org" for no in range(count)]
+
+
+def borg_listing(archives: int, hosts: int = 50, end: datetime = datetime(2024, 6, 1)) -> str:
+    """
+    Returns:
+        The output of `borg list --json` for a repository with the given number of archives (one archive per
+        host and day, most recent last).
+    """
+    names = hostnames(hosts)
+    listing = []
+    for no in range(archives):
+        start = end - timedelta(days=(archives - no) // hosts, seconds=no % 3600)
+        name = f"{names[no % hosts]}.{start:%Y-%m-%d}"
+        listing.append({"archive": name, "name": name, "start": f"{start:%Y-%m-%dT%H:%M:%S.%f}"})
+    return json.dumps({"archives": listing})
+
+
+def automysqlbackup_tree(path: Path, databases: int, days: int, end: datetime = datetime(2024, 6, 1)) -> int:
+    """
+    Create an automysqlbackup archive with daily, weekly and monthly dumps of the given databases.
+
+    Returns:
+        The number of created dump files.
+    """
+    files = 0
+    for db in range(databases):
+        name = f"db{db:04d}"
+        for period in ("daily", "weekly", "monthly"):
+            directory = path / period / name
+            directory.mkdir(parents=True, exist_ok=True)
+            step = {"daily": 1, "weekly": 7, "monthly": 30}[period]
+            for day in range(0, days, step):
+                date = end - timedelta(days=day)
+                if period == "weekly":
+                    filename = f"{name}_week.{date.isocalendar()[1]}.{date:%Y-%m-%d}_05h29m.sql.gz"
+                else:
+                    filename = f"{name}_{date:%Y-%m-%d}_06h25m.{date:%A}.sql.gz"
+                (directory / filename).touch()
+                files += 1
+    return files
+
+
+def tls_report(report_id: str, reporter: str, domain: str, successful: int, failure: int) -> bytes:
+    msg = EmailMessage()
+    msg["Subject"] = f"Report Domain: {domain} Submitter: {reporter} Report-ID: <{report_id}>"
+    msg.set_content("TLS report")
+    report = {
+        "organization-name": reporter,
+        "contact-info": f"tlsrpt@{reporter}",
+        "report-id": report_id,
+        "policies": [
+            {
+                "policy": {"policy-type": "sts", "policy-domain": domain},
+                "summary": {"total-successful-session-count": successful, "total-failure-session-count": failure},
+                "failure-details": [
+                    {"result-type": "certificate-expired", "sending-mta-ip": f"10.0.0.{no}", "failed-session-count": 1}
+                    for no in range(failure)
+                ],
+            }
+        ],
+    }
+    msg.add_attachment(
+        gzip.compress(json.dumps(report).encode("utf-8")),
+        maintype="application",
+        subtype="tlsrpt+gzip",
+        filename=f"{report_id}.json.gz",
+    )
+    return msg.as_bytes()
+
+
+def tls_report_mailbox(reports: int, domains: int = 20) -> FakeImap:
+    """
+    Returns:
+        A local IMAP stand-in that serves the given number of TLS-RPT mails.
+    """
+    rnd = random.Random(RANDOM_SEED)
+    imap = FakeImap()
+    for uid in range(1, reports + 1):
+        reporter = rnd.choice(("google.com", "microsoft.com", "yahoo.com", "example.net"))
+        domain = f"domain{rnd.randrange(domains)}.example.org"
+        failure = rnd.choice((0, 0, 0, 1, 5))
+        imap.add(uid, tls_report(f"report-{uid}", reporter, domain, rnd.randrange(1000), failure))
+    return imap
+
+
+def kindle_texts(count: int) -> list[str]:
+    """
+    Returns:
+        Kindle quote mails (text/plain) with the quote between the greeting and the share links.
+    """
+    rnd = random.Random(RANDOM_SEED)
+    words = SENTENCE.split()
+    texts = []
+    for no in range(count):
+        quote = " ".join(rnd.choice(words) for _ in range(rnd.randrange(20, 80)))
+        texts.append(
+            f'Hello reader,\n\nyou shared a quote from book {no}:\n\n"{quote[:60]}\n{quote[60:]} ({no})"\n\n'
+            f"Start reading: https://amzn.eu/d/{no:08x}\nGet the app: https://amzn.to/{no:08x}\n"
+        )
+    return texts
+
+
+def wg_dump(interfaces: int, peers: int = 20, now: int = 1_717_200_000) -> str:
+    """
+    Returns:
+        The output of `wg show all dump` for the given number of interfaces and peers per interface.
+    """
+    lines = []
+    for interface in range(interfaces):
+        name = f"wg{interface}"
+        lines.append(f"{name}\tPRIVATE{interface:036d}=\tPUBLIC{interface:037d}=\t{51820 + interface}\toff")
+        for peer in range(peers):
+            public_key = f"PEER{interface:020d}{peer:019d}="
+            endpoint = f"192.0.2.{peer}:{51820 + peer}" if peer % 4 else "(none)"
+            handshake = now - peer * 30 if peer % 4 else 0
+            lines.append(
+                f"{name}\t{public_key}\t(none)\t{endpoint}\t10.{interface}.{peer}.0/24\t{handshake}\t1024\t2048\t25"
+            )
+    return "\n".join(lines) + "\n"
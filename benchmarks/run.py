@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Benchmark the hot paths of the monitors on large synthetic fixtures.
+
+Usage:
+    python benchmarks/run.py [--scale 1.0] [--filter NAME] [--update-baseline]
+
+Every benchmark reports its best runtime, throughput (items per second) and peak memory (tracemalloc). The
+run fails, if a benchmark is slower or needs more memory than its entry in baseline.json permits.
+Baselines are only compared for runs with the same number of items (i.e., the same scale).
+"""
+
+import argparse
+import os
+import sys
+import tracemalloc
+from collections.abc import Callable
+from datetime import datetime
+from json import dump, load, loads
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, NamedTuple
+from unittest.mock import MagicMock, patch
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path[:0] = [str(ROOT_DIR / "src"), str(ROOT_DIR / "tests")]
+
+import fixtures  # noqa: E402
+
+from cronvisio.monitor.amazon_kindle_quotes import AmazonKindleQuotes  # noqa: E402
+from cronvisio.monitor.automysqlbackup import AutoMysqlBackup  # noqa: E402
+from cronvisio.monitor.borgbackup import BorgBackupMonitor  # noqa: E402
+from cronvisio.monitor.tlsreport import TLSReportMonitor  # noqa: E402
+from cronvisio.monitor.wireguard import WireguardMonitor  # noqa: E402
+from fake_borg import create_repository, install_fake_borg  # noqa: E402
+from fake_imap import FakeSessionPool  # noqa: E402
+
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+TIME_TOLERANCE = 1.5
+MEMORY_TOLERANCE = 1.25
+REPEAT = 3
+NOW = datetime(2024, 6, 1)
+
+
+class Result(NamedTuple):
+    items: int
+    seconds: float
+    peak_memory: int
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.seconds if self.seconds else float("inf")
+
+
+# name -> setup(tmp_dir, scale), which returns the benchmarked callable and the number of processed items
+BENCHMARKS: dict[str, Callable[[Path, float], tuple[Callable[[], Any], int]]] = {}
+
+
+def benchmark(name: str):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+@benchmark("borgbackup.parse_borgbackup_output")
+def borg_parse_json(tmp_dir: Path, scale: float):
+    archives = int(100_000 * scale)
+    listing = fixtures.borg_listing(archives)
+    monitor = BorgBackupMonitor(archive_path=tmp_dir, max_age=7, cache_file=None)
+    return lambda: monitor.parse_borgbackup_output(listing, current_date=NOW), archives
+
+
+@benchmark("borgbackup.filter_archives")
+def borg_filter_archives(tmp_dir: Path, scale: float):
+    archives = int(100_000 * scale)
+    listing = [[archive["start"], archive["name"]] for archive in loads(fixtures.borg_listing(archives))["archives"]]
+    hosts = fixtures.hostnames(50)
+    monitor = BorgBackupMonitor(archive_path=tmp_dir, max_age=7, cache_file=None)
+    return lambda: monitor.filter_archives(listing, hosts, current_date=NOW), archives
+
+
+def borg_repository(tmp_dir: Path, archives: int) -> tuple[Path, Callable[..., Any]]:
+    """
+    Returns:
+        A repository with the given number of archives and a function that runs get_backups on it with a fake
+        borg executable (see test_borgbackup.py), which serves the repository's listing.
+    """
+    bin_dir = install_fake_borg(tmp_dir / "bin")
+    listing = loads(fixtures.borg_listing(archives))["archives"]
+    repository = create_repository(tmp_dir / "archives" / "repo", listing)
+    monitor = BorgBackupMonitor(archive_path=tmp_dir / "archives", max_age=7, cache_file=None)
+
+    def get_backups(cache: dict | None = None):
+        with patch.dict(os.environ, {"PATH": f"{bin_dir}{os.pathsep}{os.environ['PATH']}"}):
+            return monitor.get_backups(repository, cache, current_date=NOW)
+
+    return repository, get_backups
+
+
+@benchmark("borgbackup.get_backups (complete listing)")
+def borg_get_backups(tmp_dir: Path, scale: float):
+    archives = int(100_000 * scale)
+    _, get_backups = borg_repository(tmp_dir, archives)
+    return get_backups, archives
+
+
+@benchmark("borgbackup.get_backups (--last listing)")
+def borg_get_backups_last(tmp_dir: Path, scale: float):
+    archives = int(100_000 * scale)
+    repository, get_backups = borg_repository(tmp_dir, archives)
+    cache = {}
+    get_backups(cache)
+    entry = cache[str(repository)]
+
+    def get_recent_backups():
+        # a new transaction changed the repository since the last run
+        return get_backups({str(repository): {**entry, "fingerprint": None}})
+
+    return get_recent_backups, len(entry["archives"])
+
+
+@benchmark("automysqlbackup.notify (cold)")
+def automysqlbackup_cold(tmp_dir: Path, scale: float):
+    files = fixtures.automysqlbackup_tree(tmp_dir / "backups", databases=int(200 * scale), days=60)
+    monitor = AutoMysqlBackup(tmp_dir / "backups", max_age=2, date=NOW, index_file=None)
+    return lambda: monitor.notify(force=True), files
+
+
+@benchmark("automysqlbackup.notify (indexed)")
+def automysqlbackup_indexed(tmp_dir: Path, scale: float):
+    files = fixtures.automysqlbackup_tree(tmp_dir / "backups", databases=int(200 * scale), days=60)
+    monitor = AutoMysqlBackup(tmp_dir / "backups", max_age=2, date=NOW, index_file=str(tmp_dir / "index"))
+    monitor.notify(force=True)
+    return lambda: monitor.notify(force=True), files
+
+
+def tls_report_monitor(imap, state_file: Path) -> TLSReportMonitor:
+    return TLSReportMonitor(
+        imap_server="imap.example.com",
+        imap_user="user",
+        imap_pass="pass",
+        imap_filter='SUBJECT "Report Domain"',
+        max_age=30,
+        imap_sessions=FakeSessionPool(imap),
+        state_file=str(state_file),
+    )
+
+
+@benchmark("tlsreport.compute_stats (cold)")
+def tlsreport_cold(tmp_dir: Path, scale: float):
+    reports = int(2000 * scale)
+    imap = fixtures.tls_report_mailbox(reports)
+    runs = iter(range(1_000_000))
+
+    def compute_stats():
+        # every run starts without a cache
+        return tls_report_monitor(imap, tmp_dir / f"state-{next(runs)}").compute_stats()
+
+    return compute_stats, reports
+
+
+@benchmark("tlsreport.compute_stats (cached)")
+def tlsreport_cached(tmp_dir: Path, scale: float):
+    reports = int(2000 * scale)
+    imap = fixtures.tls_report_mailbox(reports)
+    tls_report_monitor(imap, tmp_dir / "state").compute_stats()
+    return lambda: tls_report_monitor(imap, tmp_dir / "state").compute_stats(), reports
+
+
+@benchmark("amazon_kindle_quotes.extract_quote")
+def kindle_extract_quote(tmp_dir: Path, scale: float):
+    texts = fixtures.kindle_texts(int(10_000 * scale))
+    return lambda: [AmazonKindleQuotes.extract_quote(text) for text in texts], len(texts)
+
+
+@benchmark("amazon_kindle_quotes.is_known_quote")
+def kindle_is_known_quote(tmp_dir: Path, scale: float):
+    quotes = [AmazonKindleQuotes.extract_quote(text) for text in fixtures.kindle_texts(int(100_000 * scale))]
+    monitor = AmazonKindleQuotes("imap.example.com", "user", "pass", 30, quote_store=str(tmp_dir / "quotes.bin"))
+    # half of the quotes are known
+    for quote in quotes[::2]:
+        monitor.is_known_quote(quote)
+    return lambda: [monitor.is_known_quote(quote) for quote in quotes], len(quotes)
+
+
+@benchmark("wireguard.collect_peer_status (wg dump)")
+def wireguard_dump(tmp_dir: Path, scale: float):
+    interfaces = max(1, int(50 * scale))
+    output = MagicMock(stdout=fixtures.wg_dump(interfaces))
+    requested = [(f"ns{no % 5}", f"wg{no}") for no in range(interfaces)]
+
+    def collect_peer_status():
+        with (
+            patch.object(WireguardMonitor, "read_peer_status_netlink", side_effect=OSError),
+            patch("subprocess.run", return_value=output),
+        ):
+            status = WireguardMonitor.collect_peer_status(requested)
+            return [WireguardMonitor.handshake_age(peers) for peers in status.values()]
+
+    return collect_peer_status, interfaces
+
+
+def measure(func: Callable[[], Any], items: int, repeat: int) -> Result:
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        seconds = min(seconds, perf_counter() - start)
+
+    # tracemalloc slows down the execution, therefore the memory is measured in a separate run
+    tracemalloc.start()
+    try:
+        func()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return Result(items, seconds, peak_memory)
+
+
+def check_regression(result: Result, baseline: dict | None, time_tolerance: float, memory_tolerance: float) -> str:
+    """
+    Returns:
+        A description of the regression or an empty string.
+    """
+    if not baseline or baseline["items"] != result.items:
+        return ""
+    problems = []
+    if result.seconds > baseline["seconds"] * time_tolerance:
+        problems.append(f"{result.seconds / baseline['seconds']:.2f}x slower")
+    if result.peak_memory > baseline["peak_memory"] * memory_tolerance:
+        problems.append(f"{result.peak_memory / baseline['peak_memory']:.2f}x more memory")
+    return ", ".join(problems)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1.0, help="fixture size relative to the default size")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains the given text")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    try:
+        baselines = load(args.baseline.open())
+    except FileNotFoundError:
+        baselines = {}
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<42} {'items':>8} {'seconds':>9} {'items/s':>11} {'peak MiB':>9}  status")
+    for name, setup in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        with TemporaryDirectory() as tmp_dir:
+            func, items = setup(Path(tmp_dir), args.scale)
+            result = results[name] = measure(func, items, args.repeat)
+        if regression := check_regression(result, baselines.get(name), args.time_tolerance, args.memory_tolerance):
+            regressions.append(name)
+        print(
+            f"{name:<42} {result.items:>8} {result.seconds:>9.4f} {result.throughput:>11.0f} "
+            f"{result.peak_memory / (1 << 20):>9.2f}  {regression or 'ok'}"
+        )
+
+    if args.update_baseline:
+        baselines.update({name: result._asdict() for name, result in results.items()})
+        with args.baseline.open("w") as f:
+            dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        return 0
+
+    if regressions:
+        print(f"\nRegressions: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
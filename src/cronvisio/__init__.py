@@ -1,19 +1,91 @@
+from typing import NamedTuple
+
+from cronvisio import metrics
+from cronvisio.concurrency import run_concurrently
 from cronvisio.monitor import Monitor
 from cronvisio.notifier import Notifier
 
 
+class Delivery(NamedTuple):
+    notifier: str
+    sent: int
+    error: str | None
+    duration: float
+
+    def __str__(self):
+        if self.error:
+            return f"{self.notifier}: failed after {self.duration:.1f} s - {self.error}"
+        return f"{self.notifier}: sent {self.sent} message(s) in {self.duration:.1f} s"
+
+
 class Cronitor:
     @staticmethod
-    def cronitor(monitors: list[Monitor], notifiers: list[Notifier], force: bool = False):
+    def cronitor(
+        monitors: list[Monitor],
+        notifiers: list[Notifier],
+        force: bool = False,
+        max_workers: int | None = 1,
+        timeout: float | None = None,
+        notification_timeout: float | None = None,
+    ) -> list[Delivery]:
         """
         Args:
             monitors: a list of monitors to monitor
             notifiers: a list of notifiers used for sending notifications.
             force: whether to force notifications
+            max_workers: number of monitors to evaluate concurrently (None: all monitors at once).
+            timeout: maximum runtime per monitor in seconds; monitors exceeding it yield a warning message.
+            notification_timeout: maximum time per notifier for sending the messages in seconds.
+
+        Returns:
+            The delivery result per notifier (empty, if there was nothing to notify).
         """
-        messages = list(filter(None, [m.notify(force) for m in monitors]))
+        messages = list(filter(None, Cronitor.run_monitors(monitors, force, max_workers, timeout)))
         if not messages:
-            return
+            return []
+        return Cronitor.send_notifications(notifiers, messages, notification_timeout)
 
-        for n in notifiers:
-            n.send_notifications(messages)
+    @staticmethod
+    def send_notifications(notifiers: list[Notifier], messages: list, timeout: float | None = None) -> list[Delivery]:
+        """
+        Send the messages through all notifiers concurrently; a failing or hanging notifier does not affect
+        the others.
+
+        Returns:
+            The delivery result per notifier in the order of the given notifiers.
+        """
+        results = run_concurrently([lambda n=n: n.send_notifications(messages) for n in notifiers], timeout=timeout)
+        deliveries = []
+        for notifier, result in zip(notifiers, results, strict=True):
+            if result.timed_out:
+                error = f"did not finish within {timeout} seconds"
+            else:
+                error = (str(result.error) or type(result.error).__name__) if result.error else None
+            delivery = Delivery(type(notifier).__name__, 0 if error else len(messages), error, result.duration)
+            metrics.add("notifier_duration_seconds", delivery.duration, notifier=delivery.notifier)
+            metrics.add("notifier_failed", bool(error), notifier=delivery.notifier)
+            metrics.add("messages_sent", delivery.sent, notifier=delivery.notifier)
+            deliveries.append(delivery)
+        return deliveries
+
+    @staticmethod
+    def run_monitors(
+        monitors: list[Monitor], force: bool = False, max_workers: int | None = 1, timeout: float | None = None
+    ) -> list:
+        """
+        Returns:
+            The monitors' notification messages in the order of the given monitors.
+        """
+        results = run_concurrently([lambda m=m: m.notify(force) for m in monitors], max_workers, timeout)
+        messages = []
+        for monitor, result in zip(monitors, results, strict=True):
+            name = type(monitor).__name__
+            metrics.add("monitor_duration_seconds", result.duration, monitor=name)
+            metrics.add("monitor_failed", result.error is not None, monitor=name)
+            if result.timed_out:
+                messages.append(f"# WARNING: {name} did not finish within {timeout} seconds.")
+            elif result.error:
+                messages.append(f"# WARNING: {name} failed - {result.error}")
+            else:
+                messages.append(result.value)
+        return messages
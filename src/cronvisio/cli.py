@@ -3,60 +3,74 @@
 Cronitor
 """
 
+import signal
 import sys
 from json import load
+from threading import Event
 
-from cronvisio import Cronitor
-from cronvisio.monitor.amazon_kindle_quotes import AmazonKindleQuotes
-from cronvisio.monitor.automysqlbackup import AutoMysqlBackup
-from cronvisio.monitor.borgbackup import BorgBackupMonitor
-from cronvisio.monitor.postfix import PostfixMonitor
-from cronvisio.monitor.tlsreport import TLSReportMonitor
-from cronvisio.notifier.matrix import MatrixNotifier
+from cronvisio import Delivery
+from cronvisio.registry import Registry
+from cronvisio.scheduler import INTERVALS, Scheduler
+
+
+def print_deliveries(deliveries: list[Delivery]) -> None:
+    for delivery in deliveries:
+        print(delivery, file=sys.stderr)
+
+
+def stop_event() -> Event:
+    """
+    Returns:
+        An event that is set on SIGTERM or SIGINT.
+    """
+    stop = Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    return stop
+
+
+def serve(registry: Registry, stop: Event) -> None:
+    """
+    Run the groups on their configured intervals (e.g. {"hourly": "1h", "daily": "1d", "weekly": "1w"}) in a
+    resident process that keeps the configuration, notifiers, IMAP sessions and caches between runs.
+    Monitors are created for every run.
+    """
+    scheduler = Scheduler()
+    default_intervals = {group: group for group in registry.groups if group in INTERVALS}
+    for group, interval in registry.config.get("serve", default_intervals).items():
+        scheduler.add(group, interval, lambda group=group: print_deliveries(registry.run_group(group)))
+    scheduler.run(stop)
 
 
 def cli():
     if len(sys.argv) < 2:
-        print(f"{sys.argv[0]} [hourly|daily|weekly] [nonotify]")
+        print(f"{sys.argv[0]} [<group>|watch|serve] [nonotify]")
         sys.exit(-1)
 
     config = load(open("cronvisio.json"))
-
     # optional: disable notifications for debuging
-    if len(sys.argv) > 2 and sys.argv[2] == "nonotify":
-        from cronvisio.notifier.stdout import StdoutNotifier
-
-        update_notifiers = [StdoutNotifier()]
-        delight_notifier = [StdoutNotifier()]
-    else:
-        update_notifiers = [MatrixNotifier(**config["matrix"]["updates"])]
-        delight_notifier = [MatrixNotifier(**config["matrix"]["delight"])]
+    registry = Registry(config, nonotify=len(sys.argv) > 2 and sys.argv[2] == "nonotify")
 
     match sys.argv[1]:
-        case "hourly":
-            # postfix
-            # monitors = [PostfixMonitor()]
-            # Cronitor.cronvisio(monitors, update_notifiers)
-            # kindle
-            monitors = [AmazonKindleQuotes(**config["amazon_kindle_quotes"])]
-            Cronitor.cronitor(monitors, delight_notifier)
-        case "daily":
-            monitors = [
-                TLSReportMonitor(**config["tlsreport_monitor"]),
-                AutoMysqlBackup(**config["automysqlbackup_monitor"]),
-            ]
-            Cronitor.cronitor(monitors, update_notifiers)
-        case "weekly":
-            monitors = [
-                PostfixMonitor(),
-                TLSReportMonitor(**config["tlsreport_monitor"]),
-                BorgBackupMonitor(**config["borgbackup_monitor"]),
-            ]
-            Cronitor.cronitor(monitors, notifiers=update_notifiers, force=True)
+        case group if group in registry.groups:
+            print_deliveries(registry.run_group(group))
+        case "watch":
+            # resident wireguard monitor; terminates on SIGTERM or SIGINT
+            watch_options = dict(config.get("wireguard_watch", {}))
+            notifiers = registry.get_notifiers(watch_options.pop("notifiers", ["matrix.updates"]))
+            registry.create_monitor("wireguard_monitor").watch(notifiers, stop=stop_event(), **watch_options)
+        case "serve":
+            # resident scheduler; terminates on SIGTERM or SIGINT after the running groups have finished
+            serve(registry, stop_event())
         case _:
             print(f"Unsupported parameter {sys.argv[1]}.")
             sys.exit(-1)
 
+    # only close the IMAP sessions if a monitor has used them
+    if imap := sys.modules.get("cronvisio.imap"):
+        imap.IMAP_SESSIONS.close_all()
+    registry.close()
+
 
 if __name__ == "__main__":
     cli()
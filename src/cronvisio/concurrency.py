@@ -0,0 +1,76 @@
+"""
+Run blocking tasks concurrently with bounded parallelism and per-task deadlines.
+"""
+
+from collections.abc import Callable, Sequence
+from contextvars import copy_context
+from queue import Empty, Queue
+from threading import Thread
+from time import monotonic
+from typing import Any, NamedTuple
+
+
+class TaskResult(NamedTuple):
+    value: Any = None
+    error: BaseException | None = None
+    duration: float = 0.0
+
+    @property
+    def timed_out(self) -> bool:
+        return isinstance(self.error, TimeoutError)
+
+
+def run_concurrently(
+    tasks: Sequence[Callable[[], Any]], max_workers: int | None = None, timeout: float | None = None
+) -> list[TaskResult]:
+    """
+    Execute the given tasks in worker threads.
+
+    Args:
+        tasks: callables without arguments.
+        max_workers: maximum number of tasks running at the same time (default: all tasks).
+        timeout: maximum runtime per task in seconds, measured from the moment the task has been started.
+
+    Returns:
+        A list of TaskResults in the order of the given tasks. Tasks that exceed their deadline yield a
+        TaskResult with a TimeoutError; their worker threads are abandoned (daemon threads) so that a hung
+        task neither blocks the remaining tasks nor the interpreter's shutdown.
+
+    Note:
+        Tasks run in a copy of the caller's context (e.g., the active metrics collector).
+    """
+    max_workers = max(1, max_workers or len(tasks))
+    results: list[TaskResult | None] = [None] * len(tasks)
+    finished: Queue = Queue()
+    pending = list(range(len(tasks)))
+    pending.reverse()
+    running: dict[int, float] = {}
+
+    def worker(idx: int, start: float) -> None:
+        try:
+            result = TaskResult(value=tasks[idx](), duration=monotonic() - start)
+        except Exception as e:
+            result = TaskResult(error=e, duration=monotonic() - start)
+        finished.put((idx, result))
+
+    while pending or running:
+        while pending and len(running) < max_workers:
+            idx = pending.pop()
+            running[idx] = monotonic()
+            Thread(target=copy_context().run, args=(worker, idx, running[idx]), daemon=True).start()
+
+        wait = None if timeout is None else max(0.0, min(running.values()) + timeout - monotonic())
+        try:
+            idx, result = finished.get(timeout=wait)
+            # ignore late results of tasks that have already been abandoned
+            if running.pop(idx, None) is not None:
+                results[idx] = result
+        except Empty:
+            now = monotonic()
+            for idx, start in list(running.items()):
+                if now - start >= timeout:
+                    del running[idx]
+                    results[idx] = TaskResult(
+                        error=TimeoutError(f"Task did not finish within {timeout} seconds."), duration=now - start
+                    )
+    return results
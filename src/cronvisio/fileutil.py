@@ -0,0 +1,45 @@
+"""
+Helpers for the state, cache and report files written by cronvisio.
+"""
+
+import os
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
+from pathlib import Path
+from tempfile import mkstemp
+from typing import IO
+
+# permissions of newly created files (mkstemp creates files that are only readable by their owner)
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+
+@contextmanager
+def atomic_write(path: str | Path, mode: str = "w") -> Iterator[IO]:
+    """
+    Open a temporary file that replaces the given file once the block has been left without an exception, so
+    that readers (e.g., the node-exporter or a concurrent run) never see partially written content.
+
+    Every writer uses its own temporary file, i.e. concurrent writers of the same file do not interfere (the
+    last replacement wins). The content is flushed to disk before the replacement, so that a crash leaves
+    either the old or the new file.
+
+    Args:
+        mode: "w" for text or "wb" for binary content.
+
+    Yields:
+        The temporary file.
+    """
+    path = Path(path)
+    fd, tmp_file = mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix=".tmp")
+    try:
+        os.fchmod(fd, 0o666 & ~UMASK)
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(tmp_file)
+        raise
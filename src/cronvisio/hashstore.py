@@ -0,0 +1,79 @@
+"""
+Persistent set of fixed-size digests.
+"""
+
+from pathlib import Path
+
+from cronvisio.fileutil import atomic_write
+
+
+class HashStore:
+    """
+    A set of digests with O(1) membership tests that is persisted as a sorted binary file of fixed-size
+    records.
+
+    Additions are buffered in memory and written with a single atomic file replacement by `save`.
+    """
+
+    def __init__(self, path: str | Path, digest_size: int = 16, legacy_path: str | Path | None = None):
+        """
+        Args:
+            path: the binary store.
+            digest_size: size of the stored digests in bytes.
+            legacy_path: text file with one hex encoded digest per line that is migrated, if the binary
+                store does not exist yet.
+        """
+        self.path = Path(path)
+        self.digest_size = digest_size
+        self.legacy_path = Path(legacy_path) if legacy_path else None
+        self.digests = set()
+        self.modified = False
+
+        try:
+            data = self.path.read_bytes()
+        except FileNotFoundError:
+            self.digests = self.read_legacy_store()
+            self.modified = bool(self.digests)
+        else:
+            # a truncated trailing record is dropped by the next compaction
+            end = len(data) - len(data) % digest_size
+            self.digests = {data[pos : pos + digest_size] for pos in range(0, end, digest_size)}
+
+    def read_legacy_store(self) -> set[bytes]:
+        if not self.legacy_path:
+            return set()
+        try:
+            lines = self.legacy_path.read_text().split()
+        except FileNotFoundError:
+            return set()
+        return {bytes.fromhex(line) for line in lines if len(line) == 2 * self.digest_size}
+
+    def __contains__(self, digest: bytes) -> bool:
+        return digest in self.digests
+
+    def __len__(self) -> int:
+        return len(self.digests)
+
+    def add(self, digest: bytes) -> None:
+        if digest not in self.digests:
+            self.digests.add(digest)
+            self.modified = True
+
+    def save(self) -> None:
+        """
+        Atomically write the store, if it has been modified.
+        """
+        if self.modified:
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Rewrite the store as a sorted file without duplicate or truncated records and remove a migrated
+        legacy store.
+        """
+        with atomic_write(self.path, "wb") as f:
+            f.write(b"".join(sorted(self.digests)))
+        self.modified = False
+
+        if self.legacy_path:
+            self.legacy_path.unlink(missing_ok=True)
@@ -0,0 +1,435 @@
+"""
+Shared IMAP sessions for monitors that access the same mail account.
+"""
+
+import re
+from base64 import b64decode
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from imaplib import IMAP4, IMAP4_SSL
+from itertools import takewhile
+from quopri import decodestring
+from threading import Lock
+from time import monotonic
+from typing import Any, NamedTuple
+
+from cronvisio import metrics
+
+IDLE_CHECK_INTERVAL = 60  # verify idle connections with a NOOP after this many seconds
+TIMEOUT = 60  # socket timeout of the IMAP connections in seconds
+LOCK_TIMEOUT = 600  # maximum time to wait for a session that is used by another monitor
+
+
+class ImapSession:
+    def __init__(self, imap: IMAP4):
+        self.imap = imap
+        self.mailbox = None
+        self.last_used = monotonic()
+        self.lock = Lock()
+
+
+class ImapSessionPool:
+    """
+    Keeps one authenticated IMAP connection per (server, user) and lends it to monitors.
+
+    Note:
+        imaplib connections are not thread-safe. Borrowing a session therefore grants exclusive access
+        to it until the monitor returns it.
+    """
+
+    def __init__(self, timeout: float | None = TIMEOUT, lock_timeout: float = LOCK_TIMEOUT):
+        """
+        Args:
+            timeout: socket timeout in seconds; a hung server raises an OSError, which discards the connection.
+            lock_timeout: maximum number of seconds to wait for a session that is lent to another monitor.
+        """
+        self._sessions: dict[tuple[str, str], ImapSession] = {}
+        self._lock = Lock()
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+
+    def connect(self, server: str, user: str, password: str) -> IMAP4:
+        imap = IMAP4_SSL(server, timeout=self.timeout)
+        imap.login(user, password)
+        return imap
+
+    @contextmanager
+    def session(self, server: str, user: str, password: str, mailbox: str = "INBOX") -> Iterator[IMAP4]:
+        """
+        Borrow the authenticated connection for the given account with the given mailbox selected.
+
+        Raises:
+            TimeoutError: if the session is not returned by another monitor within lock_timeout.
+            IMAP4.error: if the mailbox cannot be selected.
+        """
+        with self._lock:
+            if (server, user) not in self._sessions:
+                self._sessions[server, user] = ImapSession(None)
+            session = self._sessions[server, user]
+
+        if not session.lock.acquire(timeout=self.lock_timeout):
+            msg = f"IMAP session {user}@{server} is still in use after {self.lock_timeout} seconds."
+            raise TimeoutError(msg)
+        try:
+            if session.imap is not None and monotonic() - session.last_used > IDLE_CHECK_INTERVAL:
+                try:
+                    session.imap.noop()
+                except (IMAP4.error, OSError):
+                    self._discard(session)
+
+            if session.imap is None:
+                session.imap = self.connect(server, user, password)
+            if session.mailbox != mailbox:
+                try:
+                    typ, data = session.imap.select(mailbox)
+                except (IMAP4.abort, OSError):
+                    self._discard(session)
+                    raise
+                if typ != "OK":
+                    # imaplib returns to the AUTH state; select the mailbox again on the next request
+                    session.mailbox = None
+                    msg = f"Cannot select mailbox {mailbox} of {user}@{server}: {data[0]!r}"
+                    raise IMAP4.error(msg)
+                session.mailbox = mailbox
+
+            try:
+                yield session.imap
+            except (IMAP4.abort, OSError):
+                # the connection is unusable; reconnect on the next request
+                self._discard(session)
+                raise
+            finally:
+                session.last_used = monotonic()
+        finally:
+            session.lock.release()
+
+    @staticmethod
+    def _discard(session: ImapSession) -> None:
+        try:
+            session.imap.shutdown()
+        except (IMAP4.error, OSError):
+            pass
+        session.imap = None
+        session.mailbox = None
+
+    def close_all(self) -> None:
+        """
+        Log out of all pooled connections.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+
+        for session in sessions:
+            # sessions that are still lent to a (hung) monitor are left to it
+            if not session.lock.acquire(timeout=self.lock_timeout):
+                continue
+            try:
+                if session.imap is not None:
+                    session.imap.logout()
+            except (IMAP4.error, OSError):
+                pass
+            finally:
+                session.imap = None
+                session.lock.release()
+
+
+IMAP_SESSIONS = ImapSessionPool()
+
+
+#
+# batched, part-selective fetching
+#
+
+BATCH_SIZE = 200  # number of messages requested per FETCH command
+RE_TOKEN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+RE_LITERAL = re.compile(rb"\{(\d+)\}$")
+RE_NON_BASE64 = re.compile(rb"[^A-Za-z0-9+/=]")
+
+
+class BodyPart(NamedTuple):
+    section: str
+    content_type: str
+    params: dict[str, str]
+    encoding: str
+    size: int
+    disposition: str | None
+
+
+def uid_set(uids: Iterable[int]) -> str:
+    """
+    Returns:
+        A compact IMAP sequence set (e.g. "1:4,7") for the given UIDs.
+    """
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and ranges[-1][1] == uid - 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(first) if first == last else f"{first}:{last}" for first, last in ranges)
+
+
+def _batches(items: list, size: int, weights: dict | None = None, max_weight: int | None = None) -> Iterator[list]:
+    """
+    Yields:
+        Batches of at most size items; with weights, the summed weight of a batch does not exceed max_weight
+        unless the batch consists of a single item.
+    """
+    batch, batch_weight = [], 0
+    for item in items:
+        weight = weights[item] if weights else 0
+        if batch and (len(batch) >= size or (max_weight is not None and batch_weight + weight > max_weight)):
+            yield batch
+            batch, batch_weight = [], 0
+        batch.append(item)
+        batch_weight += weight
+    if batch:
+        yield batch
+
+
+def _tokenize(data: list) -> Iterator[tuple[str, Any]]:
+    """
+    Split an imaplib response (bytes and (prefix, literal) tuples) into tokens.
+    """
+    for element in data:
+        if element is None:
+            continue
+        literal = None
+        if isinstance(element, tuple):
+            element, literal = element
+            element = RE_LITERAL.sub(b"", element.rstrip())
+
+        for lpar, rpar, quoted, atom in RE_TOKEN.findall(element):
+            if lpar:
+                yield "(", None
+            elif rpar:
+                yield ")", None
+            elif atom:
+                yield "atom", None if atom == b"NIL" else atom.decode("utf-8", errors="replace")
+            else:
+                yield "string", re.sub(rb"\\(.)", rb"\1", quoted).decode("utf-8", errors="replace")
+        if literal is not None:
+            yield "literal", literal
+
+
+def _parse(tokens: list, pos: int) -> tuple[Any, int]:
+    kind, value = tokens[pos]
+    if kind != "(":
+        return value, pos + 1
+
+    result = []
+    pos += 1
+    while tokens[pos][0] != ")":
+        value, pos = _parse(tokens, pos)
+        result.append(value)
+    return result, pos + 1
+
+
+def parse_fetch_response(data: list) -> dict[int, dict[str, Any]]:
+    """
+    Returns:
+        A mapping of UIDs to the fetched message attributes (e.g. "INTERNALDATE", "BODYSTRUCTURE", "BODY[2]").
+        Literals are returned as bytes, all other strings as str.
+    """
+    tokens = list(_tokenize(data))
+    result = {}
+    pos = 0
+    while pos < len(tokens):
+        _, pos = _parse(tokens, pos)  # message sequence number
+        items, pos = _parse(tokens, pos)
+        attributes = {str(key).upper(): value for key, value in zip(items[::2], items[1::2], strict=False)}
+        # skip unsolicited FETCH responses (e.g. flag updates)
+        if "UID" in attributes:
+            result.setdefault(int(attributes["UID"]), {}).update(attributes)
+    return result
+
+
+def _str(value: Any) -> str | None:
+    return value.decode("utf-8", errors="replace") if isinstance(value, bytes) else value
+
+
+def _params(value: list | None) -> dict[str, str]:
+    value = value or []
+    return {_str(key).lower(): _str(val) for key, val in zip(value[::2], value[1::2], strict=False)}
+
+
+def iter_parts(structure: list, section: str = "") -> Iterator[BodyPart]:
+    """
+    Yield all leaf parts of the given parsed BODYSTRUCTURE together with their section numbers.
+    """
+    if isinstance(structure[0], list):
+        # the child parts precede the multipart subtype
+        children = takewhile(lambda element: isinstance(element, list), structure)
+        for no, child in enumerate(children, 1):
+            yield from iter_parts(child, f"{section}.{no}" if section else str(no))
+        return
+
+    content_type = f"{_str(structure[0])}/{_str(structure[1])}".lower()
+    # extension data starts after the type specific fields
+    if content_type.startswith("text/"):
+        extension = 8
+    elif content_type == "message/rfc822":
+        extension = 10
+    else:
+        extension = 7
+    disposition = structure[extension + 1] if len(structure) > extension + 1 else None
+    yield BodyPart(
+        section=section or "1",
+        content_type=content_type,
+        params=_params(structure[2]),
+        encoding=(_str(structure[5]) or "7bit").lower(),
+        size=int(structure[6] or 0),
+        disposition=_str(disposition[0]).lower() if isinstance(disposition, list) and disposition else None,
+    )
+
+
+class TransferDecoder:
+    """
+    Incrementally remove the content transfer encoding from a body section that is received in chunks.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self.pending = b""
+
+    def decode(self, content: bytes) -> bytes:
+        if self.encoding == "base64":
+            content = self.pending + RE_NON_BASE64.sub(b"", content)
+            end = len(content) - len(content) % 4
+        elif self.encoding == "quoted-printable":
+            # encoded characters never span lines
+            content = self.pending + content
+            end = content.rfind(b"\n") + 1
+        else:
+            return content
+
+        self.pending = content[end:]
+        return self.flush(content[:end])
+
+    def flush(self, content: bytes | None = None) -> bytes:
+        if content is None:
+            content, self.pending = self.pending, b""
+        if self.encoding == "base64":
+            return b64decode(content)
+        if self.encoding == "quoted-printable":
+            return decodestring(content)
+        return content
+
+
+def decode_part(part: BodyPart, content: bytes) -> bytes:
+    """
+    Returns:
+        The given body section with its content transfer encoding removed.
+    """
+    return TransferDecoder(part.encoding).flush(content)
+
+
+def _fetch(imap: IMAP4, uids: str, items: str) -> list:
+    """
+    Returns:
+        The untagged responses of the UID FETCH command; the response size is recorded in the run's metrics.
+    """
+    _, data = imap.uid("FETCH", uids, items)
+    metrics.add("imap_bytes_fetched", sum(len(part) for item in data for part in _response_parts(item)))
+    return data
+
+
+def _response_parts(item: Any) -> tuple:
+    if isinstance(item, tuple):
+        return item
+    return (item,) if item else ()
+
+
+def iter_structures(
+    imap: IMAP4, uids: Iterable[int], items: Iterable[str] = (), batch_size: int = BATCH_SIZE
+) -> Iterator[dict[int, dict[str, Any]]]:
+    """
+    Fetch the BODYSTRUCTURE (and additional items) of many messages with one command per batch.
+
+    Yields:
+        Per batch a mapping of UIDs to the fetched attributes; "PARTS" contains the message's leaf BodyParts.
+    """
+    for batch in _batches(sorted(uids), batch_size):
+        data = _fetch(imap, uid_set(batch), "({})".format(" ".join(("UID", *items, "BODYSTRUCTURE"))))
+        metrics.add("imap_messages_fetched", len(batch), kind="structure")
+        structures = parse_fetch_response(data)
+        for attributes in structures.values():
+            attributes["PARTS"] = list(iter_parts(attributes["BODYSTRUCTURE"]))
+        del data
+        yield structures
+
+
+def fetch_structures(
+    imap: IMAP4, uids: Iterable[int], items: Iterable[str] = (), batch_size: int = BATCH_SIZE
+) -> dict[int, dict[str, Any]]:
+    """
+    Returns:
+        A mapping of UIDs to the fetched attributes of all given messages (see `iter_structures`).
+    """
+    result = {}
+    for structures in iter_structures(imap, uids, items, batch_size):
+        result.update(structures)
+    return result
+
+
+def fetch_sections(
+    imap: IMAP4, parts: dict[int, list[BodyPart]], batch_size: int = BATCH_SIZE, buffer_size: int | None = None
+) -> Iterator[dict[tuple[int, str], bytes]]:
+    """
+    Fetch the given body parts without setting the \\Seen flag.
+
+    Messages that require the same sections are fetched together in one command per batch. The next batch is
+    only fetched once the caller has processed the previous one, so that at most one batch is held in memory.
+
+    Args:
+        parts: a mapping of UIDs to the required body parts.
+        buffer_size: maximum summed size of the parts fetched in one batch (None: unlimited).
+
+    Yields:
+        Per batch a mapping of (UID, section) to the raw (still transfer encoded) section content.
+    """
+    uids_by_sections = defaultdict(list)
+    sizes = {}
+    for uid, required in parts.items():
+        if required:
+            uids_by_sections[tuple(part.section for part in required)].append(uid)
+            sizes[uid] = sum(part.size for part in required)
+
+    for required, uids in uids_by_sections.items():
+        items = "({})".format(" ".join(f"BODY.PEEK[{section}]" for section in required))
+        for batch in _batches(sorted(uids), batch_size, sizes, buffer_size):
+            data = _fetch(imap, uid_set(batch), items)
+            metrics.add("imap_messages_fetched", len(batch), kind="content")
+            contents = {}
+            for uid, attributes in parse_fetch_response(data).items():
+                for section in required:
+                    content = attributes.get(f"BODY[{section}]")
+                    contents[uid, section] = content.encode("utf-8") if isinstance(content, str) else content
+            # release the raw response while the caller processes the batch
+            del data
+            yield contents
+
+
+def iter_section(imap: IMAP4, uid: int, part: BodyPart, chunk_size: int) -> Iterator[bytes]:
+    """
+    Stream a large body section with partial fetches of at most chunk_size bytes.
+
+    Yields:
+        The section's content with its content transfer encoding removed.
+    """
+    decoder = TransferDecoder(part.encoding)
+    offset = 0
+    while True:
+        data = _fetch(imap, str(uid), f"(BODY.PEEK[{part.section}]<{offset}.{chunk_size}>)")
+        if not offset:
+            metrics.add("imap_messages_fetched", kind="content")
+        content = parse_fetch_response(data).get(uid, {}).get(f"BODY[{part.section}]<{offset}>") or b""
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        yield decoder.decode(content)
+        offset += len(content)
+        if len(content) < chunk_size:
+            break
+    yield decoder.flush()
@@ -0,0 +1,94 @@
+"""
+Incremental JSON parser that turns a stream of text chunks into parse events.
+
+The events mirror ijson's `parse` interface: (prefix, event, value) with prefixes such as
+"policies.item.summary" and the events start_map, map_key, end_map, start_array, end_array, string, number,
+boolean and null. Only the current token is kept in memory, so the memory consumption does not depend on the
+size of the parsed document.
+"""
+
+import re
+from collections.abc import Iterable, Iterator
+from json import JSONDecodeError, loads
+from typing import Any
+
+RE_TOKEN = re.compile(r'\s*(?:([{}\[\]:,])|"((?:[^"\\]|\\.)*)"|(-?[\d.eE+-]+|true|false|null))', re.DOTALL)
+RE_WHITESPACE = re.compile(r"\s*")
+LITERALS = {"true": ("boolean", True), "false": ("boolean", False), "null": ("null", None)}
+
+
+def _tokens(chunks: Iterable[str]) -> Iterator[tuple[str, Any]]:
+    """
+    Yield (kind, value) tokens; kind is either a punctuation character, "string" or a scalar event.
+    """
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+    eof = False
+    while True:
+        match = RE_TOKEN.match(buffer, pos)
+        # a token that ends with the buffer might continue in the next chunk
+        if not eof and (match is None or match.end() == len(buffer)):
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+            else:
+                buffer = buffer[pos:] + chunk
+                pos = 0
+            continue
+
+        if match is None:
+            if RE_WHITESPACE.match(buffer, pos).end() == len(buffer):
+                return
+            msg = "Invalid or truncated JSON document"
+            raise JSONDecodeError(msg, buffer, pos)
+
+        pos = match.end()
+        punctuation, string, scalar = match.groups()
+        if punctuation:
+            yield punctuation, None
+        elif string is not None:
+            yield "string", loads(f'"{string}"') if "\\" in string else string
+        elif scalar in LITERALS:
+            yield LITERALS[scalar]
+        else:
+            yield "number", int(scalar) if scalar.lstrip("-").isdigit() else float(scalar)
+
+
+def parse(chunks: Iterable[str]) -> Iterator[tuple[str, str, Any]]:
+    """
+    Parse the JSON document provided by the given text chunks.
+
+    Yields:
+        (prefix, event, value) tuples.
+    """
+    path: list[str] = []
+    # stack of the enclosing containers; True for objects, False for arrays
+    containers: list[bool] = []
+    expect_key = False
+
+    for kind, value in _tokens(chunks):
+        prefix = ".".join(path)
+        if kind == "{":
+            yield prefix, "start_map", None
+            containers.append(True)
+            path.append("")
+            expect_key = True
+        elif kind == "[":
+            yield prefix, "start_array", None
+            containers.append(False)
+            path.append("item")
+        elif kind in "}]":
+            containers.pop()
+            path.pop()
+            yield ".".join(path), "end_map" if kind == "}" else "end_array", None
+        elif kind == ",":
+            expect_key = containers[-1]
+        elif kind == ":":
+            continue
+        elif expect_key:
+            path[-1] = value
+            yield ".".join(path[:-1]), "map_key", value
+            expect_key = False
+        else:
+            yield prefix, kind, value
@@ -0,0 +1,158 @@
+"""
+Low-overhead instrumentation of cronvisio runs.
+
+A RunMetrics collector is active while a run is instrumented (see `collect`); instrumented code records into
+the active collector and does nothing otherwise. The collector is bound to the current context, so that
+concurrently running groups (serve mode) record into their own collectors. Tasks started with
+run_concurrently inherit the context of their caller.
+
+The results are exported as a Prometheus node-exporter textfile and/or a JSON run report.
+"""
+
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from json import dump
+from threading import Lock
+from time import monotonic, time
+
+from cronvisio.fileutil import atomic_write
+
+PREFIX = "cronvisio_"
+REPORT_FILE = ".cronvisio-run-{group}.json"
+
+# description of every recorded metric (Prometheus HELP text)
+METRICS = {
+    "run_timestamp_seconds": "Start of the run as Unix timestamp.",
+    "run_duration_seconds": "Wall time of the run.",
+    "monitor_duration_seconds": "Wall time of the monitor (summed over its instances).",
+    "monitor_failed": "Number of the monitor's instances that failed or timed out.",
+    "notifier_duration_seconds": "Wall time for sending the run's messages.",
+    "notifier_failed": "Whether the notifier failed or timed out.",
+    "messages_sent": "Number of messages sent by the notifier.",
+    "subprocess_duration_seconds": "Total runtime of the command's invocations.",
+    "subprocess_calls": "Number of invocations of the command.",
+    "imap_messages_fetched": "Number of messages whose structure or content (kind) has been fetched.",
+    "imap_bytes_fetched": "Number of bytes received in IMAP FETCH responses.",
+}
+
+
+class RunMetrics:
+    def __init__(self, group: str):
+        self.group = group
+        self.started = time()
+        self.duration = 0.0
+        # (name, sorted labels) -> value
+        self.values: dict[tuple[str, tuple[tuple[str, str], ...]], float] = defaultdict(float)
+        self.lock = Lock()
+
+    def add(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] += value
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        """
+        Returns:
+            The (name, labels, value) of all metrics including the run's start and duration.
+        """
+        with self.lock:
+            values = sorted(self.values.items())
+        return [
+            ("run_timestamp_seconds", {}, self.started),
+            ("run_duration_seconds", {}, self.duration),
+            *((name, dict(labels), value) for (name, labels), value in values),
+        ]
+
+    def to_prometheus(self) -> str:
+        """
+        Returns:
+            The metrics in the Prometheus text exposition format; all metrics are gauges labelled with the group.
+        """
+        lines = []
+        described = set()
+        for name, labels, value in self.samples():
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {PREFIX}{name} {METRICS.get(name, name)}")
+                lines.append(f"# TYPE {PREFIX}{name} gauge")
+            label_str = ",".join(f'{key}="{escape(value)}"' for key, value in {"group": self.group, **labels}.items())
+            lines.append(f"{PREFIX}{name}{{{label_str}}} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        return {
+            "group": self.group,
+            "started": self.started,
+            "duration": self.duration,
+            "metrics": [{"name": name, "labels": labels, "value": value} for name, labels, value in self.samples()],
+        }
+
+
+CURRENT: ContextVar[RunMetrics | None] = ContextVar("cronvisio_metrics", default=None)
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def add(name: str, value: float = 1, **labels: str) -> None:
+    """
+    Add the given value to the metric of the active run (if any).
+    """
+    if (metrics := CURRENT.get()) is not None:
+        metrics.add(name, value, **labels)
+
+
+@contextmanager
+def timed(name: str, **labels: str) -> Iterator[None]:
+    """
+    Record the number of calls (<name>_calls) and the total wall time (<name>_duration_seconds) of the
+    enclosed block.
+    """
+    if (metrics := CURRENT.get()) is None:
+        yield
+        return
+    start = monotonic()
+    try:
+        yield
+    finally:
+        metrics.add(f"{name}_duration_seconds", monotonic() - start, **labels)
+        metrics.add(f"{name}_calls", 1, **labels)
+
+
+@contextmanager
+def collect(group: str) -> Iterator[RunMetrics]:
+    """
+    Instrument the enclosed run.
+
+    Yields:
+        The run's metrics, which are complete after the block has been left.
+    """
+    metrics = RunMetrics(group)
+    token = CURRENT.set(metrics)
+    start = monotonic()
+    try:
+        yield metrics
+    finally:
+        metrics.duration = monotonic() - start
+        CURRENT.reset(token)
+
+
+def export(metrics: RunMetrics, textfile: str | None = None, report: str | None = REPORT_FILE) -> None:
+    """
+    Args:
+        textfile: Prometheus textfile, e.g. "/var/lib/prometheus/node-exporter/cronvisio_{group}.prom" (None:
+            disable the export).
+        report: JSON run report (None: disable the report).
+
+    Note:
+        "{group}" in the file names is replaced with the run's group, so that every group keeps its own file.
+    """
+    if textfile:
+        with atomic_write(textfile.format(group=metrics.group)) as f:
+            f.write(metrics.to_prometheus())
+    if report:
+        with atomic_write(report.format(group=metrics.group)) as f:
+            dump(metrics.to_dict(), f, indent=2)
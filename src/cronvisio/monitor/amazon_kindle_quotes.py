@@ -1,36 +1,50 @@
 #!/usr/bin/env python3
 
-import email
 from datetime import date, timedelta
 from hashlib import md5
-from imaplib import IMAP4_SSL
-from quopri import decodestring
 
+from cronvisio.hashstore import HashStore
+from cronvisio.imap import IMAP_SESSIONS, ImapSessionPool, decode_part, fetch_sections, fetch_structures
 from cronvisio.monitor import Monitor
 
+QUOTE_STORE_FILE = ".cronvisio-known-amazon-kindle-quotes.bin"
+# legacy text store with one hex encoded hash per line
 QUOTE_CACHE_FILE = ".cronvisio-known-amazon-kindle-quotes"
 
 
 class AmazonKindleQuotes(Monitor):
-    def __init__(self, imap_server: str, imap_user: str, imap_pass: str, max_age: int):
+    def __init__(
+        self,
+        imap_server: str,
+        imap_user: str,
+        imap_pass: str,
+        max_age: int,
+        imap_sessions: ImapSessionPool = IMAP_SESSIONS,
+        quote_store: str = QUOTE_STORE_FILE,
+    ):
+        """
+        Args:
+            quote_store: file that stores the hashes of all known quotes.
+        """
         self.imap_server = imap_server
         self.imap_user = imap_user
         self.imap_pass = imap_pass
         self.since = date.today() - timedelta(days=max_age)
-        try:
-            self.known_quote_hashes = open(QUOTE_CACHE_FILE).read().split()
-        except FileNotFoundError:
-            self.known_quote_hashes = []
+        self.imap_sessions = imap_sessions
+        self.known_quote_hashes = HashStore(quote_store, legacy_path=QUOTE_CACHE_FILE)
 
     def is_known_quote(self, quote):
         """
-        Checks whether the given quote is known.
+        Checks whether the given quote is known and marks it as known otherwise.
+
+        Note:
+            New quotes are persisted by `get_quotes` with a single write per run.
         """
-        quote_hash = md5(quote.encode("utf8"), usedforsecurity=False).hexdigest()
+        quote_hash = md5(quote.encode("utf8"), usedforsecurity=False).digest()
         if quote_hash in self.known_quote_hashes:
             return True
 
-        open(QUOTE_CACHE_FILE, "a").write(quote_hash + "\n")
+        self.known_quote_hashes.add(quote_hash)
         return False
 
     @staticmethod
@@ -57,31 +71,29 @@ class AmazonKindleQuotes(Monitor):
     def get_quotes(self):
         """
         Returns:
-            The number of failures and a dictionary with per reporter and
-            domain statistics.
+            A list of the new quotes received since the configured date.
         """
+        with self.imap_sessions.session(self.imap_server, self.imap_user, self.imap_pass) as imap:
+            _, messages = imap.uid("SEARCH", None, "(SINCE {})".format(self.since.strftime("%d-%b-%Y")))
+            uids = [int(uid) for uid in messages[0].split()]
+            if not uids:
+                return []
+
+            # only download the text/plain part that contains the quote
+            text_parts = {
+                uid: [part for part in attributes["PARTS"] if part.content_type == "text/plain"][-1:]
+                for uid, attributes in fetch_structures(imap, uids).items()
+            }
+            contents = {key: content for batch in fetch_sections(imap, text_parts) for key, content in batch.items()}
+
         result = []
-        with IMAP4_SSL(self.imap_server) as imap:
-            imap.login(self.imap_user, self.imap_pass)
-            imap.select("INBOX")
-            _, messages = imap.search(None, "(SINCE {})".format(self.since.strftime("%d-%b-%Y")))
-            for msg in messages[0].split(b" "):
-                if not msg:
-                    continue
-                _, data = imap.fetch(msg, "(RFC822)")
-
-                for response in data:
-                    if isinstance(response, tuple):
-                        msg = email.message_from_bytes(response[1])
-                        for part in msg.walk():
-                            if part.get_content_type() == "text/plain":
-                                if part.get("Content-Transfer-Encoding", "utf8") == "quoted-printable":
-                                    mail_content = self.extract_quote(decodestring(part.get_payload()).decode("utf8"))
-                                else:
-                                    mail_content = self.extract_quote(part.get_payload())
-                        quote = self.extract_quote(mail_content)
-                        if not self.is_known_quote(quote):
-                            result.append(quote)
+        for uid, parts in sorted(text_parts.items()):
+            for part in parts:
+                text = decode_part(part, contents[uid, part.section])
+                quote = self.extract_quote(text.decode(part.params.get("charset", "utf8"), errors="replace"))
+                if not self.is_known_quote(quote):
+                    result.append(quote)
+        self.known_quote_hashes.save()
         return result
 
     def notify(self, force=True):
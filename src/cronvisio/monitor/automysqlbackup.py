@@ -1,40 +1,242 @@
 #!/usr/bin/env python3
 
+import os
+import random
 import re
-from datetime import datetime, timedelta
+import zlib
+from datetime import date, datetime, timedelta
+from json import dump, load
 from pathlib import Path
+from typing import NamedTuple
 
+from cronvisio.concurrency import run_concurrently
+from cronvisio.fileutil import atomic_write
 from cronvisio.monitor import Monitor
 
-RE_DATE = re.compile(r"[\._](\d{4}-\d{2}-\d{2})[\._]")
+# e.g. seahub-db_2022-07-24_06h25m.Sunday.sql.gz or seahub-db_week.36.2023-09-09_05h29m.sql.gz
+RE_BACKUP = re.compile(r"(?P<database>.+?)(?:_week\.\d+)?[\._](?P<date>\d{4}-\d{2}-\d{2})[\._]")
+BACKUP_SUFFIX = ".sql.gz"
+INDEX_FILE = ".cronvisio-automysqlbackup-index"
+INDEX_VERSION = 2
+NO_BACKUP = ["", ""]
+GZIP_MAGIC = b"\x1f\x8b\x08"
+GZIP_MIN_SIZE = 20  # header, empty deflate stream and footer
+DEFLATE_MAX_RATIO = 1032
+GZIP_HEADER_MARGIN = 1024
+CHUNK_SIZE = 1 << 20
+MAX_WORKERS = 4
+
+
+class Backup(NamedTuple):
+    date: date
+    path: str
 
 
 class AutoMysqlBackup(Monitor):
-    def __init__(self, archive_path: Path, max_age: int, date: datetime | None = None):
+    def __init__(
+        self,
+        archive_path: Path,
+        max_age: int,
+        date: datetime | None = None,
+        ignore_databases: list[str] = (),
+        index_file: str | None = INDEX_FILE,
+        verify_integrity: bool = False,
+        verify_sample: int = 0,
+        max_workers: int = MAX_WORKERS,
+    ):
         """
         Args:
             max_age: maximum backup age to consider in days.
-            ignore_hosts: hosts to ignore (i.e., we won't trigger an alert if no backup has been conducted within
-                max_age for the hosts).
+            ignore_databases: databases to ignore (i.e., we won't trigger an alert if no backup has been
+                conducted within max_age for the databases).
+            index_file: file that caches the scan results of unchanged directories between runs (None: disable
+                the index).
+            verify_integrity: check the gzip header and footer of every database's most recent backup.
+            verify_sample: number of randomly chosen most recent backups that are fully decompressed to verify
+                their checksums, if verify_integrity is set.
+            max_workers: number of backups that are fully verified in parallel.
         """
         if not date:
             date = datetime.now()
         self.archive_path = Path(archive_path)
         self.date_threshold = date - timedelta(days=max_age)
+        self.ignore_databases = ignore_databases
+        self.index_file = index_file
+        self.verify_integrity = verify_integrity
+        self.verify_sample = verify_sample
+        self.max_workers = max_workers
+
+    def load_index(self) -> dict:
+        try:
+            with open(self.index_file) as f:
+                index = load(f)
+            if index["version"] == INDEX_VERSION and index["archive_path"] == str(self.archive_path):
+                return index["directories"]
+        except (FileNotFoundError, TypeError, ValueError, KeyError):
+            pass
+        return {}
+
+    def save_index(self, directories: dict) -> None:
+        if not self.index_file:
+            return
+        with atomic_write(self.index_file) as f:
+            dump({"version": INDEX_VERSION, "archive_path": str(self.archive_path), "directories": directories}, f)
+
+    @staticmethod
+    def scan_directory(path: str) -> tuple[dict[str, list[str]], list[str]]:
+        """
+        Returns:
+            The ISO date and path of the most recent backup per database in the given directory, and the
+            directory's subdirectories.
+        """
+        latest = {}
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.endswith(BACKUP_SUFFIX):
+                    if not (match := RE_BACKUP.match(entry.name)):
+                        continue
+                    database = match.group("database")
+                    backup = [match.group("date"), entry.path]
+                    # ISO dates sort chronologically
+                    if backup > latest.get(database, NO_BACKUP):
+                        latest[database] = backup
+                elif not entry.name.startswith(".") and entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+        return latest, subdirs
+
+    def get_latest_backups(self) -> dict[str, Backup]:
+        """
+        Returns:
+            The most recent backup per database.
+
+        Note:
+            Only directories whose mtime has changed since the last run are scanned; the results of all other
+            directories are taken from the index.
+        """
+        index = self.load_index()
+        directories = {}
+        latest = {}
+        pending = [str(self.archive_path)]
+        while pending:
+            path = pending.pop()
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+                if (cached := index.get(path)) and cached["mtime_ns"] == mtime_ns:
+                    backups, subdirs = cached["latest"], cached["subdirs"]
+                else:
+                    backups, subdirs = self.scan_directory(path)
+            except OSError:
+                # the archive path does not exist or a (cached) subdirectory has been removed
+                continue
+            directories[path] = {"mtime_ns": mtime_ns, "latest": backups, "subdirs": subdirs}
+
+            for database, backup in backups.items():
+                if backup > latest.get(database, NO_BACKUP):
+                    latest[database] = backup
+            pending.extend(subdirs)
+        self.save_index(directories)
+
+        return {
+            database: Backup(date.fromisoformat(backup_date), path)
+            for database, (backup_date, path) in sorted(latest.items())
+            if database not in self.ignore_databases
+        }
+
+    @staticmethod
+    def check_gzip_file(path: str) -> str | None:
+        """
+        Cheaply validate the gzip header and footer of the given file.
+
+        Returns:
+            A description of the detected problem or None.
+        """
+        with open(path, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size < GZIP_MIN_SIZE:
+                return f"file is truncated ({size} bytes)"
+            f.seek(0)
+            if f.read(len(GZIP_MAGIC)) != GZIP_MAGIC:
+                return "invalid gzip header"
+            f.seek(-4, os.SEEK_END)
+            isize = int.from_bytes(f.read(4), "little")
+
+        # deflate never expands data by more than 5 bytes per 16 KiB block (plus an optional file name in the
+        # header) and never compresses it by more than DEFLATE_MAX_RATIO; only applicable if the uncompressed
+        # size fits into the 32 bit ISIZE field
+        payload = size - GZIP_MIN_SIZE
+        if payload * DEFLATE_MAX_RATIO < 1 << 32 and (
+            isize + GZIP_HEADER_MARGIN < payload - 5 * (payload // 16384 + 1) or isize > payload * DEFLATE_MAX_RATIO
+        ):
+            return "implausible uncompressed size in gzip footer (truncated file?)"
+        return None
+
+    @staticmethod
+    def verify_gzip_file(path: str) -> str | None:
+        """
+        Decompress the given file and verify the CRC and size stored in its footer.
+
+        Returns:
+            A description of the detected problem or None.
+        """
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        try:
+            with open(path, "rb") as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    # data after the end of a member (e.g., within the last chunk) belongs to the next member
+                    while chunk or (decompressor.eof and decompressor.unused_data):
+                        if decompressor.eof:
+                            # concatenated gzip members
+                            chunk = decompressor.unused_data + chunk
+                            decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+                        decompressor.decompress(chunk, CHUNK_SIZE)
+                        chunk = decompressor.unconsumed_tail
+        except zlib.error as e:
+            return f"corrupt gzip stream ({e})"
+        return None if decompressor.eof else "file is truncated"
+
+    def check_integrity(self, backups: dict[str, Backup]) -> dict[str, str]:
+        """
+        Returns:
+            The problems detected in the given backups per database.
+        """
+        problems = {
+            database: error for database, backup in backups.items() if (error := self.check_gzip_file(backup.path))
+        }
+
+        candidates = sorted(database for database in backups if database not in problems)
+        sample = random.sample(candidates, min(self.verify_sample, len(candidates)))
+        results = run_concurrently(
+            [lambda path=backups[database].path: self.verify_gzip_file(path) for database in sample], self.max_workers
+        )
+        for database, result in zip(sample, results, strict=True):
+            if error := result.value or result.error:
+                problems[database] = str(error)
+        return dict(sorted(problems.items()))
 
     def notify(self, force=False):
         msg = []
+        latest_backups = self.get_latest_backups()
+        stale_backups = {
+            database: backup.date
+            for database, backup in latest_backups.items()
+            if backup.date < self.date_threshold.date()
+        }
+
+        if not latest_backups:
+            msg.append(f"\n# WARNING: No automysql database backup found in {self.archive_path}.")
+        elif stale_backups:
+            msg.append("\n# WARNING: No recent automysql database backup found.")
+            msg += self.format_backups(stale_backups)
+        elif force:
+            msg.append("\n# Automysql database backups:")
+            msg += self.format_backups({database: backup.date for database, backup in latest_backups.items()})
 
-        # determine the date of the most recent backup
-        most_current_date = datetime.strptime("1900-01-01", "%Y-%m-%d")
-        for path in self.archive_path.rglob("*.sql.gz"):
-            date = datetime.strptime(RE_DATE.search(str(path.name)).group(1), "%Y-%m-%d")
-            if date > most_current_date:
-                most_current_date = date
-
-        if most_current_date < self.date_threshold or force:
-            msg.append(
-                "\n# WARNING: No recent automysql database backup found.\n"
-                f"           Date of last backup: {most_current_date.date().isoformat()}"
-            )
+        if self.verify_integrity and (problems := self.check_integrity(latest_backups)):
+            msg.append("\n# WARNING: Corrupt automysql database backups found.")
+            msg += [f"- {database}: {latest_backups[database].path}: {error}" for database, error in problems.items()]
         return "\n".join(msg)
+
+    @staticmethod
+    def format_backups(backups: dict[str, date]) -> list[str]:
+        return [f"- {database}: last backup {backup_date.isoformat()}" for database, backup_date in backups.items()]
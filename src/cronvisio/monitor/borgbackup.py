@@ -1,11 +1,26 @@
 #!/usr/bin/env python3
 
+import os
 import subprocess
 from datetime import datetime, timedelta
-from json import loads
+from json import dump, load, loads
 from pathlib import Path
+from tempfile import TemporaryFile
+from threading import Event, Timer
 
+from cronvisio import metrics
+from cronvisio.concurrency import run_concurrently
+from cronvisio.fileutil import atomic_write
 from cronvisio.monitor import Monitor
+from cronvisio.timeseries import TIMESERIES_DIR, TimeSeriesStore
+
+MAX_WORKERS = 4
+CACHE_FILE = ".cronvisio-borgbackup-cache"
+REPOSITORY_STATE_FILES = ("index.", "hints.", "integrity.")
+# same timestamp format as borg's json output
+ARCHIVE_FORMAT = "{start:%Y-%m-%dT%H:%M:%S.%f}{TAB}{name}{NL}"
+LAST_ARCHIVES_MARGIN = 16
+FULL_LISTING_INTERVAL = timedelta(days=7)  # maximum time until hosts of pruned archives disappear
 
 
 class BorgBackupMonitor(Monitor):
@@ -16,27 +31,193 @@ class BorgBackupMonitor(Monitor):
         min_backup_count: int = 0,
         ignore_archives: list[str] = (),
         ignore_hosts: list[str] = (),
+        max_workers: int = MAX_WORKERS,
+        timeout: int | None = None,
+        cache_file: str | None = CACHE_FILE,
+        timeseries_dir: str | None = TIMESERIES_DIR,
     ):
         """
         Args:
             max_age: maximum backup age to consider in days.
             ignore_hosts: hosts to ignore (i.e., we won't trigger an alert if no backup has been conducted within
                 max_age for the hosts).
+            max_workers: number of repositories that are listed in parallel.
+            timeout: maximum time in seconds for listing a single repository.
+            cache_file: file that caches the listings of unchanged repositories between runs (None: disable
+                caching).
+            timeseries_dir: time-series store that records the number of recent backups per repository and host
+                (None: disable the history).
         """
         self.archive_path = Path(archive_path)
         self.max_age = timedelta(days=max_age)
         self.min_backup_count = min_backup_count
         self.ignore_archives = ignore_archives
         self.ignore_hosts = ignore_hosts
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache_file = cache_file
+        self.timeseries = TimeSeriesStore(timeseries_dir) if timeseries_dir else None
+
+    def load_cache(self) -> dict:
+        try:
+            with open(self.cache_file) as f:
+                return load(f)
+        except (FileNotFoundError, TypeError, ValueError):
+            return {}
+
+    def save_cache(self, cache: dict) -> None:
+        if not self.cache_file:
+            return
+        with atomic_write(self.cache_file) as f:
+            dump(cache, f)
+
+    @staticmethod
+    def get_fingerprint(path: Path) -> list | None:
+        """
+        Returns:
+            A cheap fingerprint of the repository's state (borg rewrites the index, hints and integrity files on
+            every transaction), or None if the path does not contain a local borg repository.
+        """
+        fingerprint = sorted(
+            [entry.name, entry.stat().st_mtime_ns, entry.stat().st_size]
+            for entry in os.scandir(path)
+            if entry.name.startswith(REPOSITORY_STATE_FILES) and entry.is_file()
+        )
+        return fingerprint or None
+
+    def list_archives(self, path: Path, cutoff: str, last: int | None = None) -> tuple[list[list[str]], list[str], int]:
+        """
+        Stream the repository's archive list and only keep archives that started after the cutoff.
+
+        Args:
+            cutoff: ISO formatted start time of the oldest relevant archive.
+            last: only list the given number of most recent archives.
+
+        Returns:
+            The relevant [start, name] pairs, all hosts that occurred in the listing and the number of listed
+            archives.
+        """
+        cmd = ["borg", "list", "--sort-by", "timestamp", "--format", ARCHIVE_FORMAT]
+        if last:
+            cmd += ["--last", str(last)]
+        archives, hosts, count = [], {}, 0
+        with (
+            metrics.timed("subprocess", command="borg"),
+            TemporaryFile() as stderr,
+            subprocess.Popen([*cmd, str(path)], stdout=subprocess.PIPE, stderr=stderr, text=True) as proc,
+        ):
+            timed_out = Event()
+            timer = Timer(self.timeout, lambda: timed_out.set() or proc.kill()) if self.timeout else None
+            if timer:
+                timer.start()
+            try:
+                for line in proc.stdout:
+                    start, _, name = line.rstrip("\n").partition("\t")
+                    count += 1
+                    hosts[name.rsplit(".", 1)[0]] = None
+                    # ISO timestamps sort chronologically, so there is no need to parse outdated archives
+                    if start >= cutoff:
+                        archives.append([start, name])
+                returncode = proc.wait()
+            finally:
+                if timer:
+                    timer.cancel()
+
+            if timed_out.is_set():
+                raise subprocess.TimeoutExpired(cmd, self.timeout)
+            if returncode:
+                stderr.seek(0)
+                raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr.read())
+        return archives, list(hosts), count
+
+    def list_changed_archives(
+        self, path: Path, cutoff: str, entry: dict | None, current_date: datetime
+    ) -> tuple[list[list[str]], list[str], str | None]:
+        """
+        List the archives of a repository that changed since its cache entry has been created.
+
+        Hosts of older archives are known from the cache entry, so that listing the most recent archives is
+        sufficient. The complete repository is listed every FULL_LISTING_INTERVAL, so that hosts whose archives
+        have all been pruned eventually disappear.
+
+        Returns:
+            The relevant [start, name] pairs, the repository's hosts and the ISO formatted time of the last
+            complete listing.
+        """
+        listed = entry.get("listed") if entry else None
+        last = None
+        if entry and cutoff and listed and datetime.fromisoformat(listed) > current_date - FULL_LISTING_INTERVAL:
+            last = 2 * len(entry["archives"]) + LAST_ARCHIVES_MARGIN
+        archives, hosts, count = self.list_archives(path, cutoff, last)
+        if last and count == last and len(archives) == count:
+            # all listed archives are relevant, so there might be even more of them
+            archives, hosts, count = self.list_archives(path, cutoff)
+            last = None
+
+        if last and count == last:
+            hosts = list(dict.fromkeys(entry["hosts"] + hosts))
+        else:
+            # the listing contains all archives and is therefore authoritative
+            listed = current_date.isoformat()
+        return archives, hosts, listed
+
+    def get_backups(self, path: Path, cache: dict | None = None, current_date: datetime | None = None):
+        """
+        Returns:
+            A map of hostnames and the corresponding backups of the given repository. The listing is served
+            from the cache, if the repository has not changed since it has been cached.
+        """
+        cache = {} if cache is None else cache
+        current_date = current_date or datetime.now()
+        cutoff = (current_date - self.max_age).isoformat(timespec="microseconds") if self.max_age else ""
+        fingerprint = self.get_fingerprint(path)
+        entry = cache.get(str(path))
+        if entry and entry.get("max_age") != self.max_age.days:
+            entry = None
+
+        if fingerprint and entry and entry["fingerprint"] == fingerprint:
+            archives, hosts, listed = entry["archives"], entry["hosts"], entry.get("listed")
+        else:
+            archives, hosts, listed = self.list_changed_archives(path, cutoff, entry, current_date)
+
+        if fingerprint:
+            cache[str(path)] = {
+                "fingerprint": fingerprint,
+                "max_age": self.max_age.days,
+                "listed": listed,
+                "hosts": hosts,
+                "archives": [archive for archive in archives if archive[0] >= cutoff],
+            }
+        return self.filter_archives(archives, hosts, current_date)
+
+    @staticmethod
+    def format_error(error: Exception) -> str:
+        if isinstance(error, subprocess.CalledProcessError) and error.stderr:
+            return error.stderr.decode("utf-8", errors="replace").strip()
+        return str(error)
 
     def notify(self, force=False):
         msg = []
-        for path in self.archive_path.glob("*"):
-            if not path.is_dir() or path.name in self.ignore_archives:
+        paths = sorted(
+            path for path in self.archive_path.glob("*") if path.is_dir() and path.name not in self.ignore_archives
+        )
+        cache = self.load_cache()
+        results = run_concurrently(
+            [lambda path=path: self.get_backups(path, cache) for path in paths],
+            self.max_workers,
+        )
+        # drop repositories that no longer exist
+        self.save_cache({str(path): cache[str(path)] for path in paths if str(path) in cache})
+        for path, result in zip(paths, results, strict=True):
+            if result.error:
+                msg.append(f"\n# WARNING: Cannot list backups in archive {path}: {self.format_error(result.error)}")
                 continue
-            backups = self.parse_borgbackup_output(
-                subprocess.check_output(["borg", "list", "--json", str(path)]).decode("utf-8")
-            )
+
+            backups = result.value
+            if self.timeseries:
+                self.timeseries.append_all(
+                    {f"borgbackup.{path.name}.{host}": len(last_backups) for host, last_backups in backups.items()}
+                )
             notification_required = any(
                 (
                     host
@@ -55,18 +236,30 @@ class BorgBackupMonitor(Monitor):
     def parse_borgbackup_output(self, out: str, current_date: datetime | None = None):
         """
         Returns:
-          A map of hostnames and the corresponding backups.
+          A map of hostnames and the corresponding backups from the output of `borg list --json`.
+        """
+        archives = [[archive["start"], archive["name"]] for archive in loads(out)["archives"]]
+        return self.filter_archives(archives, [name.rsplit(".", 1)[0] for _, name in archives], current_date)
+
+    def filter_archives(self, archives: list[list[str]], hosts: list[str], current_date: datetime | None = None):
+        """
+        Args:
+            archives: [start, name] pairs of the repository's archives.
+            hosts: all hosts with backups in the repository.
+
+        Returns:
+          A map of hostnames and the corresponding backups within max_age.
         """
         if not current_date:
             current_date = datetime.now()
 
-        archives = {}
+        backups = {host: [] for host in hosts if host and host not in self.ignore_hosts}
         cutoff_date = current_date - self.max_age
-        for archive in loads(out)["archives"]:
-            backup_host = archive["name"].rsplit(".", 1)[0]
-            if backup_host not in archives and backup_host and backup_host not in self.ignore_hosts:
-                archives[backup_host] = []
-            date = datetime.strptime(archive["start"], "%Y-%m-%dT%H:%M:%S.%f")
+        for start, name in archives:
+            backup_host = name.rsplit(".", 1)[0]
+            if backup_host not in backups:
+                continue
+            date = datetime.strptime(start, "%Y-%m-%dT%H:%M:%S.%f")
             if not self.max_age or date >= cutoff_date:
-                archives[backup_host].append(date)
-        return archives
+                backups[backup_host].append(date)
+        return backups
@@ -2,13 +2,45 @@
 
 import subprocess
 
+from cronvisio import metrics
 from cronvisio.monitor import Monitor
+from cronvisio.timeseries import TIMESERIES_DIR, TimeSeriesStore
+
+QUEUE_SIZE = "postfix.queue_size"
+GROWTH_WINDOW = 3600
 
 
 class PostfixMonitor(Monitor):
+    def __init__(
+        self,
+        timeseries_dir: str | None = TIMESERIES_DIR,
+        max_queue_growth: float | None = None,
+        growth_window: float = GROWTH_WINDOW,
+    ):
+        """
+        Args:
+            timeseries_dir: time-series store that records the queue size (None: disable the history).
+            max_queue_growth: maximum growth of the mail queue in mails per hour (None: no growth threshold).
+            growth_window: number of seconds over which the queue's growth is computed.
+        """
+        self.timeseries = TimeSeriesStore(timeseries_dir) if timeseries_dir else None
+        self.max_queue_growth = max_queue_growth
+        self.growth_window = growth_window
+
     def notify(self, force=True):
-        if queue_size := self.get_queue_size():
-            return f"# Mail monitoring:\n- {queue_size} mails are currently queued."
+        queue_size = self.get_queue_size()
+        growth = None
+        if self.timeseries:
+            self.timeseries.append(QUEUE_SIZE, queue_size)
+            growth = self.timeseries.rate(QUEUE_SIZE, self.growth_window, per=3600)
+
+        msg = []
+        if queue_size:
+            msg.append(f"- {queue_size} mails are currently queued.")
+        if growth is not None and self.max_queue_growth is not None and growth > self.max_queue_growth:
+            msg.append(f"- The mail queue grows by {growth:.0f} mails per hour.")
+        if msg:
+            return "\n".join(("# Mail monitoring:", *msg))
         if force:
             return "# Mail monitoring:\n- Mail queue is empty."
         return ""
@@ -19,7 +51,8 @@ class PostfixMonitor(Monitor):
         Returns:
           A key, value mapping of sensor data.
         """
-        output = subprocess.check_output(["postqueue", "-p"]).decode("utf-8")
+        with metrics.timed("subprocess", command="postqueue"):
+            output = subprocess.check_output(["postqueue", "-p"]).decode("utf-8")
         # one line per item  header
         return len(output.splitlines()) - 1
 
@@ -1,13 +1,108 @@
 #!/usr/bin/env python3
 
-import email
+import re
+import sqlite3
+import zlib
+from codecs import getincrementaldecoder
 from collections import defaultdict
+from collections.abc import Iterable, Iterator
 from datetime import date, timedelta
-from gzip import decompress
-from imaplib import IMAP4, IMAP4_SSL
-from json import loads
+from email.header import decode_header, make_header
+from imaplib import IMAP4, Internaldate2tuple
 
+from cronvisio.imap import (
+    IMAP_SESSIONS,
+    BodyPart,
+    ImapSessionPool,
+    decode_part,
+    fetch_sections,
+    iter_section,
+    iter_structures,
+)
+from cronvisio.jsonstream import parse
 from cronvisio.monitor import Monitor
+from cronvisio.timeseries import TIMESERIES_DIR, TimeSeriesStore
+
+STATE_FILE = ".cronvisio-tlsreport-cache.sqlite"
+BUFFER_SIZE = 1 << 20
+RE_UIDVALIDITY = re.compile(rb"UIDVALIDITY (\d+)")
+RE_REPORT_ID = re.compile(r"Report-ID:\s*<?([^\s>]+)>?", re.IGNORECASE)
+
+
+class TLSReportCache:
+    """
+    On-disk cache of the processed reports and the account's UID checkpoint.
+
+    Reports are keyed by their TLS-RPT report-id, so that every report is parsed at most once and duplicates
+    are counted only once.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS checkpoint (account TEXT PRIMARY KEY, uidvalidity INTEGER, last_uid INTEGER)",
+        "CREATE TABLE IF NOT EXISTS reports (report_id TEXT PRIMARY KEY, received TEXT)",
+        "CREATE INDEX IF NOT EXISTS reports_received ON reports (received)",
+        "CREATE TABLE IF NOT EXISTS report_stats "
+        "(report_id TEXT, reporter TEXT, domain TEXT, successful INTEGER, failure INTEGER)",
+        "CREATE INDEX IF NOT EXISTS report_stats_report_id ON report_stats (report_id)",
+    )
+
+    def __init__(self, cache_file: str | None):
+        self.db = sqlite3.connect(cache_file or ":memory:")
+        # allow the database to shrink after evicting reports
+        self.db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        for statement in self.SCHEMA:
+            self.db.execute(statement)
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
+
+    def get_checkpoint(self, account: str) -> tuple[int | None, int]:
+        """
+        Returns:
+            The UIDVALIDITY and the last processed UID of the given account.
+        """
+        row = self.db.execute("SELECT uidvalidity, last_uid FROM checkpoint WHERE account = ?", (account,)).fetchone()
+        return row or (None, 0)
+
+    def set_checkpoint(self, account: str, uidvalidity: int, last_uid: int) -> None:
+        self.db.execute("INSERT OR REPLACE INTO checkpoint VALUES (?, ?, ?)", (account, uidvalidity, last_uid))
+
+    def __contains__(self, report_id: str) -> bool:
+        return self.db.execute("SELECT 1 FROM reports WHERE report_id = ?", (report_id,)).fetchone() is not None
+
+    def add(self, report_id: str, received: date, reporter: str, domains: dict[str, list[int]]) -> None:
+        if report_id in self:
+            return
+        self.db.execute("INSERT INTO reports VALUES (?, ?)", (report_id, received.isoformat()))
+        self.db.executemany(
+            "INSERT INTO report_stats VALUES (?, ?, ?, ?, ?)",
+            [(report_id, reporter, domain, successful, failure) for domain, (successful, failure) in domains.items()],
+        )
+
+    def evict(self, since: date) -> None:
+        """
+        Remove all reports received before the given date.
+        """
+        self.db.execute(
+            "DELETE FROM report_stats WHERE report_id IN (SELECT report_id FROM reports WHERE received < ?)",
+            (since.isoformat(),),
+        )
+        if self.db.execute("DELETE FROM reports WHERE received < ?", (since.isoformat(),)).rowcount:
+            self.db.commit()
+            self.db.execute("PRAGMA incremental_vacuum")
+
+    def get_stats(self, since: date) -> Iterator[tuple[str, str, int, int]]:
+        """
+        Returns:
+            The summed successful and failed sessions per reporter and domain.
+        """
+        return self.db.execute(
+            "SELECT reporter, domain, SUM(successful), SUM(failure) FROM report_stats "
+            "JOIN reports USING (report_id) WHERE received >= ? "
+            "GROUP BY reporter, domain ORDER BY MIN(report_stats.rowid)",
+            (since.isoformat(),),
+        )
 
 
 class TLSReportMonitor(Monitor):
@@ -18,12 +113,147 @@ class TLSReportMonitor(Monitor):
         imap_pass: str,
         imap_filter: str,
         max_age: int,
+        imap_sessions: ImapSessionPool = IMAP_SESSIONS,
+        state_file: str | None = STATE_FILE,
+        buffer_size: int = BUFFER_SIZE,
+        timeseries_dir: str | None = TIMESERIES_DIR,
     ):
+        """
+        Args:
+            state_file: sqlite database used for caching the UID checkpoint and the statistics of already
+                processed reports between runs (None: process all reports on every run).
+            buffer_size: maximum number of bytes buffered while downloading and decompressing a report.
+                Larger attachments are streamed in chunks of this size.
+            timeseries_dir: time-series store that records the successful and failed sessions per policy domain
+                within max_age (None: disable the history).
+        """
         self.imap_server = imap_server
         self.imap_user = imap_user
         self.imap_pass = imap_pass
         self.imap_filter = imap_filter
         self.since = date.today() - timedelta(days=max_age)
+        self.imap_sessions = imap_sessions
+        self.state_file = state_file
+        self.buffer_size = buffer_size
+        self.timeseries = TimeSeriesStore(timeseries_dir) if timeseries_dir else None
+
+    @staticmethod
+    def get_report_id(envelope: list | None) -> str | None:
+        """
+        Returns:
+            The report-id announced in the report's subject (RFC 8460, section 5.3).
+        """
+        if not envelope or not envelope[1]:
+            return None
+        subject = envelope[1]
+        if isinstance(subject, bytes):
+            subject = subject.decode("utf-8", errors="replace")
+        match = RE_REPORT_ID.search(str(make_header(decode_header(subject))))
+        return match.group(1) if match else None
+
+    def parse_report(self, chunks: Iterable[bytes]) -> tuple[str | None, str, dict[str, list[int]]]:
+        """
+        Parse the gzip compressed report provided by the given chunks as an event stream, so that only the
+        summary counters (and not the report's failure details) are kept in memory.
+
+        Returns:
+            The report-id, the reporter and a mapping of policy domains to their successful and failed
+            session counts.
+        """
+        report_id = reporter = None
+        domains = {}
+        for prefix, event, value in parse(self.gunzip(chunks)):
+            if prefix == "report-id":
+                report_id = value
+            elif prefix == "contact-info":
+                reporter = value
+            elif prefix == "policies.item" and event == "start_map":
+                domain, successful, failure = None, 0, 0
+            elif prefix == "policies.item.policy.policy-domain":
+                domain = value
+            elif prefix == "policies.item.summary.total-successful-session-count":
+                successful = value
+            elif prefix == "policies.item.summary.total-failure-session-count":
+                failure = value
+            elif prefix == "policies.item" and event == "end_map":
+                counts = domains.setdefault(domain, [0, 0])
+                counts[0] += successful
+                counts[1] += failure
+        return report_id, reporter, domains
+
+    def gunzip(self, chunks: Iterable[bytes]) -> Iterator[str]:
+        """
+        Decompress the given chunks into text chunks of at most buffer_size bytes.
+        """
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 32)  # gzip or zlib header
+        decoder = getincrementaldecoder("utf-8")()
+        for chunk in chunks:
+            while chunk:
+                yield decoder.decode(decompressor.decompress(chunk, self.buffer_size))
+                chunk = decompressor.unconsumed_tail
+        yield decoder.decode(decompressor.flush(), final=True)
+
+    def fetch_new_reports(self, imap: IMAP4, cache: TLSReportCache) -> None:
+        """
+        Add the reports of all messages above the account's UID watermark to the cache.
+        """
+        account = f"{self.imap_server}|{self.imap_user}|{self.imap_filter}"
+        _, data = imap.status("INBOX", "(UIDVALIDITY)")
+        uidvalidity = int(RE_UIDVALIDITY.search(data[0]).group(1))
+        cached_uidvalidity, last_uid = cache.get_checkpoint(account)
+        if uidvalidity != cached_uidvalidity:
+            # UIDs from a previous mailbox incarnation are meaningless; the report-ids prevent double counting
+            last_uid = 0
+
+        _, messages = imap.uid(
+            "SEARCH",
+            None,
+            "({} UID {}:* SINCE {})".format(self.imap_filter, last_uid + 1, self.since.strftime("%d-%b-%Y")),
+        )
+        # "UID n:*" always matches the mailbox's last message, even if its UID is smaller than n
+        uids = [int(uid) for uid in messages[0].split() if int(uid) > last_uid]
+        if not uids:
+            cache.set_checkpoint(account, uidvalidity, last_uid)
+            return
+
+        # messages are processed in batches, so that memory does not grow with the number of reports
+        for structures in iter_structures(imap, uids, items=("INTERNALDATE", "ENVELOPE")):
+            self.add_reports(imap, cache, uidvalidity, structures)
+        cache.set_checkpoint(account, uidvalidity, max(last_uid, *uids))
+
+    def add_reports(self, imap: IMAP4, cache: TLSReportCache, uidvalidity: int, structures: dict) -> None:
+        """
+        Add the reports attached to the given messages to the cache.
+
+        Args:
+            structures: the fetched INTERNALDATE, ENVELOPE and body parts of a batch of messages.
+        """
+
+        def add_report(uid: int, part: BodyPart, chunks: Iterable[bytes]) -> None:
+            received = Internaldate2tuple(f'INTERNALDATE "{structures[uid]["INTERNALDATE"]}"'.encode())
+            report_id, reporter, domains = self.parse_report(chunks)
+            cache.add(report_id or f"{uidvalidity}:{uid}:{part.section}", date(*received[:3]), reporter, domains)
+
+        # only download the attachments of reports that are not yet cached
+        attachments = {
+            uid: [part for part in attributes["PARTS"] if part.disposition == "attachment"]
+            for uid, attributes in structures.items()
+            if self.get_report_id(attributes.get("ENVELOPE")) not in cache
+        }
+        # small attachments are downloaded in batches of at most buffer_size bytes, which are parsed before the
+        # next batch is fetched; large attachments are streamed
+        small_parts = {
+            uid: [part for part in parts if part.size <= self.buffer_size] for uid, parts in attachments.items()
+        }
+        parts_by_section = {(uid, part.section): part for uid, parts in small_parts.items() for part in parts}
+        for contents in fetch_sections(imap, small_parts, buffer_size=self.buffer_size):
+            for (uid, section), content in contents.items():
+                part = parts_by_section[uid, section]
+                add_report(uid, part, [decode_part(part, content)])
+        for uid, parts in attachments.items():
+            for part in parts:
+                if part.size > self.buffer_size:
+                    add_report(uid, part, iter_section(imap, uid, part, self.buffer_size))
 
     def compute_stats(self):
         """
@@ -31,47 +261,21 @@ class TLSReportMonitor(Monitor):
             The number of failures and a dictionary with per reporter and
             domain statistics.
         """
-        stats = defaultdict(dict)
-        failures = 0
-        with IMAP4_SSL(self.imap_server) as imap:
-            imap.login(self.imap_user, self.imap_pass)
-            imap.select("INBOX")
-            _, messages = imap.search(
-                None,
-                "({} SINCE {})".format(self.imap_filter, self.since.strftime("%d-%b-%Y")),
-            )
-            for msg in messages[0].split(b" "):
-                _, data = imap.fetch(msg, "(RFC822)")
-
-                for response in data:
-                    if isinstance(response, tuple):
-                        msg = email.message_from_bytes(response[1])
-
-                        if not msg.is_multipart():
-                            print("Message is not multipart!")
-                            continue
-
-                        for part in msg.walk():
-                            content_disposition = str(part.get("Content-Disposition"))
-                            if content_disposition.startswith("attachment"):
-                                content = part.get_payload(decode=True)
-                                content = decompress(content)
-                                j = loads(content)
-
-                                reporter = j["contact-info"]
-                                for policy in j["policies"]:
-                                    domain = policy["policy"]["policy-domain"]
-                                    if domain not in stats[reporter]:
-                                        stats[reporter][domain] = {}
-                                    stats[reporter][domain]["successful"] = (
-                                        stats[reporter][domain].get("successful", 0)
-                                        + policy["summary"]["total-successful-session-count"]
-                                    )
-                                    stats[reporter][domain]["failure"] = (
-                                        stats[reporter][domain].get("failure", 0)
-                                        + policy["summary"]["total-failure-session-count"]
-                                    )
-                                    failures += policy["summary"]["total-failure-session-count"]
+        cache = TLSReportCache(self.state_file)
+        try:
+            with self.imap_sessions.session(self.imap_server, self.imap_user, self.imap_pass) as imap:
+                self.fetch_new_reports(imap, cache)
+
+            # compact reports that have left the monitored time window
+            cache.evict(self.since)
+
+            stats = defaultdict(dict)
+            failures = 0
+            for reporter, domain, successful, failure in cache.get_stats(self.since):
+                stats[reporter][domain] = {"successful": successful, "failure": failure}
+                failures += failure
+        finally:
+            cache.close()
 
         return failures, stats
 
@@ -89,7 +293,7 @@ class TLSReportMonitor(Monitor):
 
         for no, reporter in enumerate(stats, 1):
             r.append(f"{no}. {reporter}")
-            r.append(
+            r.extend(
                 "   - {}: successful: {}, failure: {}".format(
                     domain,
                     stats[reporter][domain]["successful"],
@@ -99,12 +303,26 @@ class TLSReportMonitor(Monitor):
             )
         return "\n".join(r)
 
+    def record_stats(self, stats) -> None:
+        """
+        Record the successful and failed sessions per policy domain (summed over all reporters).
+        """
+        samples = defaultdict(int)
+        for domains in stats.values():
+            for domain, counts in domains.items():
+                samples[f"tlsreport.{domain}.successful"] += counts["successful"]
+                samples[f"tlsreport.{domain}.failure"] += counts["failure"]
+        self.timeseries.append_all(samples)
+
     def notify(self, force=True):
         try:
             failures, stats = self.compute_stats()
         except IMAP4.error as e:
             return "WARNING: failed to access the impact account - " + str(e)
 
+        if self.timeseries:
+            self.record_stats(stats)
+
         if failures > 0 or force:
             return self.format_statisics(stats, failures)
         return ""
@@ -0,0 +1,139 @@
+"""
+Minimal generic netlink client (Linux only).
+"""
+
+import os
+import socket
+import struct
+from collections.abc import Iterator
+from threading import Thread
+
+NETLINK_GENERIC = 16
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+NLA_TYPE_MASK = 0x3FFF  # strips the NLA_F_NESTED and NLA_F_NET_BYTEORDER flags
+
+NLMSGHDR = struct.Struct("=IHHII")
+GENLMSGHDR = struct.Struct("=BBH")
+NLATTR = struct.Struct("=HH")
+NETNS_DIR = "/run/netns"
+RECEIVE_BUFFER = 1 << 16
+
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def encode_attribute(attribute_type: int, value: bytes) -> bytes:
+    length = NLATTR.size + len(value)
+    return NLATTR.pack(length, attribute_type) + value + b"\0" * (_align(length) - length)
+
+
+def parse_attributes(data: bytes) -> Iterator[tuple[int, bytes]]:
+    """
+    Yield the (type, value) pairs of the netlink attributes in the given buffer.
+    """
+    pos = 0
+    while pos + NLATTR.size <= len(data):
+        length, attribute_type = NLATTR.unpack_from(data, pos)
+        if length < NLATTR.size:
+            break
+        yield attribute_type & NLA_TYPE_MASK, data[pos + NLATTR.size : pos + length]
+        pos += _align(length)
+
+
+def open_socket(namespace: str | None = None) -> socket.socket:
+    """
+    Open a generic netlink socket in the given network namespace (as created by `ip netns`).
+
+    Note:
+        The socket remains bound to the namespace it has been created in. The namespace is entered by a
+        short-lived helper thread, so that the namespace of the calling thread is not affected.
+    """
+    if not namespace:
+        return socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+
+    result = {}
+
+    def create_socket_in_namespace():
+        try:
+            with open(os.path.join(NETNS_DIR, namespace)) as netns:
+                os.setns(netns.fileno(), os.CLONE_NEWNET)
+            result["socket"] = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+        except (OSError, AttributeError) as e:
+            result["error"] = e
+
+    thread = Thread(target=create_socket_in_namespace)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        msg = f"Cannot open netlink socket in namespace {namespace}: {result['error']}"
+        raise OSError(msg)
+    return result["socket"]
+
+
+class GenericNetlink:
+    def __init__(self, namespace: str | None = None):
+        self.socket = open_socket(namespace)
+        self.socket.bind((0, 0))
+        self.sequence = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        self.socket.close()
+
+    def request(self, family: int, command: int, version: int, attributes: bytes, flags: int) -> Iterator[bytes]:
+        """
+        Send a generic netlink request.
+
+        Yields:
+            The attribute payload of every response message.
+        """
+        self.sequence += 1
+        payload = GENLMSGHDR.pack(command, version, 0) + attributes
+        header = NLMSGHDR.pack(NLMSGHDR.size + len(payload), family, NLM_F_REQUEST | flags, self.sequence, 0)
+        self.socket.send(header + payload)
+
+        while True:
+            data = self.socket.recv(RECEIVE_BUFFER)
+            pos = 0
+            while pos + NLMSGHDR.size <= len(data):
+                length, message_type, _, sequence, _ = NLMSGHDR.unpack_from(data, pos)
+                message = data[pos + NLMSGHDR.size : pos + length]
+                pos += _align(length)
+                if sequence != self.sequence:
+                    continue
+                if message_type == NLMSG_DONE:
+                    return
+                if message_type == NLMSG_ERROR:
+                    error = -struct.unpack_from("=i", message)[0]
+                    if error:
+                        raise OSError(error, os.strerror(error))
+                    return  # acknowledgement
+                yield message[GENLMSGHDR.size :]
+
+    def get_family_id(self, name: str) -> int:
+        """
+        Returns:
+            The id of the generic netlink family with the given name.
+        """
+        attributes = encode_attribute(CTRL_ATTR_FAMILY_NAME, name.encode() + b"\0")
+        for message in self.request(GENL_ID_CTRL, CTRL_CMD_GETFAMILY, 1, attributes, NLM_F_ACK):
+            for attribute_type, value in parse_attributes(message):
+                if attribute_type == CTRL_ATTR_FAMILY_ID:
+                    return struct.unpack("=H", value)[0]
+        msg = f"Generic netlink family {name} not found."
+        raise OSError(msg)
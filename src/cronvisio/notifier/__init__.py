@@ -5,3 +5,8 @@ class Notifier:
     @abstractmethod
     def send_notifications(self, msg):
         pass
+
+    def close(self):
+        """
+        Release the resources (e.g., connections) held by the notifier.
+        """
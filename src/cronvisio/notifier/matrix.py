@@ -1,53 +1,105 @@
 import asyncio
+from threading import Lock
 
-from nio import AsyncClient
+from nio import AsyncClient, AsyncClientConfig, RoomSendError
 
 from cronvisio.notifier import Notifier
 
+MAX_RETRIES = 5
+DEFAULT_RETRY_AFTER_MS = 5000
+REQUEST_TIMEOUT = 30
+
 
 class MatrixNotifier(Notifier):
-    def __init__(self, homeserver: str, user_id: str, access_token: str, room_id: str):
+    def __init__(
+        self,
+        homeserver: str,
+        user_id: str,
+        access_token: str,
+        room_id: str,
+        max_retries: int = MAX_RETRIES,
+    ):
+        """
+        Args:
+            max_retries: number of retries per message after rate limiting (HTTP 429) or timeouts.
+
+        Note:
+            All messages are sent through a single client (and connection pool) that is driven by the
+            notifier's own event loop. Messages are sent one after another, so that they appear in the room in
+            the order of the monitors.
+        """
         self.homeserver = homeserver
         self.user_id = user_id
         self.access_token = access_token
         self.room_id = room_id
+        self.max_retries = max_retries
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.client: AsyncClient | None = None
+        self.lock = Lock()
+        # loop time before which no message is sent, as requested by the homeserver's rate limiting
+        self.resume_at = 0.0
+
+    def run(self, coroutine):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+            return self.loop.run_until_complete(coroutine)
 
-    @staticmethod
-    async def send_matrix_message(homeserver, user_id, access_token, room_id, message):
+    async def get_client(self) -> AsyncClient:
+        if self.client is None:
+            # rate limiting is handled by send_matrix_message, so that the pause also applies to later calls
+            config = AsyncClientConfig(
+                max_limit_exceeded=0, max_timeouts=self.max_retries, request_timeout=REQUEST_TIMEOUT
+            )
+            self.client = AsyncClient(self.homeserver, config=config)
+            self.client.access_token = self.access_token
+            self.client.user_id = self.user_id
+        return self.client
+
+    async def send_matrix_message(self, message: str) -> None:
         """
-        Sends the given message to the given matrix server.
+        Sends the given message to the notifier's room.
         """
-        client = AsyncClient(homeserver)
-        client.access_token = access_token
-        client.user_id = user_id
+        client = await self.get_client()
+        loop = asyncio.get_running_loop()
+        for _ in range(self.max_retries + 1):
+            if (delay := self.resume_at - loop.time()) > 0:
+                await asyncio.sleep(delay)
+            response = await client.room_send(
+                self.room_id,
+                message_type="m.room.message",
+                content={"msgtype": "m.text", "body": message},
+            )
+            if not isinstance(response, RoomSendError):
+                return
+            if response.status_code != "M_LIMIT_EXCEEDED":
+                raise RuntimeError(str(response))
+            retry_after = (response.retry_after_ms or DEFAULT_RETRY_AFTER_MS) / 1000
+            self.resume_at = max(self.resume_at, loop.time() + retry_after)
+        msg = f"Rate limit exceeded after {self.max_retries} retries."
+        raise RuntimeError(msg)
 
-        await client.room_send(
-            room_id,
-            message_type="m.room.message",
-            content={"msgtype": "m.text", "body": message},
-        )
-        await client.close()
+    async def send_matrix_messages(self, messages: list[str]) -> None:
+        """
+        Sends the given messages in order; a failed message does not prevent sending the remaining ones.
+        """
+        errors = []
+        for message in messages:
+            try:
+                await self.send_matrix_message(message)
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            msg = f"{len(errors)} of {len(messages)} Matrix messages could not be sent - {errors[0]}"
+            raise RuntimeError(msg)
 
     def send_notifications(self, messages):
-        for msg in messages:
-            if isinstance(msg, str):
-                asyncio.get_event_loop().run_until_complete(
-                    self.send_matrix_message(
-                        homeserver=self.homeserver,
-                        user_id=self.user_id,
-                        access_token=self.access_token,
-                        room_id=self.room_id,
-                        message=msg,
-                    )
-                )
-            else:
-                for m in msg:
-                    asyncio.get_event_loop().run_until_complete(
-                        self.send_matrix_message(
-                            homeserver=self.homeserver,
-                            user_id=self.user_id,
-                            access_token=self.access_token,
-                            room_id=self.room_id,
-                            message=m,
-                        )
-                    )
+        self.run(self.send_matrix_messages([m for msg in messages for m in ([msg] if isinstance(msg, str) else msg)]))
+
+    def close(self):
+        if self.client is not None:
+            self.run(self.client.close())
+            self.client = None
+        if self.loop is not None:
+            self.loop.close()
+            self.loop = None
@@ -0,0 +1,221 @@
+"""
+Config-driven registry that creates the monitors and notifiers of a group.
+
+Monitor and notifier classes are referenced by name ("module:Class") and only imported when they are
+instantiated, so that a run does not pay for importing modules (e.g., nio) it does not use.
+
+Monitors and notifiers are named after their configuration section; "matrix.updates", for instance, refers to a
+MatrixNotifier created with the settings in config["matrix"]["updates"].
+
+Third-party packages provide additional monitors and notifiers through the "cronvisio.monitors" and
+"cronvisio.notifiers" entry point groups, e.g. in their pyproject.toml:
+
+    [project.entry-points."cronvisio.monitors"]
+    raid_monitor = "acme_monitors.raid:RaidMonitor"
+"""
+
+import os
+import sys
+from importlib import import_module
+from json import dump, load
+from threading import Lock
+
+from cronvisio import Cronitor, Delivery, metrics
+from cronvisio.fileutil import atomic_write
+from cronvisio.monitor import Monitor
+from cronvisio.notifier import Notifier
+
+MONITORS = {
+    "amazon_kindle_quotes": "cronvisio.monitor.amazon_kindle_quotes:AmazonKindleQuotes",
+    "automysqlbackup_monitor": "cronvisio.monitor.automysqlbackup:AutoMysqlBackup",
+    "borgbackup_monitor": "cronvisio.monitor.borgbackup:BorgBackupMonitor",
+    "postfix_monitor": "cronvisio.monitor.postfix:PostfixMonitor",
+    "smtp_monitor": "cronvisio.monitor.smtp:SmtpMonitor",
+    "tlsreport_monitor": "cronvisio.monitor.tlsreport:TLSReportMonitor",
+    "wireguard_monitor": "cronvisio.monitor.wireguard:WireguardMonitor",
+}
+NOTIFIERS = {
+    "matrix": "cronvisio.notifier.matrix:MatrixNotifier",
+    "stdout": "cronvisio.notifier.stdout:StdoutNotifier",
+}
+
+ENTRY_POINT_GROUPS = {"monitors": "cronvisio.monitors", "notifiers": "cronvisio.notifiers"}
+ENTRY_POINT_INDEX = ".cronvisio-entry-points"
+DISTRIBUTION_METADATA = (".dist-info", ".egg-info")
+
+# groups used if cronvisio.json does not declare any
+DEFAULT_GROUPS = {
+    "hourly": {"monitors": ["amazon_kindle_quotes"], "notifiers": ["matrix.delight"]},
+    "daily": {"monitors": ["tlsreport_monitor", "automysqlbackup_monitor"], "notifiers": ["matrix.updates"]},
+    "weekly": {
+        "monitors": ["postfix_monitor", "tlsreport_monitor", "borgbackup_monitor"],
+        "notifiers": ["matrix.updates"],
+        "force": True,
+    },
+}
+
+
+def load_class(reference: str, base: type) -> type:
+    """
+    Returns:
+        The class referenced as "module:Class", which needs to be a subclass of base.
+    """
+    module, _, name = reference.partition(":")
+    cls = getattr(import_module(module), name)
+    if not (isinstance(cls, type) and issubclass(cls, base)):
+        msg = f"{reference} is not a {base.__name__}."
+        raise TypeError(msg)
+    return cls
+
+
+def path_fingerprint() -> list[list]:
+    """
+    Returns:
+        The name and modification time of all distribution metadata directories on sys.path; installing, upgrading
+        or removing a distribution (re)creates or deletes its metadata directory.
+
+    Note:
+        The modification times of the sys.path directories themselves are not suitable, since "" (the working
+        directory) also contains the index file and cronvisio's other state files.
+    """
+    fingerprint = []
+    for path in sys.path:
+        try:
+            with os.scandir(path or ".") as entries:
+                distributions = sorted(
+                    [entry.name, entry.stat().st_mtime_ns]
+                    for entry in entries
+                    if entry.name.endswith(DISTRIBUTION_METADATA)
+                )
+        except OSError:
+            continue
+        fingerprint.append([path, distributions])
+    return fingerprint
+
+
+def discover_entry_points(index_file: str | None = ENTRY_POINT_INDEX) -> dict[str, dict[str, str]]:
+    """
+    Returns:
+        The class reference per name of all monitors and notifiers provided by installed distributions.
+
+    Note:
+        Scanning all installed distributions is comparatively slow; the result is therefore cached in the
+        index file until sys.path or the content of one of its directories changes.
+    """
+    fingerprint = path_fingerprint()
+    try:
+        with open(index_file) as f:
+            index = load(f)
+        if index["fingerprint"] == fingerprint:
+            return index["entry_points"]
+    except (FileNotFoundError, TypeError, ValueError, KeyError):
+        pass
+
+    from importlib.metadata import entry_points
+
+    discovered = {
+        kind: {entry_point.name: entry_point.value for entry_point in entry_points(group=group)}
+        for kind, group in ENTRY_POINT_GROUPS.items()
+    }
+    if index_file:
+        with atomic_write(index_file) as f:
+            dump({"fingerprint": fingerprint, "entry_points": discovered}, f)
+    return discovered
+
+
+class Registry:
+    def __init__(
+        self,
+        config: dict,
+        monitors: dict[str, str] | None = None,
+        notifiers: dict[str, str] | None = None,
+        nonotify: bool = False,
+        entry_point_index: str | None = ENTRY_POINT_INDEX,
+    ):
+        """
+        Args:
+            config: the content of cronvisio.json.
+            monitors: class reference per monitor type (default: the built-in and installed monitors).
+            notifiers: class reference per notifier type (default: the built-in and installed notifiers).
+            nonotify: replace all notifiers with a StdoutNotifier (for debugging).
+            entry_point_index: file that caches the discovered entry points (None: disable the cache).
+        """
+        if monitors is None or notifiers is None:
+            discovered = discover_entry_points(entry_point_index)
+            # built-in classes take precedence over plugins with the same name
+            monitors = monitors or {**discovered["monitors"], **MONITORS}
+            notifiers = notifiers or {**discovered["notifiers"], **NOTIFIERS}
+        self.config = config
+        self.monitors = monitors
+        self.notifiers = notifiers
+        self.nonotify = nonotify
+        self.groups: dict[str, dict] = config.get("groups", DEFAULT_GROUPS)
+        if imap_options := config.get("imap"):
+            # the IMAP module is only imported, if its sessions are configured
+            from cronvisio.imap import IMAP_SESSIONS
+
+            IMAP_SESSIONS.timeout = imap_options.get("timeout", IMAP_SESSIONS.timeout)
+            IMAP_SESSIONS.lock_timeout = imap_options.get("lock_timeout", IMAP_SESSIONS.lock_timeout)
+        # notifiers (and their connections) are shared by all groups and runs
+        self.notifier_instances: dict[str, Notifier] = {}
+        self.lock = Lock()
+
+    def create(self, name: str, classes: dict[str, str], base: type):
+        """
+        Instantiate the monitor or notifier with the given name ("type" or "type.instance").
+        """
+        kind, _, instance = name.partition(".")
+        if kind not in classes:
+            msg = f"Unknown {base.__name__.lower()} {kind}."
+            raise ValueError(msg)
+        settings = self.config.get(kind, {})
+        if instance:
+            settings = settings[instance]
+        return load_class(classes[kind], base)(**settings)
+
+    def create_monitor(self, name: str) -> Monitor:
+        return self.create(name, self.monitors, Monitor)
+
+    def create_monitors(self, group: str) -> list[Monitor]:
+        return [self.create_monitor(name) for name in self.groups[group]["monitors"]]
+
+    def get_notifiers(self, names: list[str]) -> list[Notifier]:
+        """
+        Returns:
+            The notifiers with the given names; notifiers are created once and shared afterwards.
+        """
+        names = ["stdout"] if self.nonotify else names
+        with self.lock:
+            for name in names:
+                if name not in self.notifier_instances:
+                    self.notifier_instances[name] = self.create(name, self.notifiers, Notifier)
+            return [self.notifier_instances[name] for name in names]
+
+    def run_group(self, group: str) -> list[Delivery]:
+        """
+        Run the monitors of the given group (created anew for every run) and export the run's metrics as
+        configured in config["metrics"] (see `metrics.export`).
+
+        Returns:
+            The delivery result per notifier.
+        """
+        if group not in self.groups:
+            msg = f"Unsupported group {group}."
+            raise ValueError(msg)
+        with metrics.collect(group) as run_metrics:
+            deliveries = Cronitor.cronitor(
+                self.create_monitors(group),
+                self.get_notifiers(self.groups[group].get("notifiers", [])),
+                force=self.groups[group].get("force", False),
+                **self.config.get("cronitor", {}),
+            )
+        try:
+            metrics.export(run_metrics, **self.config.get("metrics", {}))
+        except OSError as e:
+            print(f"Warning: Cannot export the metrics of {group} - {e}")
+        return deliveries
+
+    def close(self) -> None:
+        for notifier in self.notifier_instances.values():
+            notifier.close()
+        self.notifier_instances.clear()
@@ -0,0 +1,99 @@
+"""
+Concurrent host name resolution with per-lookup timeouts and a TTL cache.
+"""
+
+import ipaddress
+import socket
+from collections.abc import Sequence
+from threading import Lock
+from time import monotonic
+
+from cronvisio.concurrency import run_concurrently
+
+# getaddrinfo does not expose the record's TTL; cached addresses therefore expire after a configurable period
+DEFAULT_TTL = 300
+DEFAULT_TIMEOUT = 5
+
+
+def strip_port(endpoint: str | None) -> str | None:
+    """
+    Returns:
+        The address of an endpoint in `wg`'s notation (e.g., 10.0.0.1:51820 or [2001:db8::1]:51820).
+    """
+    if not endpoint:
+        return None
+    return endpoint.rsplit(":", 1)[0].strip("[]")
+
+
+class Resolver:
+    def __init__(self, ttl: float = DEFAULT_TTL, timeout: float = DEFAULT_TIMEOUT, family: int = socket.AF_UNSPEC):
+        """
+        Args:
+            ttl: number of seconds a resolved address is served from the cache.
+            timeout: maximum duration of a single lookup in seconds.
+            family: restrict the lookups to socket.AF_INET or socket.AF_INET6.
+        """
+        self.ttl = ttl
+        self.timeout = timeout
+        self.family = family
+        self.cache: dict[str, tuple[float, str]] = {}
+        self.lock = Lock()
+
+    def lookup(self, hostname: str) -> str:
+        """
+        Resolve the given hostname (without consulting the cache).
+        """
+        addresses = socket.getaddrinfo(hostname, None, self.family, socket.SOCK_DGRAM)
+        return addresses[0][4][0]
+
+    def cached(self, hostname: str, current: str | None = None) -> str | None:
+        """
+        Returns:
+            The cached address of the given hostname, if it has not expired and matches the current address.
+        """
+        with self.lock:
+            expires, address = self.cache.get(hostname, (0, None))
+        if expires < monotonic() or (current and address != current):
+            return None
+        return address
+
+    def resolve(self, hostname: str, current: str | None = None) -> str | None:
+        return self.resolve_all([(hostname, current)])[0]
+
+    def resolve_all(
+        self, hostnames: Sequence[tuple[str, str | None]], max_workers: int | None = None
+    ) -> list[str | None]:
+        """
+        Resolve the given hostnames concurrently.
+
+        Args:
+            hostnames: (hostname, current address) pairs; the current address (e.g., the one a WireGuard peer
+                currently uses) invalidates a cache entry that differs from it.
+            max_workers: maximum number of concurrent lookups.
+
+        Returns:
+            The resolved addresses or None for hostnames that could not be resolved within the timeout.
+        """
+        addresses = {}
+        for hostname, current in hostnames:
+            try:
+                addresses[hostname] = str(ipaddress.ip_address(hostname))
+            except ValueError:
+                if (address := self.cached(hostname, current)) is not None:
+                    addresses[hostname] = address
+
+        pending = sorted({hostname for hostname, _ in hostnames if hostname not in addresses})
+        results = run_concurrently(
+            [lambda hostname=hostname: self.lookup(hostname) for hostname in pending], max_workers, self.timeout
+        )
+        for hostname, result in zip(pending, results, strict=True):
+            if result.error:
+                print(f"Error: Cannot resolve {hostname}: {result.error}")
+                continue
+            addresses[hostname] = result.value
+            with self.lock:
+                self.cache[hostname] = (monotonic() + self.ttl, result.value)
+        return [addresses.get(hostname) for hostname, _ in hostnames]
+
+
+RESOLVER = Resolver()
@@ -0,0 +1,125 @@
+"""
+In-process scheduler that periodically runs jobs without overlapping executions of the same job.
+"""
+
+import re
+from collections.abc import Callable
+from json import dump, load
+from threading import Event, Lock, Thread
+from time import time
+
+from cronvisio.fileutil import atomic_write
+
+STATE_FILE = ".cronvisio-schedule"
+MAX_SLEEP = 60  # re-check the schedule at least every minute (e.g., after a suspend or clock change)
+RE_INTERVAL = re.compile(r"(\d+(?:\.\d+)?)\s*([smhdw]?)")
+UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+INTERVALS = {"hourly": UNITS["h"], "daily": UNITS["d"], "weekly": UNITS["w"]}
+
+
+def parse_interval(interval: str | float) -> float:
+    """
+    Args:
+        interval: number of seconds, a duration such as "15m", "6h", "2d" or "1w", or hourly/daily/weekly.
+
+    Returns:
+        The interval in seconds.
+    """
+    if isinstance(interval, int | float):
+        return float(interval)
+    if interval in INTERVALS:
+        return float(INTERVALS[interval])
+    if not (match := RE_INTERVAL.fullmatch(interval.strip())):
+        msg = f"Invalid interval {interval}."
+        raise ValueError(msg)
+    return float(match.group(1)) * UNITS[match.group(2)]
+
+
+class Job:
+    def __init__(self, name: str, interval: float, action: Callable[[], object], next_run: float):
+        self.name = name
+        self.interval = interval
+        self.action = action
+        self.next_run = next_run
+        self.lock = Lock()
+
+
+class Scheduler:
+    def __init__(self, state_file: str | None = STATE_FILE):
+        """
+        Args:
+            state_file: file that records the start of each job's last run, so that a restarted scheduler
+                continues the schedule (None: run all jobs immediately after the start).
+        """
+        self.state_file = state_file
+        self.jobs: dict[str, Job] = {}
+        self.last_runs = self.load_state()
+        self.state_lock = Lock()
+        self.threads: list[Thread] = []
+
+    def load_state(self) -> dict[str, float]:
+        try:
+            with open(self.state_file) as f:
+                return load(f)
+        except (FileNotFoundError, TypeError, ValueError):
+            return {}
+
+    def save_state(self) -> None:
+        if not self.state_file:
+            return
+        with self.state_lock:
+            with atomic_write(self.state_file) as f:
+                dump(self.last_runs, f)
+
+    def add(self, name: str, interval: str | float, action: Callable[[], object]) -> None:
+        """
+        Schedule the given action every interval; overdue jobs run right after the scheduler's start.
+        """
+        interval = parse_interval(interval)
+        self.jobs[name] = Job(name, interval, action, self.last_runs.get(name, 0) + interval)
+
+    def run_pending(self, now: float | None = None) -> list[str]:
+        """
+        Start all due jobs in worker threads.
+
+        Returns:
+            The names of the started jobs.
+        """
+        now = now or time()
+        started = []
+        for job in self.jobs.values():
+            if job.next_run > now:
+                continue
+            # missed runs are not caught up
+            job.next_run = now + job.interval
+            if not job.lock.acquire(blocking=False):
+                print(f"Warning: Skipping {job.name} - the previous run is still in progress.")
+                continue
+            self.last_runs[job.name] = now
+            self.save_state()
+            thread = Thread(target=self.execute, args=(job,), name=f"cronvisio-{job.name}")
+            thread.start()
+            self.threads.append(thread)
+            started.append(job.name)
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        return started
+
+    @staticmethod
+    def execute(job: Job) -> None:
+        try:
+            job.action()
+        except Exception as e:
+            print(f"Error: {job.name} failed - {e}")
+        finally:
+            job.lock.release()
+
+    def run(self, stop: Event) -> None:
+        """
+        Run the scheduled jobs until `stop` is set and wait for running jobs to finish.
+        """
+        while not stop.is_set():
+            self.run_pending()
+            next_run = min((job.next_run for job in self.jobs.values()), default=time() + MAX_SLEEP)
+            stop.wait(min(max(0.0, next_run - time()), MAX_SLEEP))
+        for thread in self.threads:
+            thread.join()
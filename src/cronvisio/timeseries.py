@@ -0,0 +1,193 @@
+"""
+Compact, append-only store for the numeric measurements of monitors (e.g., queue sizes or backup counts).
+
+Every series is stored in one binary file per resolution with fixed-size (timestamp, value) records in
+chronological order. New samples are appended to the raw file. Samples that have outgrown a resolution's
+retention are averaged into buckets of the next coarser resolution; samples older than the last
+resolution's retention are dropped.
+"""
+
+import os
+import struct
+from collections.abc import Iterable
+from itertools import pairwise
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import NamedTuple
+from urllib.parse import quote
+
+from cronvisio.fileutil import atomic_write
+
+TIMESERIES_DIR = ".cronvisio-timeseries"
+# (resolution, retention) in seconds: raw samples for a week, hourly means for 90 days and daily means for 5 years
+RESOLUTIONS = ((0, 7 * 86400), (3600, 90 * 86400), (86400, 5 * 365 * 86400))
+RECORD = struct.Struct("<Id")  # Unix timestamp, value
+
+
+class Sample(NamedTuple):
+    timestamp: int
+    value: float
+
+
+class TimeSeriesStore:
+    # appends and compactions are serialized, since monitors run concurrently
+    lock = Lock()
+
+    def __init__(self, path: str | Path = TIMESERIES_DIR, resolutions: tuple[tuple[int, int], ...] = RESOLUTIONS):
+        """
+        Args:
+            path: directory that holds the series.
+            resolutions: (resolution, retention) pairs in seconds from the finest (0: raw samples) to the coarsest
+                resolution. Samples are kept at a resolution for its retention (measured from now).
+        """
+        self.path = Path(path)
+        self.resolutions = resolutions
+
+    def get_file(self, key: str, resolution: int) -> Path:
+        return self.path / f"{quote(key, safe='')}.{resolution}"
+
+    @staticmethod
+    def read(path: Path, offset: int = 0) -> list[Sample]:
+        """
+        Returns:
+            The samples stored in the given file, starting with the record at the given offset.
+        """
+        try:
+            with path.open("rb") as f:
+                f.seek(offset * RECORD.size)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        # a truncated trailing record (e.g., after a crash during an append) is ignored
+        end = len(data) - len(data) % RECORD.size
+        return [Sample(*record) for record in RECORD.iter_unpack(data[:end])]
+
+    @staticmethod
+    def find(path: Path, start: float) -> int:
+        """
+        Returns:
+            The offset of the first record of the given file with a timestamp >= start (binary search).
+        """
+        try:
+            with path.open("rb") as f:
+                low, high = 0, os.fstat(f.fileno()).st_size // RECORD.size
+                while low < high:
+                    middle = (low + high) // 2
+                    f.seek(middle * RECORD.size)
+                    if RECORD.unpack(f.read(RECORD.size))[0] < start:
+                        low = middle + 1
+                    else:
+                        high = middle
+        except FileNotFoundError:
+            return 0
+        return low
+
+    @staticmethod
+    def read_first(path: Path) -> Sample | None:
+        try:
+            with path.open("rb") as f:
+                data = f.read(RECORD.size)
+        except FileNotFoundError:
+            return None
+        return Sample(*RECORD.unpack(data)) if len(data) == RECORD.size else None
+
+    @staticmethod
+    def write(path: Path, samples: list[Sample]) -> None:
+        with atomic_write(path, "wb") as f:
+            f.write(b"".join(RECORD.pack(*sample) for sample in samples))
+
+    def append(self, key: str, value: float, timestamp: float | None = None) -> None:
+        """
+        Append a sample to the given series and compact the series, if samples have outgrown their resolution.
+        """
+        timestamp = int(time() if timestamp is None else timestamp)
+        with self.lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with self.get_file(key, self.resolutions[0][0]).open("ab") as f:
+                f.write(RECORD.pack(timestamp, value))
+            self.compact(key, timestamp)
+
+    def append_all(self, samples: dict[str, float], timestamp: float | None = None) -> None:
+        """
+        Append one sample per series (e.g., the backup count per host) with the same timestamp.
+        """
+        timestamp = time() if timestamp is None else timestamp
+        for key, value in samples.items():
+            self.append(key, value, timestamp)
+
+    def compact(self, key: str, now: float) -> None:
+        """
+        Move samples that have outgrown their resolution's retention into the next coarser resolution, which
+        only happens once per bucket of the coarser resolution.
+        """
+        for (resolution, retention), (next_resolution, _) in pairwise(self.resolutions):
+            path = self.get_file(key, resolution)
+            # only complete buckets are moved, so that a bucket is never split across compactions
+            cutoff = int(now - retention) // next_resolution * next_resolution
+            if (first := self.read_first(path)) is None or first.timestamp >= cutoff:
+                continue
+            samples = self.read(path)
+            expired = [sample for sample in samples if sample.timestamp < cutoff]
+            next_path = self.get_file(key, next_resolution)
+            with next_path.open("ab") as f:
+                f.write(b"".join(RECORD.pack(*sample) for sample in self.downsample(expired, next_resolution)))
+            self.write(path, samples[len(expired) :])
+
+        resolution, retention = self.resolutions[-1]
+        path = self.get_file(key, resolution)
+        if (first := self.read_first(path)) is not None and first.timestamp < now - retention - resolution:
+            self.write(path, [sample for sample in self.read(path) if sample.timestamp >= now - retention])
+
+    @staticmethod
+    def downsample(samples: Iterable[Sample], resolution: int) -> list[Sample]:
+        """
+        Returns:
+            The mean of the given (chronologically ordered) samples per bucket of the given resolution; the
+            bucket's start is used as its timestamp.
+        """
+        buckets: dict[int, list[float]] = {}
+        for timestamp, value in samples:
+            buckets.setdefault(timestamp // resolution * resolution, []).append(value)
+        return [Sample(start, sum(values) / len(values)) for start, values in buckets.items()]
+
+    def last(self, key: str, count: int) -> list[Sample]:
+        """
+        Returns:
+            The most recent samples of the given series in chronological order; samples from coarser
+            resolutions are used, if there are less than count raw samples.
+        """
+        result = []
+        for resolution, _ in self.resolutions:
+            path = self.get_file(key, resolution)
+            try:
+                records = path.stat().st_size // RECORD.size
+            except FileNotFoundError:
+                continue
+            result = self.read(path, max(0, records - (count - len(result))))[: count - len(result)] + result
+            if len(result) >= count:
+                break
+        return result
+
+    def since(self, key: str, start: float) -> list[Sample]:
+        """
+        Returns:
+            All samples of the given series from the given Unix timestamp on in chronological order.
+        """
+        samples = []
+        for resolution, _ in reversed(self.resolutions):
+            path = self.get_file(key, resolution)
+            samples += self.read(path, self.find(path, start))
+        return samples
+
+    def rate(self, key: str, window: float, now: float | None = None, per: float = 1.0) -> float | None:
+        """
+        Returns:
+            The change of the series' value per `per` seconds between the first sample within the given window
+            and the most recent sample, or None, if the window contains less than two samples.
+        """
+        now = time() if now is None else now
+        samples = self.since(key, now - window)
+        if len(samples) < 2 or samples[-1].timestamp == samples[0].timestamp:
+            return None
+        return (samples[-1].value - samples[0].value) / (samples[-1].timestamp - samples[0].timestamp) * per
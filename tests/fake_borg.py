@@ -0,0 +1,58 @@
+"""
+Fake borg executable that serves the archive listing of a fake repository.
+
+A fake repository contains the state files that borg rewrites on every transaction and a `listing` file with one
+"start<TAB>name" line per archive. The fake records its invocations in the repository's `calls` file and fails or
+hangs, if the repository contains an `error` or `hang` file.
+"""
+
+import sys
+from pathlib import Path
+
+FAKE_BORG = """#!{python}
+import sys, time
+from pathlib import Path
+
+repository = Path(sys.argv[-1])
+with (repository / "calls").open("a") as f:
+    f.write(" ".join(sys.argv[1:-1]) + "\\n")
+if (repository / "error").exists():
+    sys.exit((repository / "error").read_text() or 2)
+if (repository / "hang").exists():
+    time.sleep(10)
+lines = (repository / "listing").read_text().splitlines(keepends=True)
+if "--last" in sys.argv:
+    lines = lines[-int(sys.argv[sys.argv.index("--last") + 1]):]
+sys.stdout.writelines(lines)
+"""
+
+
+def install_fake_borg(bin_dir: Path) -> Path:
+    """
+    Returns:
+        The directory with the fake borg executable, which has to be put on the PATH.
+    """
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    borg = bin_dir / "borg"
+    borg.write_text(FAKE_BORG.format(python=sys.executable))
+    borg.chmod(0o755)
+    return bin_dir
+
+
+def write_listing(repository: Path, archives: list[dict]) -> None:
+    (repository / "listing").write_text("".join(f"{a['start']}\t{a['name']}\n" for a in archives))
+
+
+def create_repository(path: Path, archives: list[dict] = ()) -> Path:
+    path.mkdir(parents=True)
+    (path / "index.42").write_bytes(b"index")
+    (path / "hints.42").write_bytes(b"hints")
+    write_listing(path, archives)
+    return path
+
+
+def borg_calls(repository: Path) -> list[str]:
+    try:
+        return (repository / "calls").read_text().splitlines()
+    except FileNotFoundError:
+        return []
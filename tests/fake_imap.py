@@ -0,0 +1,143 @@
+"""
+In-memory stand-in for an imaplib connection.
+
+The fake implements the subset of the IMAP protocol used by cronvisio (STATUS, UID SEARCH and UID FETCH of
+INTERNALDATE, ENVELOPE, BODYSTRUCTURE and BODY.PEEK sections) and returns responses in imaplib's format.
+"""
+
+import re
+from contextlib import contextmanager
+from datetime import date
+from email import message_from_bytes
+from email.message import Message
+
+RE_SECTION = re.compile(r"BODY\.PEEK\[([\d.]+)\](?:<(\d+)\.(\d+)>)?")
+
+
+def _quote(value: str | None) -> str:
+    if value is None:
+        return "NIL"
+    return '"{}"'.format(value.replace("\\", "\\\\").replace('"', '\\"'))
+
+
+def _params(params: list[tuple[str, str]]) -> str:
+    if not params:
+        return "NIL"
+    return "({})".format(" ".join(f"{_quote(key)} {_quote(value)}" for key, value in params))
+
+
+def bodystructure(part: Message) -> str:
+    """
+    Returns:
+        The IMAP BODYSTRUCTURE of the given message.
+    """
+    if part.is_multipart():
+        children = "".join(bodystructure(child) for child in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype())} {_params(part.get_params()[1:])} NIL NIL)"
+
+    payload = part.get_payload().encode("utf-8")
+    fields = [
+        _quote(part.get_content_maintype()),
+        _quote(part.get_content_subtype()),
+        _params(part.get_params()[1:]),
+        "NIL",
+        "NIL",
+        _quote(part.get("Content-Transfer-Encoding", "7bit")),
+        str(len(payload)),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(str(payload.count(b"\n")))
+    fields.append("NIL")  # md5
+    if disposition := part.get_content_disposition():
+        filename = [("filename", part.get_filename())] if part.get_filename() else []
+        fields.append(f"({_quote(disposition)} {_params(filename)})")
+    else:
+        fields.append("NIL")
+    return "({})".format(" ".join(fields))
+
+
+def section(part: Message, section: str) -> bytes:
+    """
+    Returns:
+        The raw content of the given body section.
+    """
+    for no in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(no) - 1]
+    return part.get_payload().encode("utf-8")
+
+
+class FakeImap:
+    def __init__(self, uidvalidity: int = 1):
+        self.uidvalidity = uidvalidity
+        self.messages = {}
+        self.commands = []
+
+    def add(self, uid: int, message: bytes, received: date | None = None):
+        self.messages[uid] = ((received or date.today()).strftime("%d-%b-%Y 10:00:00 +0000"), message)
+
+    @property
+    def fetched(self) -> list[int]:
+        """
+        Returns:
+            The UIDs of all messages whose content has been fetched.
+        """
+        return sorted(
+            uid for command, uids, items in self.commands if command == "FETCH" and "BODY.PEEK" in items for uid in uids
+        )
+
+    @staticmethod
+    def parse_uid_set(uid_set: str, messages: dict) -> list[int]:
+        uids = []
+        for uid_range in uid_set.split(","):
+            first, _, last = uid_range.partition(":")
+            last = max(messages, default=0) if last == "*" else int(last or first)
+            uids.extend(uid for uid in sorted(messages) if int(first) <= uid <= last)
+        return uids
+
+    def status(self, mailbox, names):
+        return "OK", [f"{mailbox} (UIDVALIDITY {self.uidvalidity})".encode()]
+
+    def uid(self, command, *args):
+        if command == "SEARCH":
+            criteria = args[1]
+            uids = sorted(self.messages)
+            if match := re.search(r"UID (\d+):\*", criteria):
+                uids = [uid for uid in uids if uid >= int(match.group(1))] or uids[-1:]
+            self.commands.append((command, uids, criteria))
+            return "OK", [" ".join(map(str, uids)).encode()]
+
+        uids = self.parse_uid_set(args[0], self.messages)
+        items = args[1]
+        self.commands.append((command, uids, items))
+        data = []
+        for uid in uids:
+            internaldate, raw = self.messages[uid]
+            msg = message_from_bytes(raw)
+            prefix = f"{uid} (UID {uid}"
+            if "INTERNALDATE" in items:
+                prefix += f' INTERNALDATE "{internaldate}"'
+            if "ENVELOPE" in items:
+                envelope = [_quote(msg["Date"]), _quote(msg["Subject"]), *["NIL"] * 7, _quote(msg["Message-ID"])]
+                prefix += " ENVELOPE ({})".format(" ".join(envelope))
+            if "BODYSTRUCTURE" in items:
+                prefix += f" BODYSTRUCTURE {bodystructure(msg)}"
+            for no, offset, length in RE_SECTION.findall(items):
+                content = section(msg, no)
+                key = f"BODY[{no}]"
+                if offset:
+                    content = content[int(offset) : int(offset) + int(length)]
+                    key += f"<{offset}>"
+                data.append((f"{prefix} {key} {{{len(content)}}}".encode(), content))
+                prefix = ""
+            data.append(f"{prefix})".encode())
+        return "OK", data
+
+
+class FakeSessionPool:
+    def __init__(self, imap: FakeImap):
+        self.imap = imap
+
+    @contextmanager
+    def session(self, *args, **kwargs):
+        yield self.imap
@@ -1,7 +1,11 @@
 import gzip
+from email.message import EmailMessage
+from hashlib import md5
 from pathlib import Path
 
-from cronvisio.monitor.amazon_kindle_quotes import AmazonKindleQuotes
+from cronvisio.hashstore import HashStore
+from cronvisio.monitor.amazon_kindle_quotes import QUOTE_CACHE_FILE, QUOTE_STORE_FILE, AmazonKindleQuotes
+from fake_imap import FakeImap, FakeSessionPool
 
 KINDLE_EXAMPLES = Path(__file__).parent / "data" / "kindle"
 
@@ -15,3 +19,45 @@ def test_parse_borgbackup_output():
 
         assert "//amzn.eu" not in extracted_text
         assert "//amzn.to" not in extracted_text
+
+
+def test_get_quotes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    imap = FakeImap()
+    for uid, example in enumerate(sorted(KINDLE_EXAMPLES.glob("*.txt.gz")), 1):
+        msg = EmailMessage()
+        msg["Subject"] = "Kindle quote"
+        msg.set_content(gzip.open(example, mode="rt").read(), cte="quoted-printable")
+        msg.add_alternative("<html><body>quote</body></html>", subtype="html")
+        imap.add(uid, msg.as_bytes())
+
+    kindle = AmazonKindleQuotes("imap.example.com", "user", "pass", max_age=7, imap_sessions=FakeSessionPool(imap))
+    quotes = kindle.get_quotes()
+    assert len(quotes) == 3
+    assert '"Sin weighs us down little by little until we are so consumed by it."' in quotes[0] + quotes[1] + quotes[2]
+    # only the text/plain parts are downloaded
+    assert all("BODY.PEEK[1]" in items for command, _, items in imap.commands if "BODY.PEEK" in items)
+
+    # known quotes are not reported again
+    kindle = AmazonKindleQuotes("imap.example.com", "user", "pass", max_age=7, imap_sessions=FakeSessionPool(imap))
+    assert kindle.get_quotes() == []
+
+
+def test_migrate_legacy_quote_store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    known_quote = md5(b"known quote", usedforsecurity=False).hexdigest()
+    Path(QUOTE_CACHE_FILE).write_text(f"{known_quote}\n{known_quote}\n")
+
+    imap_sessions = FakeSessionPool(FakeImap())
+    kindle = AmazonKindleQuotes("imap.example.com", "user", "pass", max_age=7, imap_sessions=imap_sessions)
+    assert kindle.is_known_quote("known quote")
+    assert not kindle.is_known_quote("new quote")
+    assert kindle.is_known_quote("new quote")
+
+    kindle.known_quote_hashes.save()
+    assert not Path(QUOTE_CACHE_FILE).exists()
+    assert Path(QUOTE_STORE_FILE).stat().st_size == 32
+
+    store = HashStore(QUOTE_STORE_FILE)
+    assert md5(b"new quote", usedforsecurity=False).digest() in store
+    assert len(store) == 2
@@ -1,5 +1,10 @@
-from datetime import datetime
+import gzip
+import os
+import shutil
+from datetime import date, datetime
 from pathlib import Path
+from random import Random
+from unittest.mock import patch
 
 from cronvisio.monitor.automysqlbackup import AutoMysqlBackup
 
@@ -11,6 +16,7 @@ def test_parse_borgbackup_output():
     backups = AutoMysqlBackup(
         archive_path=AUTOMYSQLBACKUP_TEST_DIR,
         max_age=1,
+        index_file=None,
         date=datetime(year=2023, month=9, day=9),
     )
     assert backups.notify() == ""
@@ -18,6 +24,7 @@ def test_parse_borgbackup_output():
     backups = AutoMysqlBackup(
         archive_path=AUTOMYSQLBACKUP_TEST_DIR,
         max_age=1,
+        index_file=None,
         date=datetime(year=2023, month=9, day=10),
     )
     assert backups.notify() == ""
@@ -26,7 +33,127 @@ def test_parse_borgbackup_output():
     backups = AutoMysqlBackup(
         archive_path=AUTOMYSQLBACKUP_TEST_DIR,
         max_age=1,
+        index_file=None,
         date=datetime(year=2023, month=9, day=11),
     )
     print(backups.notify())
     assert "2023-09-09" in backups.notify()
+
+
+def test_per_database_freshness(tmp_path):
+    for name in (
+        "daily/shop/shop_2023-09-10_06h25m.Sunday.sql.gz",
+        "daily/shop/shop_2023-09-09_06h25m.Saturday.sql.gz",
+        "daily/wiki/wiki_2023-09-01_06h25m.Friday.sql.gz",
+        "weekly/wiki/wiki_week.36.2023-09-02_05h29m.sql.gz",
+        "daily/legacy/legacy_2020-01-01_06h25m.Wednesday.sql.gz",
+        "daily/wiki/.partial/wiki_2023-09-10_06h25m.Sunday.sql.gz",
+    ):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).touch()
+
+    backups = AutoMysqlBackup(
+        archive_path=tmp_path,
+        max_age=2,
+        date=datetime(year=2023, month=9, day=10),
+        ignore_databases=["legacy"],
+        index_file=None,
+    )
+    assert {database: backup.date for database, backup in backups.get_latest_backups().items()} == {
+        "shop": date(2023, 9, 10),
+        "wiki": date(2023, 9, 2),
+    }
+    assert backups.notify() == (
+        "\n# WARNING: No recent automysql database backup found.\n- wiki: last backup 2023-09-02"
+    )
+
+
+def test_no_backups(tmp_path):
+    backups = AutoMysqlBackup(archive_path=tmp_path, max_age=2, index_file=None)
+    assert "No automysql database backup found" in backups.notify()
+    # missing archive path
+    backups = AutoMysqlBackup(archive_path=tmp_path / "missing", max_age=2, index_file=None)
+    assert "No automysql database backup found" in backups.notify()
+
+
+def test_incremental_index(tmp_path):
+    archive_path = tmp_path / "archive"
+    index_file = str(tmp_path / "index")
+    for name in (
+        "daily/shop/shop_2023-09-09_06h25m.Saturday.sql.gz",
+        "daily/wiki/wiki_2023-09-09_06h25m.Saturday.sql.gz",
+    ):
+        (archive_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (archive_path / name).touch()
+
+    def get_latest_backups():
+        backups = AutoMysqlBackup(archive_path=archive_path, max_age=2, index_file=index_file)
+        with patch.object(AutoMysqlBackup, "scan_directory", wraps=AutoMysqlBackup.scan_directory) as scan:
+            latest = {database: backup.date for database, backup in backups.get_latest_backups().items()}
+        return latest, sorted(Path(call.args[0]).name for call in scan.call_args_list)
+
+    assert get_latest_backups() == (
+        {"shop": date(2023, 9, 9), "wiki": date(2023, 9, 9)},
+        ["archive", "daily", "shop", "wiki"],
+    )
+    # unchanged directories are not scanned again
+    assert get_latest_backups()[1] == []
+
+    new_backup = archive_path / "daily" / "wiki" / "wiki_2023-09-10_06h25m.Sunday.sql.gz"
+    new_backup.touch()
+    os.utime(new_backup.parent, ns=(0, new_backup.parent.stat().st_mtime_ns + 1))
+    assert get_latest_backups() == ({"shop": date(2023, 9, 9), "wiki": date(2023, 9, 10)}, ["wiki"])
+
+    # a cached subdirectory vanished, while its parent's mtime appears unchanged
+    daily_mtime_ns = (archive_path / "daily").stat().st_mtime_ns
+    shutil.rmtree(archive_path / "daily" / "wiki")
+    os.utime(archive_path / "daily", ns=(0, daily_mtime_ns))
+    assert get_latest_backups() == ({"shop": date(2023, 9, 9)}, [])
+
+
+def test_integrity_check(tmp_path):
+    rng = Random(0)  # deterministic content, so that the truncated file's bogus footer is reliably implausible
+    rows = b"".join(b"INSERT INTO t VALUES ('%s');\n" % rng.randbytes(32).hex().encode() for _ in range(2000))
+    dump = b"-- MySQL dump\n" + rows + b"-- Dump completed\n"
+    # a flipped byte within the deflate stream leaves the header and footer intact
+    corrupt = bytearray(gzip.compress(dump))
+    corrupt[len(corrupt) // 2] ^= 0xFF
+    backups = {
+        "valid": gzip.compress(dump),
+        "corrupt": bytes(corrupt),
+        "empty": b"",
+        "plain": dump,
+        "truncated": gzip.compress(dump)[:-8],
+        "zeroed": gzip.compress(dump)[:-8] + b"\0" * 8,
+        # a valid member followed by a member whose CRC is missing (its plausible ISIZE passes the footer check)
+        "appended": gzip.compress(dump[:14]) + gzip.compress(dump)[:-8] + gzip.compress(dump)[-4:],
+    }
+    for database, content in backups.items():
+        (tmp_path / f"{database}_2023-09-09_06h25m.Saturday.sql.gz").write_bytes(content)
+
+    monitor = AutoMysqlBackup(
+        archive_path=tmp_path,
+        max_age=2,
+        date=datetime(year=2023, month=9, day=10),
+        index_file=None,
+        verify_integrity=True,
+    )
+    latest_backups = monitor.get_latest_backups()
+    # header and footer checks
+    assert monitor.check_integrity(latest_backups) == {
+        "empty": "file is truncated (0 bytes)",
+        "plain": "invalid gzip header",
+        "truncated": "implausible uncompressed size in gzip footer (truncated file?)",
+        "zeroed": "implausible uncompressed size in gzip footer (truncated file?)",
+    }
+
+    # full verification
+    monitor.verify_sample = 10
+    problems = monitor.check_integrity(latest_backups)
+    assert set(problems) == {"appended", "corrupt", "empty", "plain", "truncated", "zeroed"}
+    assert problems["appended"].startswith("corrupt gzip stream")
+    assert problems["corrupt"].startswith("corrupt gzip stream")
+
+    msg = monitor.notify()
+    assert msg.startswith("\n# WARNING: Corrupt automysql database backups found.")
+    assert "- valid:" not in msg
@@ -1,8 +1,13 @@
 import gzip
+import json
+import os
 from datetime import datetime
 from pathlib import Path
 
+import pytest
+
 from cronvisio.monitor.borgbackup import BorgBackupMonitor
+from fake_borg import borg_calls, create_repository, install_fake_borg, write_listing
 
 EXAMPLE_OUTPUT = gzip.open(Path(__file__).parent / "data" / "borgbackup.json.gz", "rt").read()
 
@@ -23,3 +28,130 @@ def test_parse_borgbackup_output():
         "epiphany.albert.priv.at": [],
         "epiphany": [],
     }
+
+
+@pytest.fixture
+def fake_borg(tmp_path, monkeypatch):
+    """
+    Put a fake borg executable that serves the repository's `listing` file on the PATH.
+    """
+    bin_dir = install_fake_borg(tmp_path / "bin")
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+
+def test_notify_parallel_listing(tmp_path, fake_borg):
+    archives = json.loads(EXAMPLE_OUTPUT)["archives"]
+    for name in ("repo-b", "repo-a", "broken", "hung", "ignored"):
+        create_repository(tmp_path / "archives" / name, archives)
+    (tmp_path / "archives" / "broken" / "error").write_text("Failed to create/acquire the lock")
+    (tmp_path / "archives" / "hung" / "hang").touch()
+
+    monitor = BorgBackupMonitor(
+        archive_path=tmp_path / "archives",
+        max_age=7,
+        ignore_archives=["ignored"],
+        timeout=2,
+        cache_file=str(tmp_path / "cache"),
+        timeseries_dir=str(tmp_path / "timeseries"),
+    )
+    msg = monitor.notify(force=True)
+
+    positions = [
+        msg.index(f"# WARNING: Cannot list backups in archive {tmp_path / 'archives' / 'broken'}"),
+        msg.index(f"# WARNING: Cannot list backups in archive {tmp_path / 'archives' / 'hung'}"),
+        msg.index(f"# Backups in archive {tmp_path / 'archives' / 'repo-a'}:"),
+        msg.index(f"# Backups in archive {tmp_path / 'archives' / 'repo-b'}:"),
+    ]
+    assert positions == sorted(positions)
+    assert "Failed to create/acquire the lock" in msg
+    assert "timed out after 2 seconds" in msg
+    assert "ignored" not in msg
+    assert not borg_calls(tmp_path / "archives" / "ignored")
+    # the number of recent backups per repository and host is recorded
+    assert [sample.value for sample in monitor.timeseries.last("borgbackup.repo-a.immanuel.fhgr.ch", 5)] == [0]
+
+
+def test_listing_cache(tmp_path, fake_borg):
+    archives = json.loads(EXAMPLE_OUTPUT)["archives"]
+    repository = create_repository(tmp_path / "archives" / "repo", archives)
+    cache_file = str(tmp_path / "cache")
+
+    def get_backups(current_date=datetime(2023, 6, 20)):
+        monitor = BorgBackupMonitor(archive_path=tmp_path / "archives", max_age=7, cache_file=cache_file)
+        cache = monitor.load_cache()
+        backups = monitor.get_backups(repository, cache, current_date=current_date)
+        monitor.save_cache(cache)
+        return backups
+
+    expected = BorgBackupMonitor(archive_path="./", max_age=7).parse_borgbackup_output(
+        EXAMPLE_OUTPUT, current_date=datetime(2023, 6, 20)
+    )
+    assert get_backups() == expected
+    assert len(borg_calls(repository)) == 1
+    assert "--last" not in borg_calls(repository)[0]
+
+    # unchanged repositories are served from the cache
+    assert get_backups() == expected
+    assert len(borg_calls(repository)) == 1
+
+    # a new transaction changes the fingerprint; only the most recent archives are listed
+    (repository / "index.42").rename(repository / "index.43")
+    with (repository / "listing").open("a") as f:
+        f.write("2023-06-20T15:30:12.000000\tepiphany.2023-06-20\n")
+    backups = get_backups(current_date=datetime(2023, 6, 21))
+    assert "--last 22" in borg_calls(repository)[1]
+    assert backups["epiphany"] == [datetime(2023, 6, 20, 15, 30, 12)]
+    assert backups["immanuel.fhgr.ch"] == expected["immanuel.fhgr.ch"]
+    # hosts without recent backups are still reported
+    assert backups["ubuntu.albert.priv.at"] == []
+
+
+def test_listing_window_exceeds_last(tmp_path, fake_borg):
+    repository = create_repository(
+        tmp_path / "archives" / "repo", [{"start": "2023-01-01T00:00:00.000000", "name": "retired.2023-01-01"}]
+    )
+    cache_file = str(tmp_path / "cache")
+    monitor = BorgBackupMonitor(archive_path=tmp_path / "archives", max_age=7, cache_file=cache_file)
+    cache = {}
+    assert monitor.get_backups(repository, cache, current_date=datetime(2023, 6, 20)) == {"retired": []}
+
+    # more new archives than requested with --last
+    (repository / "index.42").rename(repository / "index.43")
+    (repository / "listing").write_text(
+        "".join(f"2023-06-19T{hour:02}:00:00.000000\thost.2023-06-19-{hour}\n" for hour in range(24))
+    )
+    backups = monitor.get_backups(repository, cache, current_date=datetime(2023, 6, 20))
+    assert len(backups["host"]) == 24
+    assert "--last 16" in borg_calls(repository)[1]
+    assert "--last" not in borg_calls(repository)[2]
+    # the complete listing replaces the cached hosts, i.e. hosts whose archives have been pruned disappear
+    assert "retired" not in backups
+
+
+def test_pruned_hosts_disappear(tmp_path, fake_borg):
+    old = [{"start": f"2023-05-{day:02}T00:00:00.000000", "name": f"old.2023-05-{day:02}"} for day in range(1, 31)]
+    retired = {"start": "2023-05-31T00:00:00.000000", "name": "retired.2023-05-31"}
+    recent = {"start": "2023-06-19T00:00:00.000000", "name": "host.2023-06-19"}
+    repository = create_repository(tmp_path / "archives" / "repo", [retired, recent])
+    monitor = BorgBackupMonitor(archive_path=tmp_path / "archives", max_age=7, cache_file=None)
+    cache = {}
+
+    def get_backups(archives, current_date=datetime(2023, 6, 20)):
+        # every transaction changes the repository's fingerprint
+        write_listing(repository, archives)
+        index = next(repository.glob("index.*"))
+        index.rename(repository / f"index.{int(index.suffix[1:]) + 1}")
+        return monitor.get_backups(repository, cache, current_date=current_date)
+
+    assert set(get_backups([retired, recent])) == {"retired", "host"}
+    # the --last listing returns fewer archives than requested, i.e. all of them
+    assert set(get_backups([recent])) == {"host"}
+    assert "--last 18" in borg_calls(repository)[1]
+
+    # hosts of older archives are taken from the cache, as long as the --last listing is incomplete
+    assert set(get_backups([*old, retired, recent])) == {"old", "retired", "host"}
+    assert set(get_backups([*old, recent])) == {"old", "retired", "host"}
+    assert "--last 18" in borg_calls(repository)[3]
+    # until the repository is listed completely again
+    assert set(get_backups([*old, recent], current_date=datetime(2023, 6, 28))) == {"old", "host"}
+    assert "--last" not in borg_calls(repository)[4]
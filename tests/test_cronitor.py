@@ -0,0 +1,102 @@
+from time import monotonic, sleep
+
+from cronvisio import Cronitor, Delivery
+from cronvisio.concurrency import run_concurrently
+from cronvisio.monitor import Monitor
+from cronvisio.notifier import Notifier
+
+
+class SleepingMonitor(Monitor):
+    def __init__(self, message: str, delay: float = 0.0):
+        self.message = message
+        self.delay = delay
+
+    def notify(self, force: bool = True) -> str:
+        sleep(self.delay)
+        return self.message
+
+
+class FailingMonitor(Monitor):
+    def notify(self, force: bool = True) -> str:
+        msg = "unavailable"
+        raise RuntimeError(msg)
+
+
+class CollectingNotifier(Notifier):
+    def __init__(self, delay: float = 0.0):
+        self.messages = []
+        self.delay = delay
+
+    def send_notifications(self, messages):
+        sleep(self.delay)
+        self.messages.extend(messages)
+
+
+class FailingNotifier(Notifier):
+    def send_notifications(self, messages):
+        msg = "homeserver unreachable"
+        raise ConnectionError(msg)
+
+
+def test_run_concurrently_preserves_order():
+    results = run_concurrently(
+        [lambda: sleep(0.2) or 1, lambda: 2, lambda: sleep(0.1) or 3],
+        max_workers=3,
+    )
+    assert [r.value for r in results] == [1, 2, 3]
+
+
+def test_run_concurrently_timeout():
+    start = monotonic()
+    results = run_concurrently([lambda: sleep(5), lambda: 2, lambda: 3], max_workers=2, timeout=0.2)
+    assert monotonic() - start < 1
+    assert results[0].timed_out
+    assert [r.value for r in results[1:]] == [2, 3]
+
+
+def test_cronitor_concurrent_monitors():
+    notifier = CollectingNotifier()
+    monitors = [
+        SleepingMonitor("slow", delay=0.3),
+        SleepingMonitor(""),
+        FailingMonitor(),
+        SleepingMonitor("hung", delay=5),
+        SleepingMonitor("fast"),
+    ]
+    start = monotonic()
+    Cronitor.cronitor(monitors, [notifier], max_workers=None, timeout=1)
+    assert monotonic() - start < 2
+    assert notifier.messages == [
+        "slow",
+        "# WARNING: FailingMonitor failed - unavailable",
+        "# WARNING: SleepingMonitor did not finish within 1 seconds.",
+        "fast",
+    ]
+
+
+def test_cronitor_notifier_fan_out():
+    notifiers = [FailingNotifier(), CollectingNotifier(delay=5), CollectingNotifier(delay=0.2), CollectingNotifier()]
+    start = monotonic()
+    deliveries = Cronitor.cronitor([SleepingMonitor("a"), SleepingMonitor("b")], notifiers, notification_timeout=0.5)
+    # notifiers run concurrently; the hanging notifier is abandoned after the timeout
+    assert monotonic() - start < 1
+
+    assert [(d.notifier, d.sent, d.error) for d in deliveries] == [
+        ("FailingNotifier", 0, "homeserver unreachable"),
+        ("CollectingNotifier", 0, "did not finish within 0.5 seconds"),
+        ("CollectingNotifier", 2, None),
+        ("CollectingNotifier", 2, None),
+    ]
+    assert notifiers[2].messages == notifiers[3].messages == ["a", "b"]
+    assert deliveries[2].duration >= 0.2
+
+
+def test_cronitor_nothing_to_notify():
+    notifier = CollectingNotifier()
+    assert Cronitor.cronitor([SleepingMonitor("")], [notifier]) == []
+    assert notifier.messages == []
+
+
+def test_delivery_summary():
+    assert str(Delivery("MatrixNotifier", 3, None, 0.42)) == "MatrixNotifier: sent 3 message(s) in 0.4 s"
+    assert str(Delivery("MatrixNotifier", 0, "timeout", 30)) == "MatrixNotifier: failed after 30.0 s - timeout"
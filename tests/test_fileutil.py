@@ -0,0 +1,37 @@
+import stat
+from pathlib import Path
+
+import pytest
+
+from cronvisio.concurrency import run_concurrently
+from cronvisio.fileutil import UMASK, atomic_write
+
+
+def test_atomic_write(tmp_path: Path):
+    path = tmp_path / "state"
+    with atomic_write(path) as f:
+        f.write("old")
+    assert path.read_text() == "old"
+    assert stat.S_IMODE(path.stat().st_mode) == 0o666 & ~UMASK
+
+    # a failed write keeps the previous content
+    with pytest.raises(ValueError, match="failed"), atomic_write(path) as f:
+        f.write("partial")
+        msg = "failed"
+        raise ValueError(msg)
+    assert path.read_text() == "old"
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_concurrent_atomic_writes(tmp_path: Path):
+    path = tmp_path / "index"
+
+    def write(no: int) -> None:
+        with atomic_write(path, "wb") as f:
+            f.write(bytes([no]) * 1000)
+
+    results = run_concurrently([lambda no=no: write(no) for no in range(20)], max_workers=8)
+    assert not [result.error for result in results if result.error]
+    # the last replacement wins
+    assert len(set(path.read_bytes())) == 1
+    assert list(tmp_path.iterdir()) == [path]
@@ -0,0 +1,145 @@
+from imaplib import IMAP4
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from cronvisio.imap import (
+    BodyPart,
+    ImapSessionPool,
+    decode_part,
+    fetch_sections,
+    iter_parts,
+    iter_structures,
+    parse_fetch_response,
+    uid_set,
+)
+from fake_imap import FakeImap
+
+
+def imap_connection(*_, **__) -> MagicMock:
+    imap = MagicMock()
+    imap.select.return_value = ("OK", [b"1"])
+    return imap
+
+
+def test_session_reuse():
+    pool = ImapSessionPool()
+    with patch.object(ImapSessionPool, "connect", side_effect=imap_connection) as mock_connect:
+        with pool.session("imap.example.com", "user", "pass") as imap1:
+            imap1.search(None, "ALL")
+        with pool.session("imap.example.com", "user", "pass") as imap2:
+            pass
+        with pool.session("imap.example.com", "other", "pass") as imap3:
+            pass
+
+        assert imap1 is imap2
+        assert imap1 is not imap3
+        assert mock_connect.call_count == 2
+        # the mailbox is only selected once per connection
+        imap1.select.assert_called_once_with("INBOX")
+
+        pool.close_all()
+        imap1.logout.assert_called_once()
+        imap3.logout.assert_called_once()
+
+
+def test_session_reconnect_after_abort():
+    pool = ImapSessionPool()
+    with patch.object(ImapSessionPool, "connect", side_effect=imap_connection) as mock_connect:
+        with pytest.raises(IMAP4.abort), pool.session("imap.example.com", "user", "pass") as imap1:
+            msg = "connection lost"
+            raise IMAP4.abort(msg)
+        with pool.session("imap.example.com", "user", "pass") as imap2:
+            pass
+
+        assert imap1 is not imap2
+        assert mock_connect.call_count == 2
+
+
+def test_session_select_failure():
+    pool = ImapSessionPool()
+    with patch.object(ImapSessionPool, "connect", side_effect=imap_connection):
+        with pool.session("imap.example.com", "user", "pass") as imap:
+            pass
+        imap.select.return_value = ("NO", [b"[UNAVAILABLE] Mailbox is locked"])
+        with (
+            pytest.raises(IMAP4.error, match="Mailbox is locked"),
+            pool.session("imap.example.com", "user", "pass", mailbox="Reports"),
+        ):
+            pass
+
+        # the mailbox is selected again on the next request
+        imap.select.return_value = ("OK", [b"3"])
+        with pool.session("imap.example.com", "user", "pass", mailbox="Reports") as imap2:
+            pass
+        assert imap2 is imap
+        assert imap.select.call_count == 3
+
+
+def test_session_timeouts():
+    pool = ImapSessionPool(timeout=5, lock_timeout=0.1)
+    with patch("cronvisio.imap.IMAP4_SSL", side_effect=imap_connection) as mock_imap4_ssl:
+        with pool.session("imap.example.com", "user", "pass") as imap:
+            # a session that is lent to a (hung) monitor is not waited for forever
+            with (
+                pytest.raises(TimeoutError, match="still in use"),
+                pool.session("imap.example.com", "user", "pass"),
+            ):
+                pass
+        mock_imap4_ssl.assert_called_once_with("imap.example.com", timeout=5)
+
+        # a socket timeout discards the connection and releases the session
+        with pytest.raises(TimeoutError), pool.session("imap.example.com", "user", "pass"):
+            msg = "timed out"
+            raise TimeoutError(msg)
+        with pool.session("imap.example.com", "user", "pass") as imap2:
+            assert imap2 is not imap
+        assert mock_imap4_ssl.call_count == 2
+
+
+def test_uid_set():
+    assert uid_set([7, 1, 2, 3, 4, 9, 10]) == "1:4,7,9:10"
+
+
+def test_fetch_batches():
+    imap = FakeImap()
+    for uid in range(1, 6):
+        imap.add(uid, b"Subject: test\r\nContent-Type: text/plain\r\n\r\n" + b"x" * 100 * uid + b"\r\n")
+    structures = list(iter_structures(imap, range(1, 6), batch_size=2))
+    assert [sorted(batch) for batch in structures] == [[1, 2], [3, 4], [5]]
+
+    parts = {uid: attributes["PARTS"] for batch in structures for uid, attributes in batch.items()}
+    # every batch stays within the buffer size, unless a single part exceeds it
+    batches = list(fetch_sections(imap, parts, buffer_size=350))
+    assert [sorted(uid for uid, _ in batch) for batch in batches] == [[1, 2], [3], [4], [5]]
+    assert batches[-1][5, "1"].startswith(b"x" * 500)
+
+
+def test_parse_fetch_response():
+    data = [
+        b'1 (UID 5 INTERNALDATE "09-Sep-2023 10:00:00 +0000" BODYSTRUCTURE (("text" "plain" ("charset" "utf-8") '
+        b'NIL NIL "quoted-printable" 12 1 NIL NIL NIL NIL)("application" "tlsrpt+gzip" NIL NIL NIL "base64" 100 '
+        b'NIL ("attachment" ("filename" "report.json.gz")) NIL NIL) "mixed" ("boundary" "abc") NIL NIL NIL))',
+        (b"2 (UID 6 BODY[2] {4}", b"YWJj"),
+        b")",
+        b"3 (FLAGS (\\Seen))",
+    ]
+    response = parse_fetch_response(data)
+    assert response[5]["INTERNALDATE"] == "09-Sep-2023 10:00:00 +0000"
+    assert response[6]["BODY[2]"] == b"YWJj"
+    assert list(response) == [5, 6]
+
+    text, attachment = iter_parts(response[5]["BODYSTRUCTURE"])
+    assert text == BodyPart("1", "text/plain", {"charset": "utf-8"}, "quoted-printable", 12, None)
+    assert attachment == BodyPart("2", "application/tlsrpt+gzip", {}, "base64", 100, "attachment")
+    assert decode_part(attachment, response[6]["BODY[2]"]) == b"abc"
+
+
+def test_iter_parts_single_and_nested():
+    assert [p.section for p in iter_parts(["text", "plain", None, None, None, "7bit", 10, 1])] == ["1"]
+    nested = [
+        ["text", "plain", None, None, None, "7bit", 10, 1],
+        [["text", "plain", None, None, None, "7bit", 10, 1], ["text", "html", None, None, None, "7bit", 10, 1], "alt"],
+        "mixed",
+    ]
+    assert [p.section for p in iter_parts(nested)] == ["1", "2.1", "2.2"]
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from cronvisio.jsonstream import parse
+
+DOCUMENT = {
+    "report-id": "2023-09-09T00:00:00Z_example.com",
+    "contact-info": "smtp-tls-reporting@google.com",
+    "policies": [
+        {
+            "policy": {"policy-type": "sts", "policy-string": ["version: STSv1", "mode: enforce"]},
+            "summary": {"total-successful-session-count": 12, "total-failure-session-count": 1},
+            "failure-details": [{"result-type": "certificate-expired", "ratio": 0.5, "ok": False, "ip": None}],
+        },
+        {},
+        [],
+    ],
+    "escaped": 'quote " and \\ and ä',
+}
+
+
+def test_parse_events():
+    events = list(parse([json.dumps(DOCUMENT)]))
+    assert events[:3] == [
+        ("", "start_map", None),
+        ("", "map_key", "report-id"),
+        ("report-id", "string", "2023-09-09T00:00:00Z_example.com"),
+    ]
+    assert ("policies.item.summary.total-failure-session-count", "number", 1) in events
+    assert ("policies.item.policy.policy-string.item", "string", "mode: enforce") in events
+    assert ("policies.item.failure-details.item.ratio", "number", 0.5) in events
+    assert ("policies.item.failure-details.item.ok", "boolean", False) in events
+    assert ("policies.item.failure-details.item.ip", "null", None) in events
+    assert ("escaped", "string", DOCUMENT["escaped"]) in events
+    assert events[-1] == ("", "end_map", None)
+
+
+def test_parse_chunked():
+    text = json.dumps(DOCUMENT, indent=2)
+    expected = list(parse([text]))
+    for chunk_size in (1, 2, 3, 7, 64):
+        chunks = [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+        assert list(parse(chunks)) == expected
+
+
+def test_parse_truncated():
+    with pytest.raises(json.JSONDecodeError):
+        list(parse(['{"report-id": "abc']))
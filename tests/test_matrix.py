@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("nio")
+
+from nio import RoomSendError, RoomSendResponse
+
+from cronvisio.notifier.matrix import MatrixNotifier
+
+
+class FakeHomeserver:
+    def __init__(self, rate_limited: int = 0, retry_after_ms: int = 100):
+        self.rate_limited = rate_limited
+        self.retry_after_ms = retry_after_ms
+        self.messages = []
+        self.active = 0
+        self.max_active = 0
+
+    async def room_send(self, room_id, message_type, content):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        if self.rate_limited:
+            self.rate_limited -= 1
+            return RoomSendError("Too Many Requests", "M_LIMIT_EXCEEDED", self.retry_after_ms)
+        if content["body"] == "forbidden":
+            return RoomSendError("Forbidden", "M_FORBIDDEN")
+        self.messages.append(content["body"])
+        return RoomSendResponse("$event", room_id)
+
+
+@pytest.fixture
+def notifier():
+    notifier = MatrixNotifier("https://matrix.example.com", "@bot:example.com", "token", "!room:example.com")
+    yield notifier
+    notifier.close()
+
+
+def test_send_notifications_reuses_client(notifier, monkeypatch):
+    homeserver = FakeHomeserver()
+    client = notifier.run(notifier.get_client())
+    monkeypatch.setattr(client, "room_send", homeserver.room_send)
+
+    notifier.send_notifications([f"quote {no}" for no in range(10)])
+    notifier.send_notifications(["a", ["b", "c"]])
+    assert notifier.client is client
+    # the messages appear in the room in the given order
+    assert homeserver.messages == [f"quote {no}" for no in range(10)] + ["a", "b", "c"]
+    assert homeserver.max_active == 1
+
+
+def test_send_notifications_rate_limited(notifier, monkeypatch):
+    homeserver = FakeHomeserver(rate_limited=2, retry_after_ms=200)
+    notifier.run(notifier.get_client())
+    monkeypatch.setattr(notifier.client, "room_send", homeserver.room_send)
+
+    start = notifier.loop.time()
+    notifier.send_notifications(["a", "b", "c"])
+    assert homeserver.messages == ["a", "b", "c"]
+    # sending pauses as requested by the homeserver
+    assert notifier.loop.time() - start >= 0.2
+
+
+def test_send_notifications_errors(notifier, monkeypatch):
+    homeserver = FakeHomeserver()
+    notifier.run(notifier.get_client())
+    monkeypatch.setattr(notifier.client, "room_send", homeserver.room_send)
+
+    with pytest.raises(RuntimeError, match="1 of 2 Matrix messages could not be sent - RoomSendError: M_FORBIDDEN"):
+        notifier.send_notifications(["forbidden", "ok"])
+    assert homeserver.messages == ["ok"]
+
+    notifier.max_retries = 1
+    homeserver.rate_limited = 5
+    homeserver.retry_after_ms = 1
+    with pytest.raises(RuntimeError, match="Rate limit exceeded after 1 retries"):
+        notifier.send_notifications(["a"])
@@ -0,0 +1,94 @@
+from json import load
+from pathlib import Path
+from unittest.mock import patch
+
+from cronvisio import Cronitor, metrics
+from cronvisio.concurrency import run_concurrently
+from cronvisio.imap import fetch_sections, fetch_structures
+from cronvisio.monitor.postfix import PostfixMonitor
+from cronvisio.registry import Registry
+from fake_imap import FakeImap
+from test_cronitor import CollectingNotifier, FailingMonitor, FailingNotifier, SleepingMonitor
+
+MAIL = b"Subject: test\r\nContent-Type: text/plain\r\n\r\nHello world!\r\n"
+
+
+def values(run_metrics: metrics.RunMetrics) -> dict:
+    return {(name, tuple(labels.items())): value for name, labels, value in run_metrics.samples()}
+
+
+def test_inactive_collector():
+    # recording without an active run is a no-op
+    metrics.add("messages_sent", 3, notifier="x")
+    with metrics.timed("subprocess", command="true"):
+        pass
+    assert metrics.CURRENT.get() is None
+
+
+def test_collect_run():
+    with metrics.collect("daily") as run_metrics:
+        Cronitor.cronitor(
+            [SleepingMonitor("a", delay=0.1), FailingMonitor()], [CollectingNotifier(), FailingNotifier()]
+        )
+        # tasks inherit the active collector
+        run_concurrently([lambda: metrics.add("imap_bytes_fetched", 10)] * 3)
+        with patch("subprocess.check_output", return_value=b"header\nmail\n"):
+            assert PostfixMonitor.get_queue_size() == 1
+    assert metrics.CURRENT.get() is None
+
+    result = values(run_metrics)
+    assert result["monitor_duration_seconds", (("monitor", "SleepingMonitor"),)] >= 0.1
+    assert result["monitor_failed", (("monitor", "SleepingMonitor"),)] == 0
+    assert result["monitor_failed", (("monitor", "FailingMonitor"),)] == 1
+    assert result["messages_sent", (("notifier", "CollectingNotifier"),)] == 2
+    assert result["messages_sent", (("notifier", "FailingNotifier"),)] == 0
+    assert result["notifier_failed", (("notifier", "FailingNotifier"),)] == 1
+    assert result["imap_bytes_fetched", ()] == 30
+    assert result["subprocess_calls", (("command", "postqueue"),)] == 1
+    assert run_metrics.duration >= 0.1
+
+
+def test_imap_metrics():
+    imap = FakeImap()
+    for uid in (1, 2, 3):
+        imap.add(uid, MAIL)
+    with metrics.collect("hourly") as run_metrics:
+        structures = fetch_structures(imap, [1, 2, 3])
+        list(fetch_sections(imap, {uid: structures[uid]["PARTS"] for uid in (1, 2)}))
+
+    result = values(run_metrics)
+    assert result["imap_messages_fetched", (("kind", "structure"),)] == 3
+    assert result["imap_messages_fetched", (("kind", "content"),)] == 2
+    assert result["imap_bytes_fetched", ()] > 2 * len(b"Hello world!")
+
+
+def test_prometheus_textfile(tmp_path: Path):
+    with metrics.collect("weekly") as run_metrics:
+        metrics.add("subprocess_duration_seconds", 1.5, command="borg")
+        metrics.add("monitor_failed", 0, monitor='Odd "name"')
+    metrics.export(run_metrics, textfile=str(tmp_path / "cronvisio_{group}.prom"), report=None)
+
+    lines = (tmp_path / "cronvisio_weekly.prom").read_text().splitlines()
+    assert "# TYPE cronvisio_subprocess_duration_seconds gauge" in lines
+    assert 'cronvisio_subprocess_duration_seconds{group="weekly",command="borg"} 1.5' in lines
+    assert 'cronvisio_monitor_failed{group="weekly",monitor="Odd \\"name\\""} 0' in lines
+    assert lines[0].startswith("# HELP cronvisio_run_timestamp_seconds")
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_registry_run_report(tmp_path: Path):
+    registry = Registry(
+        {
+            "metrics": {"report": str(tmp_path / "run-{group}.json")},
+            "groups": {"often": {"monitors": ["echo"], "notifiers": ["collect"]}},
+        },
+        monitors={"echo": "test_registry:EchoMonitor"},
+        notifiers={"collect": "test_registry:CollectingNotifier"},
+    )
+    registry.run_group("often")
+
+    with (tmp_path / "run-often.json").open() as f:
+        report = load(f)
+    assert report["group"] == "often"
+    assert {"name": "monitor_failed", "labels": {"monitor": "EchoMonitor"}, "value": 0} in report["metrics"]
+    assert {"name": "messages_sent", "labels": {"notifier": "CollectingNotifier"}, "value": 1} in report["metrics"]
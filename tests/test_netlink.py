@@ -0,0 +1,19 @@
+from cronvisio.netlink import encode_attribute, parse_attributes
+
+NLA_F_NESTED = 0x8000
+
+
+def test_encode_and_parse_attributes():
+    nested = encode_attribute(1, b"abc") + encode_attribute(2, b"")
+    data = encode_attribute(2, b"wg0\0") + encode_attribute(8 | NLA_F_NESTED, nested)
+    # attributes are padded to four bytes
+    assert len(encode_attribute(1, b"abc")) == 8
+
+    attributes = list(parse_attributes(data))
+    assert attributes == [(2, b"wg0\0"), (8, nested)]
+    assert list(parse_attributes(attributes[1][1])) == [(1, b"abc"), (2, b"")]
+
+
+def test_parse_truncated_attributes():
+    assert list(parse_attributes(encode_attribute(1, b"abcd")[:3])) == []
+    assert list(parse_attributes(b"\0\0\0\0")) == []
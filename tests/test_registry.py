@@ -0,0 +1,162 @@
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from cronvisio.monitor import Monitor
+from cronvisio.notifier import Notifier
+from cronvisio.registry import DEFAULT_GROUPS, ENTRY_POINT_INDEX, Registry, discover_entry_points
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+# maximum time for importing the CLI module (i.e., the startup cost of every run) in seconds
+IMPORT_BUDGET = 0.25
+
+CREATED = []
+
+
+class EchoMonitor(Monitor):
+    def __init__(self, message: str = "echo"):
+        CREATED.append(self)
+        self.message = message
+
+    def notify(self, force: bool = True) -> str:
+        return f"{self.message} (forced)" if force else self.message
+
+
+class CollectingNotifier(Notifier):
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self.messages = []
+        self.closed = False
+
+    def send_notifications(self, messages):
+        self.messages.extend(f"{self.prefix}{msg}" for msg in messages)
+
+    def close(self):
+        self.closed = True
+
+
+CONFIG = {
+    "metrics": {"report": None},
+    "echo": {"message": "hello"},
+    "collect": {"updates": {"prefix": "u: "}, "delight": {"prefix": "d: "}},
+    "groups": {
+        "often": {"monitors": ["echo", "echo"], "notifiers": ["collect.updates", "collect.delight"]},
+        "rarely": {"monitors": ["echo"], "notifiers": ["collect.updates"], "force": True},
+    },
+}
+
+
+@pytest.fixture
+def registry():
+    return Registry(
+        CONFIG,
+        monitors={"echo": f"{__name__}:EchoMonitor"},
+        notifiers={"collect": f"{__name__}:CollectingNotifier", "stdout": f"{__name__}:CollectingNotifier"},
+    )
+
+
+def test_run_group(registry):
+    CREATED.clear()
+    registry.run_group("often")
+    registry.run_group("rarely")
+    updates, delight = registry.get_notifiers(["collect.updates", "collect.delight"])
+    assert updates.messages == ["u: hello", "u: hello", "u: hello (forced)"]
+    assert delight.messages == ["d: hello", "d: hello"]
+    # monitors are created for every run, notifiers only once
+    assert len(CREATED) == 3
+    assert len(registry.notifier_instances) == 2
+
+    registry.close()
+    assert updates.closed
+    assert not registry.notifier_instances
+
+
+def test_unknown_names(registry):
+    with pytest.raises(ValueError, match="Unsupported group"):
+        registry.run_group("never")
+    with pytest.raises(ValueError, match="Unknown monitor missing"):
+        registry.create_monitor("missing")
+
+
+def test_nonotify(registry):
+    registry.nonotify = True
+    registry.run_group("rarely")
+    assert list(registry.notifier_instances) == ["stdout"]
+
+
+def test_default_groups():
+    registry = Registry({}, entry_point_index=None)
+    assert registry.groups == DEFAULT_GROUPS
+    assert all(name in registry.monitors for group in DEFAULT_GROUPS.values() for name in group["monitors"])
+
+
+def install_plugin(site_packages: Path, name: str, entry_points: str) -> None:
+    (site_packages / f"{name}.py").write_text(
+        "from cronvisio.monitor import Monitor\n\n\n"
+        "class PluginMonitor(Monitor):\n"
+        "    def notify(self, force=True):\n"
+        f"        return '{name}'\n"
+    )
+    dist_info = site_packages / f"{name}-1.0.dist-info"
+    dist_info.mkdir()
+    (dist_info / "METADATA").write_text(f"Metadata-Version: 2.1\nName: {name}\nVersion: 1.0\n")
+    (dist_info / "entry_points.txt").write_text(entry_points)
+
+
+def test_entry_point_discovery(tmp_path, monkeypatch):
+    site_packages = tmp_path / "site-packages"
+    site_packages.mkdir()
+    monkeypatch.syspath_prepend(str(site_packages))
+    install_plugin(
+        site_packages,
+        "acme_raid",
+        "[cronvisio.monitors]\nraid_monitor = acme_raid:PluginMonitor\n"
+        "# built-in monitors cannot be replaced\nborgbackup_monitor = acme_raid:PluginMonitor\n\n"
+        "[cronvisio.notifiers]\nbroken = acme_raid:PluginMonitor\n",
+    )
+    # the index is written to the working directory, which is on sys.path as ""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend("")
+    index_file = ENTRY_POINT_INDEX
+
+    registry = Registry({"groups": {"raid": {"monitors": ["raid_monitor"]}}}, entry_point_index=index_file)
+    assert registry.monitors["raid_monitor"] == "acme_raid:PluginMonitor"
+    assert registry.monitors["borgbackup_monitor"] == "cronvisio.monitor.borgbackup:BorgBackupMonitor"
+    assert registry.create_monitors("raid")[0].notify() == "acme_raid"
+    with pytest.raises(TypeError, match="is not a Notifier"):
+        registry.get_notifiers(["broken"])
+
+    # the cached index is used as long as no distribution is installed or removed
+    with patch("importlib.metadata.entry_points") as mock_entry_points:
+        assert discover_entry_points(index_file)["monitors"] == {
+            "raid_monitor": "acme_raid:PluginMonitor",
+            "borgbackup_monitor": "acme_raid:PluginMonitor",
+        }
+        mock_entry_points.assert_not_called()
+
+    install_plugin(site_packages, "acme_ups", "[cronvisio.monitors]\nups_monitor = acme_ups:PluginMonitor\n")
+    assert "ups_monitor" in discover_entry_points(index_file)["monitors"]
+
+
+def test_cli_import_budget():
+    code = (
+        "import sys\n"
+        "from time import perf_counter\n"
+        "start = perf_counter()\n"
+        "import cronvisio.cli\n"
+        "print(perf_counter() - start)\n"
+        "print(' '.join(sorted(sys.modules)))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], env={"PYTHONPATH": str(SRC_DIR)}, capture_output=True, text=True, check=True
+    )
+    duration, modules = result.stdout.splitlines()
+    modules = modules.split()
+
+    # neither the notifiers' dependencies nor the monitors are imported at startup
+    assert not [module for module in modules if module == "nio" or module.startswith(("nio.", "aiohttp"))]
+    assert not [module for module in modules if module.startswith(("cronvisio.monitor.", "cronvisio.notifier."))]
+    assert float(duration) < IMPORT_BUDGET
@@ -0,0 +1,75 @@
+import socket
+from time import sleep
+from unittest.mock import patch
+
+from cronvisio.resolver import Resolver, strip_port
+
+
+def getaddrinfo(addresses: dict[str, str], delay: float = 0):
+    def _getaddrinfo(host, port, *args):
+        sleep(delay)
+        if host not in addresses:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        address = addresses[host]
+        family = socket.AF_INET6 if ":" in address else socket.AF_INET
+        return [(family, socket.SOCK_DGRAM, 17, "", (address, 0))]
+
+    return _getaddrinfo
+
+
+def test_strip_port():
+    assert strip_port("10.0.0.1:51820") == "10.0.0.1"
+    assert strip_port("[2001:db8::1]:51820") == "2001:db8::1"
+    assert strip_port(None) is None
+
+
+def test_resolve_literal_addresses():
+    resolver = Resolver()
+    with patch("socket.getaddrinfo") as mock_getaddrinfo:
+        assert resolver.resolve_all([("10.0.0.1", None), ("2001:db8::1", None)]) == ["10.0.0.1", "2001:db8::1"]
+        mock_getaddrinfo.assert_not_called()
+
+
+def test_resolve_cache():
+    resolver = Resolver(ttl=60)
+    addresses = {"vpn.example.com": "192.0.2.1", "vpn6.example.com": "2001:db8::1"}
+    with patch("socket.getaddrinfo", side_effect=getaddrinfo(addresses)) as mock_getaddrinfo:
+        assert resolver.resolve_all([("vpn.example.com", None), ("vpn6.example.com", None)]) == [
+            "192.0.2.1",
+            "2001:db8::1",
+        ]
+        assert mock_getaddrinfo.call_count == 2
+
+        # cache hits, if the peer still uses the cached address
+        assert resolver.resolve("vpn.example.com") == "192.0.2.1"
+        assert resolver.resolve("vpn.example.com", current="192.0.2.1") == "192.0.2.1"
+        assert mock_getaddrinfo.call_count == 2
+
+        # the peer's endpoint differs from the cached address
+        addresses["vpn.example.com"] = "192.0.2.2"
+        assert resolver.resolve("vpn.example.com", current="198.51.100.1") == "192.0.2.2"
+        assert mock_getaddrinfo.call_count == 3
+
+
+def test_resolve_ttl():
+    resolver = Resolver(ttl=0)
+    with patch("socket.getaddrinfo", side_effect=getaddrinfo({"vpn.example.com": "192.0.2.1"})) as mock_getaddrinfo:
+        resolver.resolve("vpn.example.com")
+        resolver.resolve("vpn.example.com")
+        assert mock_getaddrinfo.call_count == 2
+
+
+def test_resolve_errors_and_timeouts(capsys):
+    resolver = Resolver(timeout=0.2)
+    with patch("socket.getaddrinfo", side_effect=getaddrinfo({"slow.example.com": "192.0.2.1"}, delay=1)):
+        assert resolver.resolve_all([("slow.example.com", None), ("unknown.example.com", None)]) == [None, None]
+    assert "Cannot resolve slow.example.com" in capsys.readouterr().out
+    assert "slow.example.com" not in resolver.cache
+
+
+def test_resolve_concurrently():
+    resolver = Resolver(timeout=2)
+    addresses = {f"vpn{no}.example.com": f"192.0.2.{no}" for no in range(10)}
+    with patch("socket.getaddrinfo", side_effect=getaddrinfo(addresses, delay=0.2)):
+        result = resolver.resolve_all([(hostname, None) for hostname in addresses])
+    assert result == list(addresses.values())
@@ -0,0 +1,79 @@
+import json
+from threading import Event
+from time import sleep, time
+
+import pytest
+
+from cronvisio.scheduler import Scheduler, parse_interval
+
+
+def test_parse_interval():
+    assert parse_interval(90) == 90
+    assert parse_interval("15m") == 900
+    assert parse_interval("1.5h") == 5400
+    assert parse_interval("daily") == 86400
+    assert parse_interval("1w") == parse_interval("weekly")
+    with pytest.raises(ValueError, match="Invalid interval"):
+        parse_interval("every tuesday")
+
+
+def test_run_pending(tmp_path):
+    runs = []
+    scheduler = Scheduler(state_file=tmp_path / "schedule")
+    scheduler.add("hourly", "1h", lambda: runs.append("hourly"))
+    scheduler.add("daily", "daily", lambda: runs.append("daily"))
+
+    now = time()
+    assert scheduler.run_pending(now) == ["hourly", "daily"]
+    assert scheduler.run_pending(now + 60) == []
+    assert scheduler.run_pending(now + 3600) == ["hourly"]
+    for thread in scheduler.threads:
+        thread.join()
+    assert sorted(runs) == ["daily", "hourly", "hourly"]
+
+    # a restarted scheduler continues the schedule
+    scheduler = Scheduler(state_file=tmp_path / "schedule")
+    scheduler.add("hourly", "1h", lambda: runs.append("hourly"))
+    scheduler.add("daily", "daily", lambda: runs.append("daily"))
+    assert scheduler.run_pending(now + 3660) == []
+    assert scheduler.run_pending(now + 7200) == ["hourly"]
+    assert json.loads((tmp_path / "schedule").read_text()) == {"hourly": now + 7200, "daily": now}
+
+
+def test_no_overlapping_runs(capsys):
+    release = Event()
+    scheduler = Scheduler(state_file=None)
+    scheduler.add("slow", 10, release.wait)
+
+    now = time()
+    assert scheduler.run_pending(now) == ["slow"]
+    assert scheduler.run_pending(now + 10) == []
+    assert "previous run is still in progress" in capsys.readouterr().out
+    release.set()
+    scheduler.threads[0].join()
+    assert scheduler.run_pending(now + 20) == ["slow"]
+
+
+def test_run_until_stopped(capsys):
+    runs = []
+    stop = Event()
+
+    def fail():
+        runs.append("fail")
+        msg = "monitor crashed"
+        raise RuntimeError(msg)
+
+    def finish():
+        sleep(0.2)
+        runs.append("finish")
+        stop.set()
+
+    scheduler = Scheduler(state_file=None)
+    scheduler.add("fail", 0.05, fail)
+    scheduler.add("finish", 60, finish)
+    scheduler.run(stop)
+
+    # a failing job does not stop the scheduler; running jobs are awaited
+    assert runs.count("fail") >= 2
+    assert "finish" in runs
+    assert "fail failed - monitor crashed" in capsys.readouterr().out
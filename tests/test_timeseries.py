@@ -0,0 +1,78 @@
+from unittest.mock import patch
+
+import pytest
+
+from cronvisio.monitor.postfix import QUEUE_SIZE, PostfixMonitor
+from cronvisio.timeseries import RECORD, Sample, TimeSeriesStore
+
+HOUR = 3600
+DAY = 24 * HOUR
+START = 1_700_000_000 // DAY * DAY
+
+
+@pytest.fixture
+def store(tmp_path):
+    # raw samples for two days, hourly means for ten days, daily means for 30 days
+    return TimeSeriesStore(tmp_path / "timeseries", resolutions=((0, 2 * DAY), (HOUR, 10 * DAY), (DAY, 30 * DAY)))
+
+
+def test_append_and_query(store):
+    for no in range(10):
+        store.append("postfix.queue_size", no, START + no * 60)
+
+    assert store.last("postfix.queue_size", 3) == [
+        Sample(START + 420, 7),
+        Sample(START + 480, 8),
+        Sample(START + 540, 9),
+    ]
+    assert len(store.last("postfix.queue_size", 100)) == 10
+    assert store.last("unknown", 3) == []
+    assert [sample.value for sample in store.since("postfix.queue_size", START + 450)] == [8, 9]
+    # 9 mails within 9 minutes
+    assert store.rate("postfix.queue_size", window=HOUR, now=START + 600, per=HOUR) == pytest.approx(60)
+    assert store.rate("postfix.queue_size", window=30, now=START + 600) is None
+
+
+def test_truncated_record(store):
+    store.append("series", 1, START)
+    with store.get_file("series", 0).open("ab") as f:
+        f.write(RECORD.pack(START + 60, 2)[:5])
+    assert store.last("series", 5) == [Sample(START, 1)]
+
+
+def test_downsampling_and_retention(store):
+    # one sample every 10 minutes for 40 days
+    for timestamp in range(START, START + 40 * DAY, 600):
+        store.append("series", (timestamp - START) // 600 % 6, timestamp)
+    now = START + 40 * DAY - 600
+
+    raw = store.read(store.get_file("series", 0))
+    hourly = store.read(store.get_file("series", HOUR))
+    daily = store.read(store.get_file("series", DAY))
+    assert raw[0].timestamp >= now - 2 * DAY - HOUR
+    assert hourly[0].timestamp >= now - 10 * DAY - DAY
+    assert daily[0].timestamp >= now - 30 * DAY - DAY
+    # the buckets contain the mean of the values 0 ... 5
+    assert {sample.value for sample in hourly} == {2.5}
+    assert {sample.value for sample in daily} == {2.5}
+    # the resolutions neither overlap nor leave gaps
+    assert daily[-1].timestamp + DAY == hourly[0].timestamp
+    assert hourly[-1].timestamp + HOUR == raw[0].timestamp
+
+    # queries span all resolutions
+    assert store.last("series", len(raw) + 2) == [*hourly[-2:], *raw]
+    assert store.since("series", START) == [*daily, *hourly, *raw]
+
+
+def test_postfix_queue_growth(tmp_path):
+    monitor = PostfixMonitor(timeseries_dir=str(tmp_path), max_queue_growth=100)
+    for no, (now, queue_size) in enumerate(((START, 0), (START + 600, 10), (START + 1200, 80))):
+        with (
+            patch.object(PostfixMonitor, "get_queue_size", return_value=queue_size),
+            patch("cronvisio.timeseries.time", return_value=now),
+        ):
+            msg = monitor.notify(force=False)
+        if no < 2:
+            assert "grows" not in msg
+    assert msg == "# Mail monitoring:\n- 80 mails are currently queued.\n- The mail queue grows by 240 mails per hour."
+    assert [sample.value for sample in monitor.timeseries.last(QUEUE_SIZE, 5)] == [0, 10, 80]
@@ -0,0 +1,157 @@
+import gzip
+import json
+from datetime import date, timedelta
+from email.message import EmailMessage
+
+from cronvisio.monitor.tlsreport import TLSReportMonitor
+from fake_imap import FakeImap, FakeSessionPool
+
+
+def tls_report(
+    report_id: str, reporter: str, domain: str, successful: int, failure: int, failure_details: int = 0
+) -> bytes:
+    msg = EmailMessage()
+    msg["Subject"] = f"Report Domain: {domain} Submitter: {reporter} Report-ID: <{report_id}>"
+    msg.set_content("TLS report")
+    report = {
+        "organization-name": reporter,
+        "contact-info": reporter,
+        "report-id": report_id,
+        "policies": [
+            {
+                "policy": {"policy-type": "sts", "policy-domain": domain},
+                "summary": {
+                    "total-successful-session-count": successful,
+                    "total-failure-session-count": failure,
+                },
+                "failure-details": [
+                    {
+                        "result-type": "certificate-expired",
+                        "sending-mta-ip": f"10.0.{no // 256}.{no % 256}",
+                        "failed-session-count": 1,
+                    }
+                    for no in range(failure_details)
+                ],
+            }
+        ],
+    }
+    msg.add_attachment(
+        gzip.compress(json.dumps(report).encode("utf-8")),
+        maintype="application",
+        subtype="tlsrpt+gzip",
+        filename=f"{report_id}.json.gz",
+    )
+    return msg.as_bytes()
+
+
+def get_monitor(imap: FakeImap, state_file) -> TLSReportMonitor:
+    return TLSReportMonitor(
+        imap_server="imap.example.com",
+        imap_user="user",
+        imap_pass="pass",
+        imap_filter='SUBJECT "Report Domain"',
+        max_age=7,
+        imap_sessions=FakeSessionPool(imap),
+        state_file=str(state_file),
+        timeseries_dir=str(state_file.parent / "timeseries"),
+    )
+
+
+def test_incremental_compute_stats(tmp_path):
+    state_file = tmp_path / "tlsreport-state"
+    imap = FakeImap()
+    imap.add(1, tls_report("r1", "google.com", "example.com", 10, 0))
+    imap.add(2, tls_report("r2", "microsoft.com", "example.com", 5, 1))
+
+    failures, stats = get_monitor(imap, state_file).compute_stats()
+    assert failures == 1
+    assert stats == {
+        "google.com": {"example.com": {"successful": 10, "failure": 0}},
+        "microsoft.com": {"example.com": {"successful": 5, "failure": 1}},
+    }
+    assert imap.fetched == [1, 2]
+    # structures and attachments are fetched with one command each
+    assert [(command, uids) for command, uids, _ in imap.commands] == [
+        ("SEARCH", [1, 2]),
+        ("FETCH", [1, 2]),
+        ("FETCH", [1, 2]),
+    ]
+
+    # only the new message is fetched in the next run
+    imap.add(3, tls_report("r3", "google.com", "example.com", 7, 2))
+    imap.commands.clear()
+    failures, stats = get_monitor(imap, state_file).compute_stats()
+    assert imap.fetched == [3]
+    assert failures == 3
+    assert stats["google.com"]["example.com"] == {"successful": 17, "failure": 2}
+
+    # no new messages
+    imap.commands.clear()
+    assert get_monitor(imap, state_file).compute_stats() == (failures, stats)
+    assert imap.fetched == []
+
+
+def test_uidvalidity_change_and_eviction(tmp_path):
+    state_file = tmp_path / "tlsreport-state"
+    imap = FakeImap()
+    imap.add(1, tls_report("r1", "google.com", "example.com", 10, 0), received=date.today() - timedelta(days=30))
+    imap.add(2, tls_report("r2", "google.com", "example.com", 5, 1))
+
+    # outdated reports are evicted from the cache
+    failures, stats = get_monitor(imap, state_file).compute_stats()
+    assert failures == 1
+    assert stats == {"google.com": {"example.com": {"successful": 5, "failure": 1}}}
+
+    # a new UIDVALIDITY invalidates the checkpoint, but cached reports are not downloaded again
+    imap.uidvalidity = 2
+    imap.add(3, tls_report("r3", "google.com", "example.com", 1, 0))
+    imap.commands.clear()
+    failures, stats = get_monitor(imap, state_file).compute_stats()
+    assert imap.fetched == [1, 3]
+    assert stats == {"google.com": {"example.com": {"successful": 6, "failure": 1}}}
+
+
+def test_duplicate_reports(tmp_path):
+    state_file = tmp_path / "tlsreport-state"
+    imap = FakeImap()
+    imap.add(1, tls_report("r1", "google.com", "example.com", 10, 2))
+    imap.add(2, tls_report("r1", "google.com", "example.com", 10, 2))
+    failures, stats = get_monitor(imap, state_file).compute_stats()
+    assert failures == 2
+    assert stats == {"google.com": {"example.com": {"successful": 10, "failure": 2}}}
+
+    # a resent report is neither downloaded nor counted again
+    imap.add(3, tls_report("r1", "google.com", "example.com", 10, 2))
+    imap.commands.clear()
+    assert get_monitor(imap, state_file).compute_stats() == (failures, stats)
+    assert imap.fetched == []
+
+
+def test_format_statistics(tmp_path):
+    imap = FakeImap()
+    imap.add(1, tls_report("r1", "google.com", "example.com", 10, 0))
+    monitor = get_monitor(imap, tmp_path / "state")
+    assert "- example.com: successful: 10, failure: 0" in monitor.notify()
+    assert monitor.timeseries.last("tlsreport.example.com.successful", 5)[0].value == 10
+    assert monitor.timeseries.last("tlsreport.example.com.failure", 5)[0].value == 0
+
+
+def test_streamed_large_report(tmp_path):
+    imap = FakeImap()
+    imap.add(1, tls_report("r1", "google.com", "example.com", 10, 2, failure_details=5000))
+    imap.add(2, tls_report("r2", "google.com", "example.org", 3, 0))
+    monitor = get_monitor(imap, tmp_path / "state")
+    monitor.buffer_size = 4096
+
+    failures, stats = monitor.compute_stats()
+    assert failures == 2
+    assert stats == {
+        "google.com": {
+            "example.com": {"successful": 10, "failure": 2},
+            "example.org": {"successful": 3, "failure": 0},
+        }
+    }
+    # the large attachment has been fetched in partial chunks
+    partial_fetches = [items for command, uids, items in imap.commands if "<" in items]
+    assert len(partial_fetches) > 1
+    assert all(uids == [1] for command, uids, items in imap.commands if "<" in items)
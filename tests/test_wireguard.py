@@ -1,14 +1,25 @@
 import ipaddress
+import re
+import socket
+import struct
 from os.path import dirname
 from pathlib import Path
+from subprocess import CalledProcessError
+from threading import Event
+from time import monotonic, time
 from unittest.mock import MagicMock, patch
 
 from cronvisio.monitor.wireguard import (
     DEFAULT_TIMEOUT,
+    WGPEER_A_ENDPOINT,
+    WGPEER_A_LAST_HANDSHAKE_TIME,
+    WGPEER_A_PUBLIC_KEY,
     EndPoint,
+    PeerStatus,
     WireGuardInterface,
     WireguardMonitor,
 )
+from cronvisio.netlink import encode_attribute
 
 WIREGUARD_CONFIG_DIR = Path(dirname(__file__)) / "data" / "wireguard"
 
@@ -41,11 +52,77 @@ def test_wireguard_cronvisio():
 
 
 def test_read_wg_status_server_and_client_config():
-    output = (WIREGUARD_CONFIG_DIR / "wg-show-output1.txt").read_text()
-    with patch("subprocess.run") as mock_subprocess_run:
+    output = (WIREGUARD_CONFIG_DIR / "wg-show-dump.txt").read_text()
+    with (
+        patch("subprocess.run") as mock_subprocess_run,
+        patch.object(WireguardMonitor, "read_peer_status_netlink", side_effect=OSError("no netlink")),
+    ):
         mock_subprocess_run.return_value = MagicMock(stdout=output)
         delta = WireguardMonitor.time_since_last_handshake(interface="wg-client")
         assert delta > 1000
+        assert WireguardMonitor.time_since_last_handshake(interface="wg-unknown") is None
+
+
+def test_read_peer_status_dump():
+    output = (WIREGUARD_CONFIG_DIR / "wg-show-dump.txt").read_text()
+    with patch("subprocess.run") as mock_subprocess_run:
+        mock_subprocess_run.return_value = MagicMock(stdout=output)
+        status = WireguardMonitor.read_peer_status_dump("ns1")
+
+    assert mock_subprocess_run.call_args.args[0] == ("ip", "netns", "exec", "ns1", "wg", "show", "all", "dump")
+    assert status == {
+        "wg-server": [
+            PeerStatus("PEER1LLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLL=", "10.1.2.3:40312", 1711296372),
+            PeerStatus("PEER2LLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLLL=", None, 0),
+        ],
+        "wg-client": [PeerStatus("kEGKz8FXNlt/MR26o8ubQKT1shy+bHyQGQRLjmJxOXE=", "[2001:db8::1]:51820", 1711302022)],
+    }
+
+
+def test_parse_netlink_peer():
+    public_key = bytes(range(32))
+    sockaddr_in = struct.pack("=H", socket.AF_INET) + (51820).to_bytes(2, "big") + bytes([10, 1, 2, 3]) + bytes(8)
+    peer = (
+        encode_attribute(WGPEER_A_PUBLIC_KEY, public_key)
+        + encode_attribute(WGPEER_A_ENDPOINT, sockaddr_in)
+        + encode_attribute(WGPEER_A_LAST_HANDSHAKE_TIME, struct.pack("=qq", 1711302022, 500))
+    )
+    assert WireguardMonitor.parse_netlink_peer(peer) == PeerStatus(
+        "AAECAwQFBgcICQoLDA0ODxAREhMUFRYXGBkaGxwdHh8=", "10.1.2.3:51820", 1711302022
+    )
+
+    sockaddr_in6 = (
+        struct.pack("=H", socket.AF_INET6)
+        + (443).to_bytes(2, "big")
+        + bytes(4)
+        + socket.inet_pton(socket.AF_INET6, "2001:db8::1")
+        + bytes(4)
+    )
+    assert WireguardMonitor.parse_sockaddr(sockaddr_in6) == "[2001:db8::1]:443"
+
+
+def test_collect_peer_status_per_namespace():
+    peers = {
+        "client1": [PeerStatus("KEY1=", None, 0)],
+        "client2": [PeerStatus("KEY2=", None, 0)],
+        "other": [],
+    }
+    with patch.object(WireguardMonitor, "read_peer_status", return_value=peers) as mock_read_peer_status:
+        status = WireguardMonitor.collect_peer_status([("", "client1"), ("", "client2"), ("ns2", "client1")])
+
+    # a single query per namespace
+    assert sorted(call.args for call in mock_read_peer_status.call_args_list) == [
+        ("", ["client1", "client2"]),
+        ("ns2", ["client1"]),
+    ]
+    assert set(status) == {("", "client1"), ("", "client2"), ("ns2", "client1")}
+
+
+def peer_status(latest_handshake: float) -> dict[str, list[PeerStatus]]:
+    return {
+        "client1": [PeerStatus("kEGKz8FXNlt/MR26o8ubQKT1shy+bHyQGQRLjmJxOXE=", None, int(latest_handshake))],
+        "client2": [PeerStatus("cCfEsloNFf+bEwY/W87xI7L77H+ErlItnpICl2wjlEw=", None, int(latest_handshake))],
+    }
 
 
 def test_resolve_host():
@@ -55,50 +132,59 @@ def test_resolve_host():
     assert ipaddress.ip_address(WireguardMonitor.get_ipaddress("weichselbraun.net"))
 
 
-def test_notify_handshake_ok():
-    with patch(
-        "cronvisio.monitor.wireguard.WireguardMonitor.time_since_last_handshake"
-    ) as mock_time_since_last_handshake:
-        mock_time_since_last_handshake.return_value = DEFAULT_TIMEOUT - 1
+def test_notify_handshake_ok(tmp_path):
+    with patch("cronvisio.monitor.wireguard.WireguardMonitor.read_peer_status") as mock_read_peer_status:
+        mock_read_peer_status.return_value = peer_status(time() - DEFAULT_TIMEOUT + 10)
         wg = WireguardMonitor(
             interfaces={
                 ":client1": str(WIREGUARD_CONFIG_DIR / "client1.conf"),
                 ":client2": str(WIREGUARD_CONFIG_DIR / "client2.conf"),
-            }
+            },
+            timeseries_dir=str(tmp_path),
         )
         assert wg.notify() == ""
+        assert mock_read_peer_status.call_count == 1
+    # the handshake ages are recorded
+    (sample,) = wg.timeseries.last("wireguard.:client1.handshake_age", 10)
+    assert DEFAULT_TIMEOUT - 11 <= sample.value <= DEFAULT_TIMEOUT
 
 
 def test_notify_handshake_delayed():
     with (
-        patch(
-            "cronvisio.monitor.wireguard.WireguardMonitor.time_since_last_handshake"
-        ) as mock_time_since_last_handshake,
+        patch("cronvisio.monitor.wireguard.WireguardMonitor.read_peer_status") as mock_read_peer_status,
         patch("subprocess.run") as mock_subprocess_run,
     ):
-        mock_time_since_last_handshake.return_value = DEFAULT_TIMEOUT + 1
+        mock_read_peer_status.return_value = peer_status(time() - DEFAULT_TIMEOUT - 10)
         wg = WireguardMonitor(
             interfaces={
                 ":client1": str(WIREGUARD_CONFIG_DIR / "client1.conf"),
                 "ns2:client2": str(WIREGUARD_CONFIG_DIR / "client2.conf"),
-            }
+            },
+            repair_timeout=0.5,
+            repair_backoff=0.05,
+            timeseries_dir=None,
         )
+        start = monotonic()
         assert wg.notify() == (
             "Wireguard interface :client1 hasn't responded for 3 minutes.\n"
-            "Critical: Reconnect to endpoint localhost:8888 failed.\n"
+            "Critical: Reconnect to endpoint localhost:8888 failed - no handshake within 0.5 seconds.\n"
             "Wireguard interface ns2:client2 hasn't responded for 3 minutes.\n"
-            "Critical: Reconnect to endpoint 127.0.0.1:51820 failed."
+            "Critical: Reconnect to endpoint 127.0.0.1:51820 failed - no handshake within 0.5 seconds."
         )
+        # both interfaces are repaired concurrently
+        assert monotonic() - start < 0.9
+        # one status query per namespace and backoff steps (0.05, 0.1, 0.2 and the remaining 0.15 s) per repair
+        assert mock_read_peer_status.call_count == 2 + 2 * 4
 
         # Verify that subprocess.run has been called twice with the correct arguments
-        expected_cmds = (
+        expected_cmds = {
             "wg set client1 peer kEGKz8FXNlt/MR26o8ubQKT1shy+bHyQGQRLjmJxOXE= endpoint 127.0.0.1:8888",
             "ip netns exec ns2 wg set client2 peer cCfEsloNFf+bEwY/W87xI7L77H+ErlItnpICl2wjlEw= "
             "endpoint 127.0.0.1:51820",
-        )
-        for call_args, expected_cmd in zip(mock_subprocess_run.call_args_list, expected_cmds, strict=False):
-            args, kwargs = call_args
-            assert " ".join(args[0]) == expected_cmd
+        }
+        assert {" ".join(call_args.args[0]) for call_args in mock_subprocess_run.call_args_list} == expected_cmds
+        for call_args in mock_subprocess_run.call_args_list:
+            kwargs = call_args.kwargs
             assert kwargs["check"]
             assert kwargs["capture_output"]
             assert kwargs["text"]
@@ -154,3 +240,131 @@ def test_reconnect_to_wireguard_server_with_namespace():
             f"{host}:{port}",
         )
         mock_subprocess_run.assert_called_once_with(expected_cmd, check=True, capture_output=True, text=True)
+
+
+def test_notify_reconnect_and_missing_interface():
+    with (
+        patch("cronvisio.monitor.wireguard.WireguardMonitor.read_peer_status") as mock_read_peer_status,
+        patch("subprocess.run"),
+    ):
+        # the handshake succeeds with the second check after reconnecting
+        mock_read_peer_status.side_effect = [
+            {"client1": peer_status(0)["client1"]},
+            {"client1": peer_status(0)["client1"]},
+            {"client1": peer_status(time())["client1"]},
+        ]
+        wg = WireguardMonitor(
+            interfaces={
+                ":client1": str(WIREGUARD_CONFIG_DIR / "client1.conf"),
+                ":client2": str(WIREGUARD_CONFIG_DIR / "client2.conf"),
+            },
+            repair_backoff=0.01,
+            timeseries_dir=None,
+        )
+        lines = wg.notify().split("\n")
+        assert re.fullmatch(r"Successfully reconnected to endpoint localhost:8888 after 0\.\d seconds\.", lines[1])
+        assert lines[2] == "Wireguard interface :client2 not found."
+        assert mock_read_peer_status.call_args.args == ("", ["client1"])
+
+
+def test_notify_reconnect_error():
+    with (
+        patch("cronvisio.monitor.wireguard.WireguardMonitor.read_peer_status") as mock_read_peer_status,
+        patch("subprocess.run", side_effect=CalledProcessError(1, "wg")),
+    ):
+        mock_read_peer_status.return_value = {"client1": peer_status(0)["client1"]}
+        wg = WireguardMonitor(interfaces={":client1": str(WIREGUARD_CONFIG_DIR / "client1.conf")}, timeseries_dir=None)
+        assert wg.notify().split("\n")[1] == (
+            "Critical: Reconnect to endpoint localhost:8888 failed - Command 'wg' returned non-zero exit status 1."
+        )
+
+
+def test_ipv6_endpoint(tmp_path):
+    config = tmp_path / "wg6.conf"
+    config.write_text("[Peer]\nPublicKey = KEY6=\nEndpoint = [2001:db8::1]:51820\n")
+    endpoint = WireguardMonitor.read_host_from_wl_config(str(config))
+    assert endpoint == EndPoint("2001:db8::1", 51820, "KEY6=")
+    assert str(endpoint) == "[2001:db8::1]:51820"
+
+    with patch("subprocess.run") as mock_subprocess_run:
+        WireguardMonitor.reconnect_to_wireguard_server("wg6", "", "KEY6=", "2001:db8::1", 51820)
+        assert mock_subprocess_run.call_args.args[0][-1] == "[2001:db8::1]:51820"
+
+
+def test_notify_unresolvable_endpoint():
+    resolver = MagicMock()
+    resolver.resolve_all.return_value = [None]
+    with (
+        patch("cronvisio.monitor.wireguard.WireguardMonitor.read_peer_status") as mock_read_peer_status,
+        patch("subprocess.run") as mock_subprocess_run,
+    ):
+        status = {"client1": [PeerStatus("kEGKz8FXNlt/MR26o8ubQKT1shy+bHyQGQRLjmJxOXE=", "192.0.2.1:8888", 0)]}
+        mock_read_peer_status.return_value = status
+        wg = WireguardMonitor(
+            interfaces={":client1": str(WIREGUARD_CONFIG_DIR / "client1.conf")}, resolver=resolver, timeseries_dir=None
+        )
+        assert wg.notify().split("\n")[1] == "Critical: Cannot resolve endpoint localhost:8888."
+        # the peer's current endpoint is passed to the resolver
+        resolver.resolve_all.assert_called_once_with([("localhost", "192.0.2.1")])
+        mock_subprocess_run.assert_not_called()
+
+
+def test_poll_interval():
+    wg = WireguardMonitor(interfaces={}, timeout=150)
+    # all tunnels healthy
+    assert wg.poll_interval([10, 20], min_interval=5, max_interval=60) == 60
+    # a handshake is close to timing out
+    assert wg.poll_interval([10, 130], min_interval=5, max_interval=60) == 20
+    assert wg.poll_interval([149], min_interval=5, max_interval=60) == 5
+    # frozen and missing interfaces are retried every max_interval
+    assert wg.poll_interval([200, None], min_interval=5, max_interval=60) == 60
+
+
+class CollectingNotifier:
+    def __init__(self):
+        self.messages = []
+
+    def send_notifications(self, messages):
+        self.messages.extend(messages)
+
+
+def test_watch_rate_limits_notifications():
+    failed = {":client1": ["Wireguard interface :client1 hasn't responded for 3 minutes.", "Critical: failed."]}
+    recovered = {":client1": ["Wireguard interface :client1 hasn't responded for 4 minutes.", "Successfully."]}
+    results = [failed, failed, recovered, failed, {}, failed, {}]
+    stop = Event()
+
+    def check():
+        msg = results.pop(0)
+        if not results:
+            stop.set()
+        return msg, {":client1": 200 if msg else 10}
+
+    wg = WireguardMonitor(interfaces={})
+    notifier = CollectingNotifier()
+    with patch.object(wg, "check", side_effect=check):
+        wg.watch([notifier], min_interval=0, max_interval=0, notification_interval=3600, stop=stop)
+
+    # repeated outcomes are suppressed within the notification interval, unless the interface has been healthy
+    assert notifier.messages == [
+        "\n".join(failed[":client1"]),
+        "\n".join(recovered[":client1"]),
+        "\n".join(failed[":client1"]),
+    ]
+
+
+def test_watch_survives_failing_notifiers(capsys):
+    stop = Event()
+    failing_notifier = MagicMock()
+    failing_notifier.send_notifications.side_effect = OSError("offline")
+    notifier = CollectingNotifier()
+
+    def check():
+        stop.set()
+        return {":wg0": ["not found."]}, {":wg0": None}
+
+    wg = WireguardMonitor(interfaces={})
+    with patch.object(wg, "check", side_effect=check):
+        wg.watch([failing_notifier, notifier], min_interval=0, stop=stop)
+    assert notifier.messages == ["not found."]
+    assert "offline" in capsys.readouterr().out